@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# 比较作业结束以后备份工作日志的开销
+#   原来的方式：删除旧的备份，copytree整个工作目录，完成以后才能报告作业结束
+#   新的方式：把作业的输出移到暂存目录（报告作业结束前只需要这一步），
+#             后台压缩输出，测试程序文件按照内容只保存一份
+#   python benchmark/bench_backup.py [jobs] [small_files] [big_files] [big_file_mb]
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from farm.backup import BackupStore  # noqa: E402
+from farm.workspace import Workspace  # noqa: E402
+
+
+def make_source(p_small, p_big, p_big_mb):
+    m_src = tempfile.mkdtemp(prefix='farm_bench_src_')
+    for i in range(p_small):
+        m_dir = os.path.join(m_src, 'cases_%02d' % (i % 20))
+        os.makedirs(m_dir, exist_ok=True)
+        with open(os.path.join(m_dir, 'case_%05d.robot' % i), 'w') as f:
+            f.write(('Check Case %d\n    Execute SQL    SELECT * FROM T%d\n' % (i, i)) * 40)
+    os.mkdir(os.path.join(m_src, 'data'))
+    for i in range(p_big):
+        with open(os.path.join(m_src, 'data', 'reference_%d.csv' % i), 'w') as f:
+            for j in range(p_big_mb * 16):
+                f.write(''.join('%d,%d,row %d\n' % (j, k, random.randint(0, 1 << 30)) for k in range(2800)))
+    return m_src
+
+
+# 模拟一个作业的输出：Robot Framework的结果文件和日志
+def run_fake_job(p_work, p_job_id):
+    with open(os.path.join(p_work, 'output.xml'), 'w') as f:
+        for i in range(20000):
+            f.write('<kw name="Execute SQL" library="SQLCliLibrary"><arg>SELECT %d</arg>'
+                    '<status status="PASS" starttime="20200101 00:00:%02d.%03d"/></kw>\n' % (i, i % 60, i % 1000))
+    for m_name in ('log.html', 'report.html'):
+        with open(os.path.join(p_work, m_name), 'w') as f:
+            f.write('<html>job %d</html>\n' % p_job_id * 20000)
+    with open(os.path.join(p_work, 'test.tlg'), 'w') as f:
+        f.write('line of output\n' * 5000)
+
+
+def disk_usage(p_directory):
+    m_Total = 0
+    for m_root, m_dirs, m_files in os.walk(p_directory):
+        for m_name in m_files:
+            m_Total = m_Total + os.path.getsize(os.path.join(m_root, m_name))
+    return m_Total
+
+
+if __name__ == '__main__':
+    m_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    m_small = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    m_big = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    m_big_mb = int(sys.argv[4]) if len(sys.argv) > 4 else 32
+    m_src = make_source(m_small, m_big, m_big_mb)
+    print('jobs: %d, source: %d small files, %d x %d MB' % (m_jobs, m_small, m_big, m_big_mb))
+
+    m_Results = {'copytree, before finish_job': [], 'stage, before finish_job': [], 'archive, in background': []}
+    m_work = tempfile.mkdtemp(prefix='farm_bench_work_')
+    m_backup = tempfile.mkdtemp(prefix='farm_bench_backup_')
+    m_Workspace = Workspace(m_work)
+    for m_JobID in range(m_jobs):
+        m_Workspace.sync(m_src)
+        run_fake_job(m_work, m_JobID)
+        m_start = time.perf_counter()
+        m_backup_directory = os.path.join(m_backup, str(m_JobID))
+        if os.path.exists(m_backup_directory):
+            shutil.rmtree(m_backup_directory)
+        shutil.copytree(m_work, m_backup_directory, ignore=shutil.ignore_patterns(*Workspace.SKIP))
+        m_Results['copytree, before finish_job'].append(time.perf_counter() - m_start)
+    m_CopyTreeBytes = disk_usage(m_backup)
+    m_LastCopy = os.path.join(m_backup, str(m_jobs - 1))
+
+    m_work = tempfile.mkdtemp(prefix='farm_bench_work_')
+    m_backup = tempfile.mkdtemp(prefix='farm_bench_backup_')
+    m_Workspace = Workspace(m_work)
+    m_Store = BackupStore(m_backup)
+    for m_JobID in range(m_jobs):
+        m_Workspace.sync(m_src)
+        run_fake_job(m_work, m_JobID)
+        m_start = time.perf_counter()
+        m_Staging = m_Workspace.stage(m_JobID)
+        m_Results['stage, before finish_job'].append(time.perf_counter() - m_start)
+        m_start = time.perf_counter()
+        m_Store.write(m_JobID, m_Staging)
+        m_Results['archive, in background'].append(time.perf_counter() - m_start)
+    m_StoreBytes = disk_usage(m_backup)
+
+    # 第一个作业需要保存测试程序文件，单独列出
+    print('%-36s %12s %12s' % ('', 'first job ms', 'later ms/job'))
+    for m_Name, m_Times in m_Results.items():
+        print('%-36s %12.1f %12.1f' % (m_Name, m_Times[0] * 1000, sum(m_Times[1:]) * 1000 / max(len(m_Times) - 1, 1)))
+    print('%-36s %12s' % ('', 'MB on disk'))
+    print('%-36s %12.1f' % ('copytree', m_CopyTreeBytes / 1048576.0))
+    print('%-36s %12.1f' % ('archive + shared objects', m_StoreBytes / 1048576.0))
+
+    # 恢复出来的内容和copytree的备份一致
+    m_restore = tempfile.mkdtemp(prefix='farm_bench_restore_')
+    m_Store.restore(m_jobs - 1, m_restore)
+    for m_root, m_dirs, m_files in os.walk(m_LastCopy):
+        for m_name in m_files:
+            m_path = os.path.join(m_root, m_name)
+            with open(m_path, 'rb') as f1, open(os.path.join(m_restore, os.path.relpath(m_path, m_LastCopy)), 'rb') as f2:
+                assert f1.read() == f2.read(), m_path
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# 一个有多个空闲位置的Worker取满位置的速度
+#   旧的方式：每个位置一个get_todo_job，逐个调用或者放在一个批量调用中，每个作业一个事务
+#   新的方式：一个claim_jobs取出最多N个作业，所有作业在一个事务中标记为WORKING
+#   python benchmark/bench_claim_jobs.py [jobs]
+import sys
+import time
+from multiprocessing.connection import Client
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server
+from farm.main import RPCProxy
+
+WORKER = dict(p_worker_user_name='bench', p_os_pid='1', p_machine_name='bench',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+# 每个位置逐个调用get_todo_job
+def get_todo_sequential(proxy, p_slots):
+    m_Count = 0
+    for i in range(p_slots):
+        if proxy.get_todo_job(**WORKER)['Result']:
+            m_Count = m_Count + 1
+    return m_Count
+
+
+# 每个位置一个get_todo_job，放在一个批量调用中（原来WorkerDaemon的做法）
+def get_todo_batched(proxy, p_slots):
+    with proxy.batch() as b:
+        m_Futures = [b.get_todo_job(**WORKER) for i in range(p_slots)]
+    return sum(1 for m_Future in m_Futures if m_Future.result()['Result'])
+
+
+# 一个claim_jobs取满所有的位置
+def claim_jobs(proxy, p_slots):
+    m_Result = proxy.claim_jobs(p_max_jobs=p_slots, **WORKER)
+    assert m_Result['Result'], m_Result
+    return len(m_Result['Rows'])
+
+
+# 一直取作业直到队列为空，返回每秒取到的作业数量
+def run(p_func, p_slots, p_jobs):
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', p_jobs)
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+    m_handler.submit_job('bench', 'bench_regress', 'bench', '')
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_JOBS(ID, TASK_ID, REGRESS_NAME, LABEL_NAME, STATUS) "
+                           "VALUES(?, 1, 'bench_regress', 'bench', 'NEW')", [(i, ) for i in range(2, p_jobs + 1)])
+        m_conn.execute("UPDATE FARM_TASKS SET TOTAL_JOBS = ? WHERE ID = 1", (p_jobs, ))
+    m_handler.scheduler.push('bench', range(2, p_jobs + 1))
+    m_port = start_rpc_server([m_handler.get_todo_job, m_handler.claim_jobs], m_handler.batch_transaction)
+    c = Client(('localhost', m_port), authkey=b'welcome')
+    proxy = RPCProxy(c)
+
+    m_Claimed = 0
+    m_start = time.perf_counter()
+    while m_Claimed < p_jobs:
+        m_Count = p_func(proxy, p_slots)
+        assert m_Count > 0
+        m_Claimed = m_Claimed + m_Count
+    m_elapsed = time.perf_counter() - m_start
+    c.close()
+
+    m_conn = m_handler.db.reader()
+    m_Working = m_conn.query_one("SELECT COUNT(*) FROM FARM_JOBS WHERE STATUS = 'WORKING'")[0]
+    m_Running = m_conn.query_one("SELECT RUNNING_JOBS FROM FARM_TASKS WHERE ID = 1")[0]
+    m_handler.disconnect_config_db()
+    assert m_Working == m_Running == p_jobs, (m_Working, m_Running)
+    return p_jobs / m_elapsed
+
+
+if __name__ == '__main__':
+    m_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    print('jobs: %d' % m_jobs)
+    print('%-40s %12s %12s %12s' % ('claims/sec, slots per request', '1', '8', '64'))
+    for m_Name, m_Func in (('get_todo_job per slot, sequential', get_todo_sequential),
+                           ('get_todo_job per slot, batched (before)', get_todo_batched),
+                           ('claim_jobs (after)', claim_jobs)):
+        print('%-40s %12.0f %12.0f %12.0f' % ((m_Name, ) + tuple(run(m_Func, m_Slots, m_jobs)
+                                                                  for m_Slots in (1, 8, 64))))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# 有依赖关系的套件的完成时间（makespan）
+#   套件由几条流水线（准备数据 -> 多个测试 -> 清理）和一条很长的依赖链组成
+#   分阶段提交：按照依赖关系分成几个阶段，一个阶段全部完成以后再提交下一个阶段（原来的做法），
+#               每次提交之前有一段反应时间（人工或者CI轮询）
+#   依赖关系，先进先出：整个套件一次提交，前置作业完成时马上释放，释放的作业按照编号排队
+#   依赖关系，关键路径优先：同上，关键路径长的作业先派发（新的方式）
+#   派发使用真实的FarmHandler（submit_job、claim_jobs、finish_job），作业的运行用模拟的时钟代替
+#   python benchmark/bench_dependencies.py [pipelines] [tests] [chain] [workers] [reaction_seconds]
+import heapq
+import random
+import sys
+
+from benchutil import create_farm_home, open_farm_handler
+
+WORKER = dict(p_worker_user_name='bench', p_os_pid='1', p_machine_name='bench',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+# 生成回归测试的运行时间和依赖关系[(回归测试, 它依赖的回归测试)]，回归测试按照编写的顺序排列
+def workload(p_pipelines, p_tests, p_chain, p_seed=0):
+    m_Random = random.Random(p_seed)
+    m_Durations = {}
+    m_Edges = []
+    for p in range(p_pipelines):
+        m_Setup, m_Cleanup = 'setup_%d' % p, 'cleanup_%d' % p
+        m_Durations[m_Setup] = 300.0
+        for t in range(p_tests):
+            m_Test = 'test_%d_%03d' % (p, t)
+            m_Durations[m_Test] = m_Random.lognormvariate(5.3, 0.6)
+            m_Edges.append((m_Test, m_Setup))
+            m_Edges.append((m_Cleanup, m_Test))
+        m_Durations[m_Cleanup] = 120.0
+    for c in range(p_chain):
+        m_Durations['chain_%02d' % c] = 600.0
+        if c > 0:
+            m_Edges.append(('chain_%02d' % c, 'chain_%02d' % (c - 1)))
+    return m_Durations, m_Edges
+
+
+# 每个回归测试的阶段：依赖的回归测试中最大的阶段加一
+def levels(p_durations, p_edges):
+    m_Level = dict.fromkeys(p_durations, 0)
+    m_Changed = True
+    while m_Changed:
+        m_Changed = False
+        for m_Name, m_DependsOn in p_edges:
+            if m_Level[m_Name] <= m_Level[m_DependsOn]:
+                m_Level[m_Name] = m_Level[m_DependsOn] + 1
+                m_Changed = True
+    return m_Level
+
+
+# 关键路径长度的下界和总工作量的下界
+def lower_bound(p_durations, p_edges, p_workers):
+    m_Finish = {}
+    m_Level = levels(p_durations, p_edges)
+    for m_Name in sorted(p_durations, key=lambda name: m_Level[name]):
+        m_Finish[m_Name] = p_durations[m_Name] + max([m_Finish[m_DependsOn] for m_Job, m_DependsOn in p_edges
+                                                      if m_Job == m_Name] or [0.0])
+    return max(max(m_Finish.values()), sum(p_durations.values()) / p_workers)
+
+
+# 模拟运行一次，p_mode为staged、fifo或者critical，返回所有作业完成的时间
+def simulate(p_durations, p_edges, p_workers, p_reaction, p_mode):
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', p_workers)
+    m_Level = levels(p_durations, p_edges)
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                           "VALUES(?, 'main.robot', 86400, 'RF')", [(m_Name, ) for m_Name in p_durations])
+        if p_mode == 'staged':
+            m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES(?, ?)",
+                               [('level_%d' % m_Level[m_Name], m_Name) for m_Name in p_durations])
+        else:
+            m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES('dag', ?)",
+                               [(m_Name, ) for m_Name in p_durations])
+    if p_mode != 'staged':
+        for m_Name, m_DependsOn in p_edges:
+            assert m_handler.add_suite_dependency('dag', m_Name, m_DependsOn)['Result']
+    m_handler.durations.load((m_Name, 'bench', m_Seconds) for m_Name, m_Seconds in p_durations.items())
+    # 服务端按照真实的开始和完成时间记录运行时间，模拟的时钟下不记录
+    m_handler.record_duration = lambda *args: None
+    if p_mode == 'fifo':
+        # 不考虑关键路径，所有作业按照编号排队
+        m_Push = m_handler.scheduler.push
+        m_handler.scheduler.push = lambda p_label_name, p_job_ids, p_priority=0, p_user_name=None, \
+            p_task_id=None, *args: m_Push(p_label_name, sorted(p_job_ids), p_priority, p_user_name, p_task_id)
+
+    m_Clock = 0.0
+    m_Running = []
+    if p_mode == 'staged':
+        m_Stages = ['level_%d' % i for i in range(max(m_Level.values()) + 1)]
+        m_Pending = [(0.0, m_Stages.pop(0))]
+    else:
+        m_Pending = [(0.0, 'dag')]
+    while m_Pending or m_Running:
+        # 下一个事件：提交一个套件或者一个作业完成
+        if m_Pending and (not m_Running or m_Pending[0][0] <= m_Running[0][0]):
+            m_Clock, m_Suite = m_Pending.pop(0)
+            assert m_handler.submit_job('bench', m_Suite, 'bench', '')['Result']
+        else:
+            m_Clock, m_JobID = heapq.heappop(m_Running)
+            assert m_handler.finish_job(m_JobID, 'COMPLETED', '')['Result']
+            # 一个阶段全部完成，经过反应时间以后提交下一个阶段
+            if p_mode == 'staged' and not m_Running and m_Stages:
+                m_Pending.append((m_Clock + p_reaction, m_Stages.pop(0)))
+        if len(m_Running) < p_workers:
+            m_Result = m_handler.claim_jobs(p_max_jobs=p_workers - len(m_Running), **WORKER)
+            for m_Row in m_Result['Rows']:
+                m_Job = dict(zip(m_Result['Columns'], m_Row))
+                heapq.heappush(m_Running, (m_Clock + p_durations[m_Job['REGRESS_NAME']], m_Job['ID']))
+    m_conn = m_handler.db.reader()
+    m_Status = dict(m_conn.query_all("SELECT STATUS, COUNT(*) FROM FARM_JOBS GROUP BY STATUS"))
+    m_handler.disconnect_config_db()
+    assert m_Status == {'COMPLETED': len(p_durations)}, m_Status
+    return m_Clock
+
+
+if __name__ == '__main__':
+    m_pipelines = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    m_tests = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    m_chain = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    m_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+    m_reaction = float(sys.argv[5]) if len(sys.argv) > 5 else 300.0
+
+    m_Durations, m_Edges = workload(m_pipelines, m_tests, m_chain)
+    m_Bound = lower_bound(m_Durations, m_Edges, m_workers)
+    print('%d pipelines (setup -> %d tests -> cleanup) + a chain of %d x 600s, %d workers, '
+          'staged reaction %.0fs' % (m_pipelines, m_tests, m_chain, m_workers, m_reaction))
+    print('%-44s %14s %10s' % ('', 'makespan (h)', 'vs bound'))
+    print('%-44s %14.2f %10.2f' % ('lower bound max(critical path, work/workers)', m_Bound / 3600, 1.0))
+    for m_Name, m_Mode in (('staged submission (before)', 'staged'),
+                           ('dependencies, FIFO release', 'fifo'),
+                           ('dependencies, critical path first (after)', 'critical')):
+        m_Makespan = simulate(m_Durations, m_Edges, m_workers, m_reaction, m_Mode)
+        print('%-44s %14.2f %10.2f' % (m_Name, m_Makespan / 3600, m_Makespan / m_Bound))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# 在有大量历史作业的情况下，比较三表关联查询派发（旧的方式）和等待队列派发的耗时
+#   python benchmark/bench_dispatch_history.py [history] [ready]
+import os
+import sqlite3
+import sys
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+
+LEGACY_SQL = "SELECT R.MAIN_ENTRY, R.REGRESS_TYPE, " \
+             "       J.ID, J.REGRESS_NAME, J.LABEL_NAME, L.PROPERTIES, " \
+             "       R.LIMIT_TIME, J.TASK_ID, J.REGRESS_OPTIONS " \
+             "FROM   FARM_LABEL L, FARM_JOBS J, FARM_REGRESS R " \
+             "WHERE  L.NAME = J.LABEL_NAME AND R.NAME = J.REGRESS_NAME " \
+             "AND    L.CURRENT_USED < L.LABEL_CAPACITY AND J.STATUS = 'NEW' " \
+             "LIMIT 1"
+
+
+def build_history(p_home, p_history, p_ready):
+    m_conn = sqlite3.connect(os.path.join(p_home, 'db', 'farm.db'))
+    m_conn.execute("INSERT INTO FARM_LABEL(NAME, PROPERTIES, LABEL_CAPACITY, CURRENT_USED) "
+                   "VALUES('bench', 'A=1', 1000000, 0)")
+    m_conn.execute("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                   "VALUES('bench_regress', 'main.robot', 60, 'RF')")
+    m_conn.execute("INSERT INTO FARM_TASKS(ID, SUITE_OR_REGRESS_NAME, LABEL_NAME, RUNNING_JOBS, COMPLETED_JOBS) "
+                   "VALUES(1, 'bench_regress', 'bench', 0, 0)")
+    m_conn.executemany("INSERT INTO FARM_JOBS(ID, TASK_ID, REGRESS_NAME, LABEL_NAME, STATUS) "
+                       "VALUES(?, 1, 'bench_regress', 'bench', ?)",
+                       ((i, 'COMPLETED' if i <= p_history else 'NEW') for i in range(1, p_history + p_ready + 1)))
+    m_conn.commit()
+    return m_conn
+
+
+if __name__ == '__main__':
+    m_history = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    m_ready = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    m_home = create_farm_home()
+    m_conn = build_history(m_home, m_history, m_ready)
+
+    # 旧的方式：没有状态索引，每次派发都要扫描作业历史
+    m_conn.execute("DROP INDEX IDX_FARM_JOBS_STATUS")
+    m_nLegacy = min(m_ready, 50)
+    m_start = time.perf_counter()
+    for i in range(m_nLegacy):
+        row = m_conn.execute(LEGACY_SQL).fetchone()
+        m_conn.execute("UPDATE FARM_JOBS SET STATUS = 'WORKING' WHERE ID = ?", (row[2],))
+    m_before = (time.perf_counter() - m_start) / m_nLegacy
+    m_conn.rollback()
+    m_conn.close()
+
+    # 新的方式：启动时通过索引重建队列，派发只和等待执行的作业有关
+    m_start = time.perf_counter()
+    m_handler = open_farm_handler(m_home)
+    m_startup = time.perf_counter() - m_start
+    m_start = time.perf_counter()
+    for i in range(m_ready):
+        m_Result = m_handler.get_todo_job('bench', '1', 'localhost', '/tmp', '/tmp')
+        assert m_Result['Result'], m_Result
+    m_after = (time.perf_counter() - m_start) / m_ready
+    m_handler.disconnect_config_db()
+
+    print('history jobs: %d, ready jobs: %d' % (m_history, m_ready))
+    print('%-32s %10.3f ms' % ('full scan dispatch (before)', m_before * 1000))
+    print('%-32s %10.3f ms' % ('ready queue dispatch (after)', m_after * 1000))
+    print('%-32s %10.3f ms' % ('startup rebuild (index + queue)', m_startup * 1000))
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# 多个用户共用一组资源时，每个用户的作业等待派发的时间
+#   alice一开始提交一个很大的套件，bob和carol不断地提交只有几个作业的小任务，dave偶尔提交一个高优先级的任务
+#   旧的方式：一个资源标签上只有一个先进先出的队列
+#   新的方式：按照优先级派发，优先级相同时用户之间、任务之间按照预计运行时间公平分配
+#   派发使用真实的FarmHandler（submit_job、claim_jobs、finish_job），作业的运行用模拟的时钟代替
+#   另外单独测量一次派发决定（FairQueue.popleft）的时间随用户和任务数量的变化
+#   python benchmark/bench_fair_share.py [suite_jobs] [workers] [hours]
+import heapq
+import random
+import sys
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+from farm.scheduler import FairQueue
+
+WORKER = dict(p_worker_user_name='bench', p_os_pid='1', p_machine_name='bench',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+# 生成回归测试的运行时间和所有的提交(提交时间, 用户, 套件, 优先级)
+def workload(p_suite_jobs, p_hours, p_seed=0):
+    m_Random = random.Random(p_seed)
+    m_Suites = {'big_suite': ['big_%05d' % i for i in range(p_suite_jobs)],
+                'quick_check': ['quick_%d' % i for i in range(5)],
+                'hotfix': ['hotfix_0']}
+    m_Durations = dict((m_Name, m_Random.lognormvariate(5.5, 0.8)) for m_Name in m_Suites['big_suite'])
+    m_Durations.update((m_Name, m_Random.uniform(30, 120)) for m_Name in m_Suites['quick_check'])
+    m_Durations['hotfix_0'] = 300.0
+    m_Submits = [(0.0, 'alice', 'big_suite', 0)]
+    for m_User, m_Interval in (('bob', 1800.0), ('carol', 2400.0)):
+        m_Time = m_Random.expovariate(1 / m_Interval)
+        while m_Time < p_hours * 3600:
+            m_Submits.append((m_Time, m_User, 'quick_check', 0))
+            m_Time = m_Time + m_Random.expovariate(1 / m_Interval)
+    for i in range(1, int(p_hours / 3) + 1):
+        m_Submits.append((i * 3 * 3600.0, 'dave', 'hotfix', 10))
+    return m_Suites, m_Durations, sorted(m_Submits)
+
+
+# 模拟运行，返回每个用户的作业等待派发的秒数
+def simulate(p_suites, p_durations, p_submits, p_workers, p_fair):
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', p_workers)
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                           "VALUES(?, 'main.robot', 86400, 'RF')", [(m_Name, ) for m_Name in p_durations])
+        for m_Suite, m_Names in p_suites.items():
+            m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES(?, ?)",
+                               [(m_Suite, m_Name) for m_Name in m_Names])
+    m_handler.durations.load((m_Name, 'bench', m_Seconds) for m_Name, m_Seconds in p_durations.items())
+    if not p_fair:
+        # 原来的做法：所有的作业按照提交的顺序放在一个队列中
+        m_Push = m_handler.scheduler.push
+        m_handler.scheduler.push = lambda p_label_name, p_job_ids, *args: m_Push(p_label_name, p_job_ids)
+
+    m_Clock = 0.0
+    m_Running = []
+    m_Tasks = {}
+    m_Waits = {}
+    m_Next = 0
+    while m_Next < len(p_submits) or m_Running:
+        # 下一个事件：提交一个任务或者一个作业完成
+        if m_Next < len(p_submits) and (not m_Running or p_submits[m_Next][0] <= m_Running[0][0]):
+            m_Clock, m_User, m_Suite, m_Priority = p_submits[m_Next]
+            m_Next = m_Next + 1
+            m_Result = m_handler.submit_job('bench', m_Suite, m_User, '', m_Priority)
+            m_Tasks[str(m_Result['JobID'])] = (m_Clock, m_User)
+        else:
+            m_Clock, m_JobID = heapq.heappop(m_Running)
+            assert m_handler.finish_job(m_JobID, 'COMPLETED', '')['Result']
+        if len(m_Running) < p_workers:
+            m_Result = m_handler.claim_jobs(p_max_jobs=p_workers - len(m_Running), **WORKER)
+            for m_Row in m_Result['Rows']:
+                m_Job = dict(zip(m_Result['Columns'], m_Row))
+                m_Submitted, m_User = m_Tasks[m_Job['TASK_ID']]
+                m_Waits.setdefault(m_User, []).append(m_Clock - m_Submitted)
+                heapq.heappush(m_Running, (m_Clock + p_durations[m_Job['REGRESS_NAME']], m_Job['ID']))
+    m_handler.disconnect_config_db()
+    return m_Waits
+
+
+def percentile(p_values, p_percent):
+    m_Values = sorted(p_values)
+    return m_Values[min(len(m_Values) - 1, int(len(m_Values) * p_percent / 100))]
+
+
+# 一次派发决定的时间，p_users个用户每人p_tasks个任务，每个任务p_jobs个作业
+def decision_cost(p_users, p_tasks, p_jobs):
+    m_Queue = FairQueue()
+    for t in range(p_tasks):
+        for u in range(p_users):
+            for j in range(p_jobs):
+                m_Queue.append((u, t, j), (0, u, (u, t), 1.0 + j, 0.0))
+    m_Count = len(m_Queue)
+    m_start = time.perf_counter()
+    while len(m_Queue) > 0:
+        m_Queue.popleft()
+    return (time.perf_counter() - m_start) / m_Count
+
+
+if __name__ == '__main__':
+    m_suite_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    m_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    m_hours = float(sys.argv[3]) if len(sys.argv) > 3 else 12
+
+    m_Suites, m_Durations, m_Submits = workload(m_suite_jobs, m_hours)
+    print('%d workers; alice submits %d jobs at 0, bob/carol submit 5 job checks, dave a priority 10 hotfix '
+          'every 3h, for %.0fh' % (m_workers, m_suite_jobs, m_hours))
+    print('%-24s %-8s %8s %12s %12s %12s' % ('wait before dispatch', 'user', 'jobs', 'p50 (min)', 'p90 (min)',
+                                             'p99 (min)'))
+    for m_Name, m_Fair in (('FIFO (before)', False), ('fair share (after)', True)):
+        m_Waits = simulate(m_Suites, m_Durations, m_Submits, m_workers, m_Fair)
+        for m_User in ('alice', 'bob', 'carol', 'dave'):
+            m_Values = m_Waits.get(m_User, [0.0])
+            print('%-24s %-8s %8d %12.1f %12.1f %12.1f' % (m_Name, m_User, len(m_Values),
+                                                           percentile(m_Values, 50) / 60,
+                                                           percentile(m_Values, 90) / 60,
+                                                           percentile(m_Values, 99) / 60))
+
+    print('')
+    print('%-40s %14s' % ('FairQueue.popleft, users x tasks', 'us/decision'))
+    for m_Users, m_Tasks in ((10, 10), (100, 100), (1000, 100)):
+        print('%-40s %14.2f' % ('%d x %d' % (m_Users, m_Tasks), decision_cost(m_Users, m_Tasks, 2) * 1e6))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# 一个套件在一组相同用途的资源（例如几个相同的数据库）上的完成时间（makespan）
+#   固定资源：整个套件提交到一个资源标签上（原来的做法）
+#   静态拆分：套件拆成几份，分别提交到每个资源标签上
+#   资源标签组：整个套件提交到资源标签组，作业在派发时绑定到空闲容量最多的资源标签（新的方式）
+#   其中一个资源比其他的慢，同样的作业需要更长的时间
+#   派发使用真实的FarmHandler（submit_job、claim_jobs、finish_job），作业的运行用模拟的时钟代替
+#   python benchmark/bench_label_group.py [regressions] [labels] [capacity] [slow_factor]
+import heapq
+import random
+import sys
+
+from benchutil import create_farm_home, open_farm_handler
+
+WORKER = dict(p_worker_user_name='bench', p_os_pid='1', p_machine_name='bench',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+# 模拟运行一次套件，p_suites为[(提交到的资源标签或者资源标签组, [回归测试, ...])]
+#   返回所有作业完成的时间和每个资源标签上运行的作业数量
+def simulate(p_durations, p_speeds, p_capacity, p_suites, p_group=False):
+    m_handler = open_farm_handler(create_farm_home())
+    for m_LabelName in p_speeds:
+        m_handler.create_label(m_LabelName, 'A=1', p_capacity)
+    if p_group:
+        m_handler.create_label_group('pool')
+        for m_LabelName in p_speeds:
+            assert m_handler.update_label_group('pool', m_LabelName)['Result']
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                           "VALUES(?, 'main.robot', 86400, 'RF')", [(m_Name, ) for m_Name in p_durations])
+        for i, (m_Target, m_Names) in enumerate(p_suites):
+            m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES(?, ?)",
+                               [('suite_%d' % i, m_Name) for m_Name in m_Names])
+    for i, (m_Target, m_Names) in enumerate(p_suites):
+        assert m_handler.submit_job(m_Target, 'suite_%d' % i, 'bench', '')['Result']
+
+    m_Clock = 0.0
+    m_Running = []
+    m_Jobs = dict((m_LabelName, 0) for m_LabelName in p_speeds)
+    while True:
+        m_Result = m_handler.claim_jobs(p_max_jobs=len(p_durations), **WORKER)
+        for m_Row in m_Result['Rows']:
+            m_Job = dict(zip(m_Result['Columns'], m_Row))
+            m_Seconds = p_durations[m_Job['REGRESS_NAME']] * p_speeds[m_Job['LABEL_NAME']]
+            heapq.heappush(m_Running, (m_Clock + m_Seconds, m_Job['ID'], m_Job['LABEL_NAME'],
+                                       m_Seconds, p_durations[m_Job['REGRESS_NAME']]))
+            m_Jobs[m_Job['LABEL_NAME']] = m_Jobs[m_Job['LABEL_NAME']] + 1
+        if not m_Running:
+            break
+        m_Clock, m_JobID, m_LabelName, m_Seconds, m_Expected = heapq.heappop(m_Running)
+        assert m_handler.finish_job(m_JobID, 'COMPLETED', '')['Result']
+        # 服务端按照真实的开始和完成时间记录，模拟的时钟需要直接告诉调度器
+        m_handler.scheduler.record_latency(m_LabelName, m_Seconds, m_Expected)
+    m_handler.disconnect_config_db()
+    return m_Clock, [m_Jobs[m_LabelName] for m_LabelName in p_speeds]
+
+
+if __name__ == '__main__':
+    m_regressions = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    m_labels = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    m_capacity = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    m_slow = float(sys.argv[4]) if len(sys.argv) > 4 else 2.0
+
+    m_Random = random.Random(0)
+    m_Durations = dict(('regress_%04d' % i, m_Random.lognormvariate(5.5, 1.0)) for i in range(m_regressions))
+    m_Names = list(m_Durations)
+    m_Speeds = dict(('db_%d' % i, m_slow if i == m_labels - 1 else 1.0) for i in range(m_labels))
+    m_LabelNames = list(m_Speeds)
+    m_Bound = sum(m_Durations.values()) / sum(m_capacity / m_Speed for m_Speed in m_Speeds.values())
+
+    print('%d regressions, %d labels x capacity %d, last label %.1fx slower' %
+          (m_regressions, m_labels, m_capacity, m_slow))
+    print('%-36s %14s %10s   %s' % ('', 'makespan (h)', 'vs bound', 'jobs per label'))
+    print('%-36s %14.2f %10.2f' % ('lower bound total/pool throughput', m_Bound / 3600, 1.0))
+    for m_Name, m_Suites, m_Group in (
+            ('one label (before)', [(m_LabelNames[0], m_Names)], False),
+            ('static split across labels', [(m_LabelName, m_Names[i::m_labels])
+                                            for i, m_LabelName in enumerate(m_LabelNames)], False),
+            ('label group (after)', [('pool', m_Names)], True)):
+        m_Makespan, m_Jobs = simulate(m_Durations, m_Speeds, m_capacity, m_Suites, m_Group)
+        print('%-36s %14.2f %10.2f   %s' % (m_Name, m_Makespan / 3600, m_Makespan / m_Bound,
+                                          ' '.join(str(m_Count) for m_Count in m_Jobs)))
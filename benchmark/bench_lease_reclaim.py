@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Worker丢失以后作业多快被回收，以及租约在作业很多时的开销
+#   回收：一半的Worker停止发送心跳（模拟崩溃），统计租约到期以后多久作业回到等待队列，
+#         同时检查还在发送心跳的Worker的作业没有被回收
+#   开销：对比租约放在内存中的小顶堆里（新的方式）和放在FARM_JOBS的一个列中、回收线程定时扫描
+#         （另一种常见的做法）时，一次心跳和一次检查需要的时间
+#   python benchmark/bench_lease_reclaim.py [jobs] [history] [lease_seconds]
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+
+
+def dispatch(p_handler, p_jobs, p_workers):
+    m_Jobs = {}
+    for i in range(p_jobs):
+        m_Worker = 'worker_%d' % (i % p_workers)
+        m_Result = p_handler.get_todo_job('bench', '1', m_Worker, '/tmp', '/tmp')
+        assert m_Result['Result'], m_Result
+        m_Jobs.setdefault(m_Worker, []).append(int(m_Result['ID']))
+    return m_Jobs
+
+
+def heartbeat(p_handler, p_jobs, p_workers):
+    for m_Worker in p_workers:
+        m_Result = p_handler.heartbeat_jobs(m_Worker, '1', p_jobs[m_Worker])
+        assert m_Result['Result'] and not m_Result['Lost'], m_Result
+
+
+def reclaim(p_jobs, p_lease_seconds):
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.leases.lease_seconds = p_lease_seconds
+    m_handler.create_label('bench', 'A=1', p_jobs)
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+    m_handler.submit_job('bench', 'bench_regress', 'bench', '')
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_JOBS(ID, TASK_ID, REGRESS_NAME, LABEL_NAME, STATUS) "
+                           "VALUES(?, 1, 'bench_regress', 'bench', 'NEW')", [(i, ) for i in range(2, p_jobs + 1)])
+        m_conn.execute("UPDATE FARM_TASKS SET TOTAL_JOBS = ? WHERE ID = 1", (p_jobs, ))
+    m_handler.scheduler.push('bench', range(2, p_jobs + 1))
+    m_handler.start_lease_reaper()
+
+    m_Jobs = dispatch(m_handler, p_jobs, 10)
+    m_Alive = ['worker_%d' % i for i in range(5)]
+    m_Crashed = ['worker_%d' % i for i in range(5, 10)]
+    heartbeat(m_handler, m_Jobs, m_Alive + m_Crashed)
+    m_Expiry = time.perf_counter() + p_lease_seconds
+    m_Lost = sum(len(m_Jobs[m_Worker]) for m_Worker in m_Crashed)
+
+    # 正常的Worker继续发送心跳，直到丢失的作业全部回到等待队列，服务端回收每个作业时的输出不显示
+    m_Delays = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        while m_handler.scheduler.ready_count() < m_Lost:
+            heartbeat(m_handler, m_Jobs, m_Alive)
+            m_Ready = m_handler.scheduler.ready_count()
+            m_Delays.extend([time.perf_counter() - m_Expiry] * (m_Ready - len(m_Delays)))
+            time.sleep(0.005)
+    m_Delays.extend([time.perf_counter() - m_Expiry] * (m_Lost - len(m_Delays)))
+    m_conn = m_handler.db.reader()
+    m_Status = dict(m_conn.query_all("SELECT STATUS, COUNT(*) FROM FARM_JOBS GROUP BY STATUS"))
+    m_Running = m_conn.query_one("SELECT RUNNING_JOBS FROM FARM_TASKS WHERE ID = 1")[0]
+    m_handler.disconnect_config_db()
+    assert m_Status == {'NEW': m_Lost, 'WORKING': p_jobs - m_Lost}, m_Status
+    assert m_Running == p_jobs - m_Lost, m_Running
+
+    print('jobs: %d on 10 workers, 5 workers stop sending heartbeats, lease %.1fs' % (p_jobs, p_lease_seconds))
+    print('%-44s %d' % ('jobs requeued', m_Lost))
+    print('%-44s %d' % ('jobs of live workers still WORKING', m_Status['WORKING']))
+    print('%-44s %.1f / %.1f' % ('requeued after lease expiry p50 / max (ms)',
+                                 m_Delays[len(m_Delays) // 2] * 1000, m_Delays[-1] * 1000))
+
+
+# 另一种做法：租约的到期时间放在FARM_JOBS中，心跳更新这一列，回收线程定时扫描
+def table_lease_cost(p_jobs, p_history):
+    m_home = create_farm_home()
+    m_conn = sqlite3.connect(os.path.join(m_home, 'db', 'farm.db'))
+    m_conn.execute("ALTER TABLE FARM_JOBS ADD COLUMN LEASE_EXPIRY REAL")
+    m_conn.executemany("INSERT INTO FARM_JOBS(ID, TASK_ID, REGRESS_NAME, LABEL_NAME, STATUS, LEASE_EXPIRY) "
+                       "VALUES(?, 1, 'bench_regress', 'bench', ?, ?)",
+                       ((i, 'COMPLETED' if i <= p_history else 'WORKING', None if i <= p_history else 1e12)
+                        for i in range(1, p_history + p_jobs + 1)))
+    m_conn.commit()
+
+    m_start = time.perf_counter()
+    for m_JobID in range(p_history + 1, p_history + p_jobs + 1):
+        m_conn.execute("UPDATE FARM_JOBS SET LEASE_EXPIRY = ? WHERE ID = ?", (time.time() + 60, m_JobID))
+    m_conn.commit()
+    m_Heartbeat = (time.perf_counter() - m_start) / p_jobs
+
+    m_start = time.perf_counter()
+    for i in range(10):
+        m_conn.execute("SELECT ID FROM FARM_JOBS WHERE STATUS = 'WORKING' AND LEASE_EXPIRY < ?",
+                       (time.time(), )).fetchall()
+    m_Scan = (time.perf_counter() - m_start) / 10
+    m_conn.close()
+    return m_Heartbeat, m_Scan
+
+
+def heap_lease_cost(p_jobs):
+    m_handler = open_farm_handler(create_farm_home())
+    for m_JobID in range(p_jobs):
+        m_handler.leases.grant(m_JobID, ('worker', '1'), 3600)
+    m_start = time.perf_counter()
+    m_handler.heartbeat_jobs('worker', '1', list(range(p_jobs)))
+    m_Heartbeat = (time.perf_counter() - m_start) / p_jobs
+    m_start = time.perf_counter()
+    for i in range(10):
+        m_handler.leases.wait_expired(0)
+    m_Check = (time.perf_counter() - m_start) / 10
+    m_handler.disconnect_config_db()
+    return m_Heartbeat, m_Check
+
+
+if __name__ == '__main__':
+    m_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    m_history = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    m_lease_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    reclaim(min(m_jobs, 1000), m_lease_seconds)
+
+    m_TableHeartbeat, m_TableScan = table_lease_cost(m_jobs, m_history)
+    m_HeapHeartbeat, m_HeapCheck = heap_lease_cost(m_jobs)
+    print('running jobs: %d, history jobs: %d' % (m_jobs, m_history))
+    print('%-44s %14s %14s' % ('', 'heartbeat/job', 'expiry check'))
+    print('%-44s %11.2f us %11.2f ms' % ('lease column + periodic scan', m_TableHeartbeat * 1e6, m_TableScan * 1000))
+    print('%-44s %11.2f us %11.4f ms' % ('in-memory timer heap (after)', m_HeapHeartbeat * 1e6, m_HeapCheck * 1000))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# 多线程混合读写的锁竞争测试，比较全局锁（旧的方式）和读写锁加资源标签锁
+#   读线程模拟用户查看作业，每次查询之间间隔一小段时间；工作线程不停地派发和完成作业
+#   python benchmark/bench_lock_contention.py [readers] [workers] [seconds]
+import functools
+import sys
+import threading
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+
+
+# 模拟旧的实现：所有的调用都串行在一把全局锁上
+def global_locked(p_lock, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with p_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def run(p_global_lock, p_readers, p_workers, p_seconds):
+    m_home = create_farm_home()
+    m_handler = open_farm_handler(m_home)
+    for i in range(8):
+        m_handler.create_label('label_%d' % i, 'A=1', 1000000)
+    m_handler.add_regress('bench_regress', 'main.robot', 60, 'RF')
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES('bench_suite', ?)",
+                           [('bench_regress_%d' % i, ) for i in range(1000)])
+        m_conn.executemany("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                           "VALUES(?, 'main.robot', 60, 'RF')",
+                           [('bench_regress_%d' % i, ) for i in range(1000)])
+    for i in range(200):
+        m_handler.submit_job('label_%d' % (i % 8), 'bench_regress', 'bench', '')
+
+    m_show_jobs = m_handler.show_jobs
+    m_submit_job = m_handler.submit_job
+    m_get_todo_job = m_handler.get_todo_job
+    m_finish_job = m_handler.finish_job
+    if p_global_lock:
+        m_lock = threading.RLock()
+        m_show_jobs = global_locked(m_lock, m_show_jobs)
+        m_submit_job = global_locked(m_lock, m_submit_job)
+        m_get_todo_job = global_locked(m_lock, m_get_todo_job)
+        m_finish_job = global_locked(m_lock, m_finish_job)
+
+    m_Counts = {'show_jobs': 0, 'dispatch': 0, 'submit': 0}
+    m_Latency = []
+    m_CountLock = threading.Lock()
+    m_Stop = threading.Event()
+
+    def count(p_key):
+        with m_CountLock:
+            m_Counts[p_key] = m_Counts[p_key] + 1
+
+    def reader():
+        while not m_Stop.is_set():
+            m_show_jobs('bench')
+            count('show_jobs')
+            time.sleep(0.05)
+
+    def worker():
+        while not m_Stop.is_set():
+            m_start = time.perf_counter()
+            m_Result = m_get_todo_job('bench', '1', 'localhost', '/tmp', '/tmp')
+            if m_Result['Result']:
+                m_finish_job(m_Result['ID'], 'COMPLETED', '')
+                with m_CountLock:
+                    m_Latency.append(time.perf_counter() - m_start)
+                count('dispatch')
+
+    def submitter():
+        while not m_Stop.is_set():
+            m_submit_job('label_0', 'bench_suite', 'nightly', '')
+            count('submit')
+
+    m_Threads = [threading.Thread(target=reader) for i in range(p_readers)] + \
+                [threading.Thread(target=worker) for i in range(p_workers)] + \
+                [threading.Thread(target=submitter)]
+    for t in m_Threads:
+        t.start()
+    time.sleep(p_seconds)
+    m_Stop.set()
+    for t in m_Threads:
+        t.join()
+    m_handler.disconnect_config_db()
+    m_Result = dict((k, v / float(p_seconds)) for k, v in m_Counts.items())
+    m_Latency.sort()
+    m_Result['dispatch p50 (ms)'] = m_Latency[len(m_Latency) // 2] * 1000
+    m_Result['dispatch p99 (ms)'] = m_Latency[len(m_Latency) * 99 // 100] * 1000
+    return m_Result
+
+
+if __name__ == '__main__':
+    m_readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    m_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    m_seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    m_before = run(True, m_readers, m_workers, m_seconds)
+    m_after = run(False, m_readers, m_workers, m_seconds)
+    print('readers: %d, workers: %d, seconds: %d' % (m_readers, m_workers, m_seconds))
+    print('%-22s %14s %14s' % ('', 'global lock', 'rw + label'))
+    for m_Key in ('show_jobs', 'dispatch', 'submit', 'dispatch p50 (ms)', 'dispatch p99 (ms)'):
+        print('%-22s %14.1f %14.1f' % (m_Key, m_before[m_Key], m_after[m_Key]))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# 比较定时轮询和长轮询（get_todo_job等待作业）时的派发延迟和空闲时的调用次数
+#   python benchmark/bench_long_poll.py [workers] [jobs] [poll_interval]
+import random
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server
+from farm.main import RPCProxy
+
+WORKER = dict(p_worker_user_name='bench', p_os_pid='1', p_machine_name='bench',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def worker(p_port, p_label, p_stop, p_wait, p_interval, p_received, p_calls):
+    c = Client(('localhost', p_port), authkey=b'welcome')
+    proxy = RPCProxy(c)
+    while not p_stop.is_set():
+        m_Job = proxy.get_todo_job(p_labels=[p_label], p_wait_timeout=p_wait, **WORKER)
+        p_calls.append(1)
+        if not m_Job['Result']:
+            if p_wait == 0:
+                time.sleep(p_interval)
+            continue
+        p_received[int(m_Job['TASK_ID'])] = time.perf_counter()
+        proxy.finish_job(m_Job['ID'], 'COMPLETED', '')
+    c.close()
+
+
+#   每一轮使用自己的资源标签，互相不影响
+def run(p_handler, p_port, p_label, p_workers, p_jobs, p_wait, p_interval):
+    p_handler.create_label(p_label, 'A=1', 100)
+    m_Stop = threading.Event()
+    m_Received = {}
+    m_Calls = []
+    m_Threads = [threading.Thread(target=worker,
+                                  args=(p_port, p_label, m_Stop, p_wait, p_interval, m_Received, m_Calls))
+                 for i in range(p_workers)]
+    for t in m_Threads:
+        t.start()
+    time.sleep(0.5)
+
+    # 空闲时的调用次数
+    m_Before = len(m_Calls)
+    time.sleep(2.0)
+    m_IdleCalls = (len(m_Calls) - m_Before) / 2.0
+
+    # 随机间隔提交作业，记录从提交到被worker取到的时间
+    m_Submitted = {}
+    for i in range(p_jobs):
+        time.sleep(random.uniform(0.05, 0.2))
+        m_TaskID = p_handler.submit_job(p_label, 'bench_regress', 'bench', '')['JobID']
+        m_Submitted[m_TaskID] = time.perf_counter()
+    while len(m_Received) < p_jobs:
+        time.sleep(0.05)
+    # 再提交一些作业，唤醒还在等待的worker
+    m_Stop.set()
+    for i in range(p_workers):
+        p_handler.submit_job(p_label, 'bench_regress', 'bench', '')
+    for t in m_Threads:
+        t.join()
+    m_Latency = sorted((m_Received[k] - m_Submitted[k]) * 1000 for k in m_Submitted)
+    return m_Latency[len(m_Latency) // 2], m_Latency[-1], m_IdleCalls
+
+
+if __name__ == '__main__':
+    m_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    m_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    m_interval = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+    m_port = start_rpc_server([m_handler.finish_job], p_waiting=[m_handler.get_todo_job])
+
+    print('workers: %d, jobs: %d' % (m_workers, m_jobs))
+    print('%-28s %12s %12s %14s' % ('', 'p50 ms', 'max ms', 'idle calls/s'))
+    for m_Name, m_Label, m_Wait in (('poll every %.1fs' % m_interval, 'poll', 0), ('long poll', 'long_poll', 60)):
+        m_p50, m_max, m_Idle = run(m_handler, m_port, m_Label, m_workers, m_jobs, m_Wait, m_interval)
+        print('%-28s %12.1f %12.1f %14.1f' % (m_Name, m_p50, m_max, m_Idle))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# 用历史运行时间模拟一个测试套件的完成时间（makespan）
+#   旧的方式：按照提交的顺序派发
+#   新的方式：先用历史记录得到每个回归测试的预计运行时间，一个任务中预计时间长的作业先派发
+#   派发使用真实的FarmHandler（submit_job、get_todo_job、finish_job），作业的运行用模拟的时钟代替
+#   python benchmark/bench_makespan.py [regressions] [workers] [history_runs] [trials]
+#   python benchmark/bench_makespan.py FARM_HOME/db/farm.db [workers]
+#     从已有的配置数据库重放：最后一个多作业任务作为要模拟的套件，使用它记录的运行时间，
+#     之前的作业作为历史记录
+import heapq
+import os
+import random
+import sqlite3
+import sys
+
+from benchutil import create_farm_home, open_farm_handler
+
+HISTORY_SQL = "SELECT REGRESS_NAME, LABEL_NAME, (julianday(COMPLETED_DATE) - julianday(STARTED_DATE)) * 86400 " \
+              "FROM   FARM_JOBS " \
+              "WHERE  STATUS IN ('COMPLETED', 'TIMEOUT') AND STARTED_DATE IS NOT NULL AND TASK_ID < ? " \
+              "ORDER BY COMPLETED_DATE, ID"
+
+
+# 模拟运行一次套件，p_durations为{回归测试: 这一次的运行时间}，返回所有作业完成的时间
+def simulate(p_durations, p_workers, p_history):
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', p_workers)
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                           "VALUES(?, 'main.robot', 86400, 'RF')", [(m_Name, ) for m_Name in p_durations])
+        m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES('bench_suite', ?)",
+                           [(m_Name, ) for m_Name in p_durations])
+    m_handler.durations.load(p_history)
+    assert m_handler.submit_job('bench', 'bench_suite', 'bench', '')['Result']
+
+    m_Clock = 0.0
+    m_Running = []
+    while True:
+        while len(m_Running) < p_workers:
+            m_Job = m_handler.get_todo_job('bench', '1', 'localhost', '/tmp', '/tmp')
+            if not m_Job['Result']:
+                break
+            heapq.heappush(m_Running, (m_Clock + p_durations[m_Job['REGRESS_NAME']], m_Job['ID']))
+        if not m_Running:
+            break
+        m_Clock, m_JobID = heapq.heappop(m_Running)
+        assert m_handler.finish_job(m_JobID, 'COMPLETED', '')['Result']
+    m_handler.disconnect_config_db()
+    return m_Clock
+
+
+# 随机生成回归测试的运行时间，少数回归测试运行几个小时，大部分只需要几分钟
+def synthetic(p_regressions, p_history_runs, p_seed):
+    m_Random = random.Random(p_seed)
+    m_Names = ['regress_%04d' % i for i in range(p_regressions)]
+    m_Random.shuffle(m_Names)
+    m_True = {m_Name: m_Random.lognormvariate(5.5, 1.2) for m_Name in m_Names}
+    m_History = []
+    for i in range(p_history_runs):
+        for m_Name in m_Names:
+            m_History.append((m_Name, 'bench', m_True[m_Name] * m_Random.lognormvariate(0, 0.2)))
+    return {m_Name: m_True[m_Name] * m_Random.lognormvariate(0, 0.2) for m_Name in m_Names}, m_History
+
+
+# 从配置数据库中读取最后一个多作业任务和之前的历史记录
+def recorded(p_db_file):
+    m_conn = sqlite3.connect(p_db_file)
+    m_TaskID = m_conn.execute("SELECT MAX(ID) FROM FARM_TASKS WHERE TOTAL_JOBS > 1").fetchone()[0]
+    m_Durations = dict((row[0], row[1]) for row in m_conn.execute(
+        "SELECT REGRESS_NAME, (julianday(COMPLETED_DATE) - julianday(STARTED_DATE)) * 86400 "
+        "FROM   FARM_JOBS WHERE TASK_ID = ? AND STARTED_DATE IS NOT NULL AND COMPLETED_DATE IS NOT NULL "
+        "ORDER BY ID", (m_TaskID, )))
+    m_History = [('%s' % row[0], 'bench', row[2]) for row in m_conn.execute(HISTORY_SQL, (m_TaskID, ))]
+    m_conn.close()
+    return m_Durations, m_History
+
+
+def report(p_trials, p_workers):
+    m_Fifo = m_Longest = m_Bound = 0.0
+    for m_Durations, m_History in p_trials:
+        m_Fifo = m_Fifo + simulate(m_Durations, p_workers, [])
+        m_Longest = m_Longest + simulate(m_Durations, p_workers, m_History)
+        m_Bound = m_Bound + max(max(m_Durations.values()), sum(m_Durations.values()) / p_workers)
+    n = float(len(p_trials))
+    print('%-40s %14s %10s' % ('', 'makespan (h)', 'vs bound'))
+    print('%-40s %14.2f %10.2f' % ('lower bound max(longest, total/workers)', m_Bound / n / 3600, 1.0))
+    print('%-40s %14.2f %10.2f' % ('submit order (before)', m_Fifo / n / 3600, m_Fifo / m_Bound))
+    print('%-40s %14.2f %10.2f' % ('longest expected first (after)', m_Longest / n / 3600, m_Longest / m_Bound))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
+        m_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+        m_Durations, m_History = recorded(sys.argv[1])
+        print('replay %s: %d jobs, %d history jobs, %d workers' %
+              (sys.argv[1], len(m_Durations), len(m_History), m_workers))
+        report([(m_Durations, m_History)], m_workers)
+    else:
+        m_regressions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+        m_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+        m_history_runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+        m_trials = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+        print('%d regressions, %d workers, %d recorded runs of history, %d trials' %
+              (m_regressions, m_workers, m_history_runs, m_trials))
+        report([synthetic(m_regressions, m_history_runs, m_Seed) for m_Seed in range(m_trials)], m_workers)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# 比较作业结束以后汇总output.xml的开销
+#   原来的方式：robot.result.ExecutionResult把整个结果读到内存中再遍历
+#   新的方式：summarize_output流式读两遍，内存占用和文件大小无关
+#   每种方式在单独的进程中运行，统计用时和进程的最大内存，并检查两者输出的套件、测试、关键字一致
+#   python benchmark/bench_outputxml.py [tests] [keywords_per_test]
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from farm.outputxml import summarize_output  # noqa: E402
+
+
+# 生成Robot Framework 7格式的output.xml
+def make_output(p_path, p_tests, p_keywords):
+    with open(p_path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<robot generator="Robot 7.0 (Python 3.11.7 on linux)" generated="2024-01-01T00:00:00.000000" '
+                'rpa="false" schemaversion="5">\n<suite id="s1" name="Bench" source="/tmp/bench">\n')
+        for s in range(10):
+            f.write('<suite id="s1-s%d" name="Cases %d" source="/tmp/bench/cases_%d.robot">\n' % (s + 1, s, s))
+            for t in range(p_tests // 10):
+                f.write('<test id="s1-s%d-t%d" name="Case %d" line="%d">\n' % (s + 1, t + 1, t, t + 3))
+                for k in range(p_keywords):
+                    f.write('<kw name="Execute SQL" owner="SQLCliLibrary">\n<arg>SELECT %d FROM T%d</arg>\n'
+                            '<msg time="2024-01-01T00:%02d:%02d.%06d" level="INFO">%s</msg>\n'
+                            '<status status="PASS" start="2024-01-01T00:%02d:%02d.%06d" elapsed="0.%06d"/>\n'
+                            '</kw>\n' % (k, t, s, t % 60, k * 1000, 'row ' * 20, s, t % 60, k * 1000, k * 997))
+                f.write('<status status="%s" start="2024-01-01T00:%02d:%02d.000000" elapsed="%d.250000"/>\n'
+                        '</test>\n' % ('FAIL' if t % 7 == 0 else 'PASS', s, t % 60, t % 5))
+            f.write('<status status="FAIL" start="2024-01-01T00:%02d:00.000000" elapsed="59.500000"/>\n'
+                    '</suite>\n' % s)
+        f.write('<status status="FAIL" start="2024-01-01T00:00:00.000000" elapsed="600.000000"/>\n</suite>\n'
+                '<statistics>\n<total>\n<stat pass="1" fail="0" skip="0">All Tests</stat>\n</total>\n<tag/>\n'
+                '<suite>\n<stat name="Bench" id="s1" pass="1" fail="0" skip="0">Bench</stat>\n</suite>\n'
+                '</statistics>\n<errors/>\n</robot>\n')
+
+
+# 原来的方式，按照文档的顺序遍历所有的套件、测试和关键字
+def execution_result(p_output_xml, p_csv_file):
+    from robot.api import ExecutionResult, ResultVisitor
+
+    class Writer(ResultVisitor):
+        def __init__(self, p_writer):
+            self.writer = p_writer
+
+        def row(self, p_type, p_name, p_item):
+            self.writer.writerow([p_type, p_name, p_item.status, p_item.elapsed_time.total_seconds()])
+
+        def start_suite(self, suite):
+            self.row('Suite', suite.name, suite)
+
+        def start_test(self, test):
+            self.row('Test', test.name, test)
+
+        def start_keyword(self, keyword):
+            self.row(keyword.type.capitalize(), keyword.full_name, keyword)
+
+    m_Result = ExecutionResult(p_output_xml)
+    with open(p_csv_file, 'w', newline='', encoding='utf-8') as f:
+        m_Result.visit(Writer(csv.writer(f)))
+
+
+def streaming(p_output_xml, p_csv_file):
+    summarize_output(p_output_xml, p_csv_file, 'suite-test-keyword')
+
+
+# 在子进程中运行一种方式，返回(秒, 最大内存MB)
+def measure(p_name, p_output_xml, p_csv_file):
+    m_Result = subprocess.run([sys.executable, __file__, '--run', p_name, p_output_xml, p_csv_file],
+                              stdout=subprocess.PIPE, check=True)
+    m_Seconds, m_MaxRss = m_Result.stdout.split()
+    return float(m_Seconds), int(m_MaxRss) / 1024.0
+
+
+def read_rows(p_csv_file, p_columns):
+    with open(p_csv_file, newline='', encoding='utf-8') as f:
+        m_Rows = list(csv.reader(f))
+    return [tuple(m_Row[i].lstrip('|- ') for i in p_columns) for m_Row in m_Rows]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        m_start = time.perf_counter()
+        {'ExecutionResult': execution_result, 'summarize_output': streaming}[sys.argv[2]](sys.argv[3], sys.argv[4])
+        print('%f %d' % (time.perf_counter() - m_start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        sys.exit(0)
+
+    m_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    m_keywords = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    m_dir = tempfile.mkdtemp(prefix='farm_bench_output_')
+    m_output = os.path.join(m_dir, 'output.xml')
+    make_output(m_output, m_tests, m_keywords)
+    print('output.xml: %d tests x %d keywords, %.1f MB' %
+          (m_tests, m_keywords, os.path.getsize(m_output) / 1048576.0))
+
+    print('%-20s %10s %14s' % ('', 'seconds', 'max RSS (MB)'))
+    for m_Name in ('ExecutionResult', 'summarize_output'):
+        m_seconds, m_rss = measure(m_Name, m_output, os.path.join(m_dir, m_Name + '.csv'))
+        print('%-20s %10.2f %14.1f' % (m_Name, m_seconds, m_rss))
+
+    # 两种方式得到的类型、名字、状态、用时一致
+    m_Expected = read_rows(os.path.join(m_dir, 'ExecutionResult.csv'), (0, 1, 2, 3))
+    m_Actual = read_rows(os.path.join(m_dir, 'summarize_output.csv'), (0, 1, 2, 6))[1:]
+    assert len(m_Expected) == len(m_Actual), (len(m_Expected), len(m_Actual))
+    for m_Row1, m_Row2 in zip(m_Expected, m_Actual):
+        assert m_Row1[0:3] == m_Row2[0:3] and abs(float(m_Row1[3]) - float(m_Row2[3])) < 0.001, (m_Row1, m_Row2)
+    m_Summary = summarize_output(m_output, os.path.join(m_dir, 'check.csv'), 'test')
+    assert m_Summary['Tests'] == m_tests // 10 * 10 and m_Summary['Elapsed'] == 600.0, m_Summary
+    print('rows: %d, identical' % len(m_Actual))
+    print('summary: %s' % m_Summary)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# 在模拟的广域网延迟下，比较逐个调用、流水线调用和批量调用
+#   worker每完成一个作业都要调用finish_job和get_todo_job，批量调用时只需要一次往返
+#   python benchmark/bench_rpc_batch.py [delay_ms] [jobs]
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server, free_port
+from farm.main import RPCProxy
+
+
+# 单向转发数据，每一段数据延迟p_delay秒以后再发出
+def relay(p_src, p_dst, p_delay):
+    m_Queue = deque()
+    m_Cond = threading.Condition()
+
+    def sender():
+        while True:
+            with m_Cond:
+                while not m_Queue:
+                    m_Cond.wait()
+                m_Due, m_Data = m_Queue.popleft()
+            time.sleep(max(0.0, m_Due - time.monotonic()))
+            if not m_Data:
+                p_dst.shutdown(socket.SHUT_WR)
+                return
+            p_dst.sendall(m_Data)
+
+    threading.Thread(target=sender, daemon=True).start()
+    while True:
+        m_Data = p_src.recv(65536)
+        with m_Cond:
+            m_Queue.append((time.monotonic() + p_delay, m_Data))
+            m_Cond.notify()
+        if not m_Data:
+            return
+
+
+# 一个增加了单向延迟的TCP代理，返回代理的端口
+def start_delay_proxy(p_port, p_delay):
+    m_Listener = socket.socket()
+    m_Listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    m_Listener.bind(('localhost', free_port()))
+    m_Listener.listen(16)
+
+    def accept():
+        while True:
+            m_Client, _ = m_Listener.accept()
+            m_Server = socket.create_connection(('localhost', p_port))
+            for m_Sock in (m_Client, m_Server):
+                m_Sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=relay, args=(m_Client, m_Server, p_delay), daemon=True).start()
+            threading.Thread(target=relay, args=(m_Server, m_Client, p_delay), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return m_Listener.getsockname()[1]
+
+
+WORKER = dict(p_worker_user_name='bench', p_os_pid='1', p_machine_name='bench',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+# 逐个调用：完成一个作业，再取下一个作业
+def run_sequential(proxy, p_job):
+    m_Job = proxy.get_todo_job(**WORKER)
+    while m_Job['Result']:
+        proxy.finish_job(m_Job['ID'], 'COMPLETED', '')
+        m_Job = proxy.get_todo_job(**WORKER)
+
+
+# 批量调用：完成作业和取下一个作业在一个请求中
+def run_batch(proxy, p_job):
+    m_Job = proxy.get_todo_job(**WORKER)
+    while m_Job['Result']:
+        with proxy.batch() as b:
+            b.finish_job(m_Job['ID'], 'COMPLETED', '')
+            m_Next = b.get_todo_job(**WORKER)
+        m_Job = m_Next.result()
+
+
+if __name__ == '__main__':
+    m_delay = (float(sys.argv[1]) if len(sys.argv) > 1 else 10.0) / 1000.0
+    m_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', 1)
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+    m_port = start_rpc_server([m_handler.get_todo_job, m_handler.finish_job, m_handler.show_stats],
+                              m_handler.batch_transaction)
+    m_proxy_port = start_delay_proxy(m_port, m_delay)
+
+    print('one way delay: %.1f ms' % (m_delay * 1000))
+    print('%-36s %12s' % ('', 'ms/op'))
+    for m_Name, m_Func in (('finish + get_todo, sequential', run_sequential),
+                           ('finish + get_todo, batched', run_batch)):
+        for i in range(m_jobs):
+            m_handler.submit_job('bench', 'bench_regress', 'bench', '')
+        c = Client(('localhost', m_proxy_port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_start = time.perf_counter()
+        m_Func(proxy, m_jobs)
+        m_elapsed = time.perf_counter() - m_start
+        c.close()
+        print('%-36s %12.2f' % (m_Name, m_elapsed * 1000 / m_jobs))
+
+    for m_Name, m_Pipelined in (('show_stats x %d, sequential' % m_jobs, False),
+                                ('show_stats x %d, pipelined' % m_jobs, True)):
+        c = Client(('localhost', m_proxy_port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        proxy.show_stats()
+        m_start = time.perf_counter()
+        if m_Pipelined:
+            p = proxy.pipeline()
+            m_Futures = [p.show_stats() for i in range(m_jobs)]
+            for m_Future in m_Futures:
+                m_Future.result()
+        else:
+            for i in range(m_jobs):
+                proxy.show_stats()
+        m_elapsed = time.perf_counter() - m_start
+        c.close()
+        print('%-36s %12.2f' % (m_Name, m_elapsed * 1000 / m_jobs))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# 比较两次pickle的旧报文格式和协商后的单次pickle报文格式，以及show_jobs的紧凑结果格式
+#   输出每次调用的应答字节数和耗时
+#   python benchmark/bench_rpc_framing.py [tasks] [calls]
+import sys
+import time
+from multiprocessing.connection import Client
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server
+from farm.main import RPCProxy
+from farm.rpcserver import rpc_encode
+
+
+if __name__ == '__main__':
+    m_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    m_calls = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', 1000000)
+    for i in range(m_tasks):
+        m_handler.submit_job('bench', 'bench_regress', 'bench', '')
+    m_port = start_rpc_server([m_handler.show_jobs])
+
+    print('tasks: %d' % m_tasks)
+    print('%-30s %12s %12s' % ('', 'bytes/reply', 'us/call'))
+    for m_Name, m_Protocol, m_Compact in (('pickle twice, dict rows', 1, False),
+                                          ('pickle once, dict rows', 2, False),
+                                          ('pickle once, compact rows', 2, True)):
+        c = Client(('localhost', m_port), authkey=b'welcome')
+        proxy = RPCProxy(c, protocol=m_Protocol)
+        m_Result = proxy.show_jobs('bench', p_compact=m_Compact)
+        m_start = time.perf_counter()
+        for i in range(m_calls):
+            proxy.show_jobs('bench', p_compact=m_Compact)
+        m_elapsed = (time.perf_counter() - m_start) / m_calls
+        c.close()
+        print('%-30s %12d %12.1f' % (m_Name, len(rpc_encode(m_Result, m_Protocol)), m_elapsed * 1000000))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# RPC服务的压力测试，比较每个连接一个线程（旧的方式）和asyncio事件循环
+#   每个客户端进程有自己的连接，连续调用；short模式下每次调用都重新建立连接
+#   asyncio服务分别测试放到线程池中执行的函数（访问数据库的调用）和直接在事件循环中执行的函数
+#   python benchmark/bench_rpc_load.py [clients] [calls] [long|short]
+import multiprocessing
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from benchutil import free_port
+from farm.main import RPCHandler, RPCProxy, rpc_server
+
+
+def ping(p_value):
+    return p_value
+
+
+def ping_inline(p_value):
+    return p_value
+
+
+# 旧的实现：每个连接启动一个线程
+#   旧的实现中backlog为1，多个客户端同时连接时会长时间挂起，这里放大backlog以便比较线程模型本身
+def thread_server(handler, address, authkey):
+    sock = Listener(address, authkey=authkey, backlog=1024)
+    while True:
+        client = sock.accept()
+        t = threading.Thread(target=handler.handle_connection, args=(client,))
+        t.daemon = True
+        t.start()
+
+
+def serve(p_server_func, p_port):
+    handler = RPCHandler()
+    handler.register_function(ping)
+    handler.register_function(ping_inline, blocking=False)
+    p_server_func(handler, ('localhost', p_port), b'welcome')
+
+
+def client(p_port, p_calls, p_mode, p_func, p_start, p_queue):
+    p_start.wait()
+    m_start = time.perf_counter()
+    if p_mode == 'long':
+        c = Client(('localhost', p_port), authkey=b'welcome')
+        m_func = getattr(RPCProxy(c), p_func)
+        for i in range(p_calls):
+            m_func(i)
+        c.close()
+    else:
+        for i in range(p_calls):
+            c = Client(('localhost', p_port), authkey=b'welcome')
+            getattr(RPCProxy(c), p_func)(i)
+            c.close()
+    p_queue.put(time.perf_counter() - m_start)
+
+
+def run(p_server_func, p_clients, p_calls, p_mode, p_func='ping'):
+    m_port = free_port()
+    m_server = multiprocessing.Process(target=serve, args=(p_server_func, m_port))
+    m_server.daemon = True
+    m_server.start()
+    time.sleep(0.5)
+
+    m_start = multiprocessing.Event()
+    m_queue = multiprocessing.Queue()
+    m_clients = [multiprocessing.Process(target=client, args=(m_port, p_calls, p_mode, p_func, m_start, m_queue))
+                 for i in range(p_clients)]
+    for p in m_clients:
+        p.start()
+    m_begin = time.perf_counter()
+    m_start.set()
+    for p in m_clients:
+        p.join()
+    m_elapsed = time.perf_counter() - m_begin
+    m_server.terminate()
+    return p_clients * p_calls / m_elapsed
+
+
+if __name__ == '__main__':
+    m_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    m_calls = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    m_mode = sys.argv[3] if len(sys.argv) > 3 else 'long'
+    print('clients: %d, calls per client: %d, connections: %s' % (m_clients, m_calls, m_mode))
+    print('%-26s %10.1f RPC/s' % ('thread per connection', run(thread_server, m_clients, m_calls, m_mode)))
+    print('%-26s %10.1f RPC/s' % ('asyncio server (executor)', run(rpc_server, m_clients, m_calls, m_mode)))
+    print('%-26s %10.1f RPC/s' % ('asyncio server (inline)',
+                                  run(rpc_server, m_clients, m_calls, m_mode, 'ping_inline')))
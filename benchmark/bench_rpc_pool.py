@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# 比较每次RPC都打开、关闭数据库（旧的方式）和服务端持有长连接之间的RPC吞吐量
+#   python benchmark/bench_rpc_pool.py [calls]
+import functools
+import os
+import sqlite3
+import sys
+import time
+from multiprocessing.connection import Client
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server
+from farm.main import RPCProxy
+
+
+# 模拟旧的实现：每一次调用都重新连接数据库并加载数据字典
+def reconnect_per_call(p_db_file, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        m_conn = sqlite3.connect(p_db_file)
+        m_conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchall()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            m_conn.close()
+    return wrapper
+
+
+def run(p_legacy, p_calls):
+    m_home = create_farm_home()
+    m_handler = open_farm_handler(m_home)
+    m_handler.create_label('bench', 'A=1', 1000000)
+    m_handler.add_regress('bench_regress', 'main.robot', 60, 'RF')
+
+    m_functions = [m_handler.submit_job, m_handler.show_jobs, m_handler.get_todo_job, m_handler.finish_job]
+    if p_legacy:
+        m_db_file = os.path.join(m_home, 'db', 'farm.db')
+        m_functions = [reconnect_per_call(m_db_file, f) for f in m_functions]
+    m_port = start_rpc_server(m_functions)
+
+    c = Client(('localhost', m_port), authkey=b'welcome')
+    proxy = RPCProxy(c)
+    m_start = time.perf_counter()
+    m_nCalls = 0
+    for i in range(p_calls // 4):
+        proxy.submit_job('bench', 'bench_regress', 'bench', '')
+        proxy.show_jobs('nobody')
+        m_Result = proxy.get_todo_job('bench', '1', 'localhost', '/tmp', '/tmp')
+        proxy.finish_job(m_Result['ID'], 'COMPLETED', '')
+        m_nCalls = m_nCalls + 4
+    m_elapsed = time.perf_counter() - m_start
+    c.close()
+    m_handler.disconnect_config_db()
+    return m_nCalls / m_elapsed
+
+
+if __name__ == '__main__':
+    m_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    m_before = run(True, m_calls)
+    m_after = run(False, m_calls)
+    print('%-28s %10.1f RPC/s' % ('connect per call (before)', m_before))
+    print('%-28s %10.1f RPC/s' % ('pooled connections (after)', m_after))
+    print('%-28s %10.2fx' % ('speedup', m_after / m_before))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# 比较拼接SQL文本和使用绑定变量时，派发路径上每次调用的耗时，并输出语句缓存命中率
+#   python benchmark/bench_statements.py [jobs]
+import sys
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+
+
+# 旧的实现方式：每次都拼接出不同的SQL文本，sqlite3无法复用编译好的语句
+def legacy_dispatch(p_conn, p_job_id):
+    m_conn = p_conn.conn
+    m_conn.execute("SELECT R.MAIN_ENTRY, J.ID, L.PROPERTIES FROM FARM_LABEL L, FARM_JOBS J, FARM_REGRESS R "
+                   "WHERE L.NAME = J.LABEL_NAME AND R.NAME = J.REGRESS_NAME AND J.ID = " + str(p_job_id)).fetchall()
+    m_conn.execute("UPDATE FARM_JOBS SET STATUS = 'WORKING', WORKER_OS_PID = '" + str(p_job_id) +
+                   "', WORKER_MACHINE_NAME = 'bench' WHERE ID = " + str(p_job_id))
+    m_conn.execute("UPDATE FARM_JOBS SET STATUS = 'COMPLETED', NOTES = '" + str(p_job_id) +
+                   "' WHERE ID = " + str(p_job_id))
+
+
+# 新的实现方式：SQL文本固定，只有绑定变量在变化
+def bound_dispatch(p_conn, p_job_id):
+    p_conn.query_all("SELECT R.MAIN_ENTRY, J.ID, L.PROPERTIES FROM FARM_LABEL L, FARM_JOBS J, FARM_REGRESS R "
+                     "WHERE L.NAME = J.LABEL_NAME AND R.NAME = J.REGRESS_NAME AND J.ID = ?", (p_job_id,))
+    p_conn.execute("UPDATE FARM_JOBS SET STATUS = 'WORKING', WORKER_OS_PID = ?, WORKER_MACHINE_NAME = ? "
+                   "WHERE ID = ?", (str(p_job_id), 'bench', p_job_id))
+    p_conn.execute("UPDATE FARM_JOBS SET STATUS = 'COMPLETED', NOTES = ? WHERE ID = ?", (str(p_job_id), p_job_id))
+
+
+def run(p_dispatch, p_jobs):
+    m_home = create_farm_home()
+    m_handler = open_farm_handler(m_home)
+    m_handler.create_label('bench', 'A=1', 1000000)
+    m_handler.add_regress('bench_regress', 'main.robot', 60, 'RF')
+    for i in range(p_jobs):
+        m_handler.submit_job('bench', 'bench_regress', 'bench', '')
+
+    with m_handler.db.transaction() as m_conn:
+        m_start = time.perf_counter()
+        for m_JobID in range(1, p_jobs + 1):
+            p_dispatch(m_conn, m_JobID)
+        m_elapsed = time.perf_counter() - m_start
+    m_stats = m_handler.db.statement_stats()
+    m_handler.disconnect_config_db()
+    return m_elapsed / p_jobs * 1000000, m_stats
+
+
+if __name__ == '__main__':
+    m_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    m_before, m_dummy = run(legacy_dispatch, m_jobs)
+    m_after, m_stats = run(bound_dispatch, m_jobs)
+    print('%-26s %10.1f us/dispatch' % ('concatenated SQL (before)', m_before))
+    print('%-26s %10.1f us/dispatch' % ('bound parameters (after)', m_after))
+    print('%-26s %10.2f%%' % ('emulated cache hit rate', m_stats['EmulatedHitRate'] * 100))
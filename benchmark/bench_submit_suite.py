@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# 比较提交测试套件时逐条分配编号、逐条插入（旧的方式）和批量插入之间的耗时
+#   python benchmark/bench_submit_suite.py
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+
+
+# 旧的实现方式：每一个套件成员都要查询一次MAX(ID)，然后单独插入
+def legacy_submit(p_handler, p_suite_name):
+    with p_handler.db.transaction() as m_conn:
+        m_TaskID = (m_conn.query_one("SELECT MAX(ID) FROM FARM_TASKS")[0] or 0) + 1
+        m_conn.execute("INSERT INTO FARM_TASKS(ID, SUITE_OR_REGRESS_NAME, LABEL_NAME, STATUS) "
+                       "VALUES(?, ?, 'bench', 'NEW')", (m_TaskID, p_suite_name))
+        m_nCount = 0
+        for row_suite in m_conn.query_all("SELECT REGRESS_NAME FROM FARM_SUITE_REGRESS WHERE SUITE_NAME = ?",
+                                          (p_suite_name,)):
+            m_JobID = (m_conn.query_one("SELECT MAX(ID) FROM FARM_JOBS")[0] or 0) + 1
+            m_conn.execute("INSERT INTO FARM_JOBS(ID, TASK_ID, SUITE_NAME, REGRESS_NAME, LABEL_NAME, "
+                           "       REGRESS_OPTIONS, SUBMITTED_DATE, STATUS) "
+                           "VALUES(?, ?, ?, ?, 'bench', '', datetime('now'), 'NEW')",
+                           (m_JobID, m_TaskID, p_suite_name, row_suite[0]))
+            m_nCount = m_nCount + 1
+        m_conn.execute("UPDATE FARM_TASKS SET TOTAL_JOBS = ? WHERE ID = ?", (m_nCount, m_TaskID))
+
+
+def run(p_size):
+    m_home = create_farm_home()
+    m_handler = open_farm_handler(m_home)
+    m_suite_name = 'suite_%d' % p_size
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES(?, ?)",
+                           [(m_suite_name, 'regress_%d' % i) for i in range(p_size)])
+
+    m_start = time.perf_counter()
+    legacy_submit(m_handler, m_suite_name)
+    m_before = time.perf_counter() - m_start
+
+    # 旧的方式直接修改了数据库，需要重新读取序列号的起点
+    m_handler.disconnect_config_db()
+    m_handler.connect_config_db()
+    m_start = time.perf_counter()
+    m_Result = m_handler.submit_job('bench', m_suite_name, 'bench', '')
+    m_after = time.perf_counter() - m_start
+    assert m_Result['Result'], m_Result
+    m_handler.disconnect_config_db()
+    return m_before, m_after
+
+
+if __name__ == '__main__':
+    print('%10s %14s %14s %10s' % ('members', 'before(ms)', 'after(ms)', 'speedup'))
+    for m_size in (10, 1000, 10000):
+        m_before, m_after = run(m_size)
+        print('%10d %14.2f %14.2f %9.1fx' % (m_size, m_before * 1000, m_after * 1000, m_before / m_after))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# 查看正在运行的作业的输出
+#   用一个不停输出带时间戳的行的robot命令代替真正的测试，作业运行期间持续调用tail_job
+#   统计从输出一行到通过tail_job看到这一行的延迟，以及Worker进程的内存占用
+#   python benchmark/bench_tail.py [job_seconds] [lines_per_second]
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client
+
+from benchutil import create_farm_home, open_farm_handler, free_port
+from farm.main import RPCHandler, RPCProxy, rpc_server
+
+
+# 生成一个假的robot命令，每一行是输出时的时间和一段填充的内容
+def fake_robot(p_seconds, p_rate):
+    m_bin = tempfile.mkdtemp(prefix='farm_bench_bin_')
+    with open(os.path.join(m_bin, 'robot'), 'w') as f:
+        f.write('#!%s\n'
+                'import sys, time\n'
+                'end = time.time() + %s\n'
+                'while time.time() < end:\n'
+                '    for i in range(%d):\n'
+                '        sys.stdout.write("%%.6f %%s\\n" %% (time.time(), "x" * 200))\n'
+                '    sys.stdout.flush()\n'
+                '    time.sleep(0.01)\n' % (sys.executable, p_seconds, max(p_rate // 100, 1)))
+    os.chmod(os.path.join(m_bin, 'robot'), 0o755)
+    return m_bin
+
+
+def rss_kb(p_pid):
+    with open('/proc/%d/status' % p_pid) as f:
+        for m_Line in f:
+            if m_Line.startswith('VmRSS:'):
+                return int(m_Line.split()[1])
+    return 0
+
+
+if __name__ == '__main__':
+    m_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    m_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', 1000)
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+    handler = RPCHandler()
+    handler.register_function(m_handler.get_todo_job, waiting=True)
+    handler.register_function(m_handler.finish_job)
+    handler.register_function(m_handler.show_stats, blocking=False)
+    handler.register_function(m_handler.report_job_output, blocking=False)
+    handler.register_function(m_handler.tail_job)
+    handler.set_transaction(m_handler.batch_transaction)
+    m_port = free_port()
+    t = threading.Thread(target=rpc_server, args=(handler, ('localhost', m_port), b'welcome'))
+    t.daemon = True
+    t.start()
+
+    m_src = tempfile.mkdtemp(prefix='farm_bench_src_')
+    os.mkdir(os.path.join(m_src, 'bench_regress'))
+    open(os.path.join(m_src, 'bench_regress', 'main.robot'), 'w').close()
+    m_env = dict(os.environ,
+                 PATH=fake_robot(m_seconds, m_rate) + os.pathsep + os.environ['PATH'],
+                 T_WORK=tempfile.mkdtemp(prefix='farm_bench_work_'),
+                 T_BACKUP=tempfile.mkdtemp(prefix='farm_bench_backup_'),
+                 T_SRCHOME=m_src)
+    m_JobID = m_handler.submit_job('bench', 'bench_regress', 'bench', '')['JobID']
+    m_Worker = subprocess.Popen([sys.executable, '-m', 'farm.main', '--start_worker', '--worker_slots', '1',
+                                 '--port', str(m_port)],
+                                env=m_env, cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    proxy = RPCProxy(Client(('localhost', m_port), authkey=b'welcome'))
+    m_Delays = []
+    m_Rss = []
+    m_LineNo = 0
+    m_Status = 'NEW'
+    while m_Status in ('NEW', 'WORKING'):
+        m_Result = proxy.tail_job(p_job_id=m_JobID, p_lines=50, p_since=m_LineNo)
+        m_Now = time.time()
+        if m_Result['Result']:
+            m_Status = m_Result['Status']
+            m_LineNo = m_Result['LineNo']
+            if m_Result['Lines']:
+                m_Delays.append(m_Now - float(m_Result['Lines'][-1].split()[0]))
+        m_Rss.append(rss_kb(m_Worker.pid))
+        time.sleep(0.5)
+    m_Worker.send_signal(signal.SIGTERM)
+    m_Worker.wait()
+
+    m_Delays.sort()
+    print('job: %.0fs, %d lines/s of 220 bytes' % (m_seconds, m_rate))
+    print('tail calls with new lines      %d' % len(m_Delays))
+    print('lines seen by the server       %d' % m_LineNo)
+    print('delay p50 / max (ms)           %.0f / %.0f' %
+          (m_Delays[len(m_Delays) // 2] * 1000, m_Delays[-1] * 1000))
+    print('worker RSS min / max (MB)      %.1f / %.1f' % (min(m_Rss) / 1024.0, max(m_Rss) / 1024.0))
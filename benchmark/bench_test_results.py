@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# 每个测试的结果保存到FARM_TEST_RESULTS以后的上传和查询开销
+#   上传：一个作业的所有测试逐条插入、各自提交（对比），和upload_test_results在一个事务中批量插入
+#   查询：表中有几百万行时，按照任务查找失败的测试，按照测试的名字查找历史结果
+#   python benchmark/bench_test_results.py [tasks] [jobs_per_task] [tests_per_job]
+import random
+import sys
+import time
+
+from benchutil import create_farm_home, open_farm_handler
+
+
+def make_results(p_job, p_tests):
+    return [('Suite %d.Case %d' % (i // 100, i), 'FAIL' if random.random() < 0.02 else 'PASS',
+             random.random() * 10, 'Expected 1 but got 2' if i % 50 == 0 else '')
+            for i in range(p_tests)]
+
+
+# 对比：每个测试单独插入、单独提交
+def upload_one_by_one(p_handler, p_job_id, p_test_results):
+    m_row = p_handler.db.reader().query_one("SELECT TASK_ID, REGRESS_NAME FROM FARM_JOBS WHERE ID = ?",
+                                            (p_job_id,))
+    for m_Name, m_Status, m_Elapsed, m_Message in p_test_results:
+        with p_handler.db.transaction() as m_conn:
+            m_conn.execute("INSERT INTO FARM_TEST_RESULTS(JOB_ID, TASK_ID, REGRESS_NAME, "
+                           "       TEST_NAME, STATUS, ELAPSED, MESSAGE) "
+                           "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                           (p_job_id, m_row[0], m_row[1], m_Name, m_Status, m_Elapsed, m_Message))
+
+
+def timed(p_func, *p_args):
+    m_start = time.perf_counter()
+    m_Result = p_func(*p_args)
+    return m_Result, (time.perf_counter() - m_start) * 1000
+
+
+if __name__ == '__main__':
+    m_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    m_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    m_tests = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    m_handler = open_farm_handler(create_farm_home())
+    with m_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES(?, ?)",
+                           [('bench_suite', 'regress_%d' % i) for i in range(m_jobs)])
+    for i in range(m_tasks):
+        m_handler.submit_job('bench', 'bench_suite', 'bench', '')
+
+    m_Results = make_results(1, m_tests)
+    m_start = time.perf_counter()
+    upload_one_by_one(m_handler, 1, m_Results)
+    m_OneByOne = (time.perf_counter() - m_start) * 1000
+
+    m_Times = []
+    for m_JobID in range(1, m_tasks * m_jobs + 1):
+        m_Result, m_ms = timed(m_handler.upload_test_results, m_JobID, make_results(m_JobID, m_tests))
+        assert m_Result['Result'], m_Result
+        m_Times.append(m_ms)
+    m_Times.sort()
+    m_Rows = m_handler.db.reader().query_one("SELECT COUNT(*) FROM FARM_TEST_RESULTS")[0]
+    print('rows in FARM_TEST_RESULTS: %d (%d jobs x %d tests)' % (m_Rows, m_tasks * m_jobs, m_tests))
+    print('%-44s %10s' % ('upload one job', 'ms'))
+    print('%-44s %10.1f' % ('one insert and commit per test', m_OneByOne))
+    print('%-44s %10.1f' % ('upload_test_results, p50', m_Times[len(m_Times) // 2]))
+    print('%-44s %10.1f' % ('upload_test_results, max', m_Times[-1]))
+
+    print('%-44s %10s %8s' % ('query', 'ms', 'rows'))
+    for m_Name, m_Func, m_Args in (
+            ('show_failed_tests, last task', m_handler.show_failed_tests, (m_tasks, )),
+            ('show_failed_tests, first task', m_handler.show_failed_tests, (1, )),
+            ('show_test_history, 20 latest', m_handler.show_test_history, ('Suite 3.Case 321', )),
+            ('show_test_history, one regress', m_handler.show_test_history, ('Suite 3.Case 321', 'regress_2')),
+            ('show_test_history, unknown test', m_handler.show_test_history, ('No Such Case', ))):
+        m_Best = None
+        for i in range(5):
+            m_Result, m_ms = timed(m_Func, *m_Args)
+            m_Best = m_ms if m_Best is None else min(m_Best, m_ms)
+        assert m_Result['Result'], m_Result
+        print('%-44s %10.2f %8d' % (m_Name, m_Best, len(m_Result['Rows'])))
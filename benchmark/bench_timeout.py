@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# 作业超时以后多久释放资源，是否留下没有结束的进程
+#   测试启动一个后台进程，然后一直等待，测试进程和后台进程都忽略SIGTERM，只能被SIGKILL结束
+#   分别用一次性的Worker、常驻Worker和常驻Worker --zygote运行，作业的LIMIT_TIME为2秒
+#   python benchmark/bench_timeout.py
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LIMIT_TIME = 2
+# 用来找到测试留下的进程
+MARKER = '600.4242'
+
+
+# 生成一个假的robot命令
+def fake_robot():
+    m_bin = tempfile.mkdtemp(prefix='farm_bench_bin_')
+    with open(os.path.join(m_bin, 'robot'), 'w') as f:
+        f.write("#!/bin/sh\ntrap '' TERM\nsleep %s &\nsleep %s\n" % (MARKER, MARKER))
+    os.chmod(os.path.join(m_bin, 'robot'), 0o755)
+    return m_bin
+
+
+def leftover_processes():
+    m_Result = subprocess.run(['pgrep', '-f', '[s]leep ' + MARKER], stdout=subprocess.PIPE)
+    return len(m_Result.stdout.split())
+
+
+def job_status(p_handler, p_job_id):
+    return p_handler.db.reader().query_one("SELECT STATUS FROM FARM_JOBS WHERE ID = ?", (p_job_id, ))[0]
+
+
+def run(p_handler, p_port, p_env, p_args):
+    m_JobID = p_handler.submit_job('bench', 'bench_regress', 'bench', '')['JobID']
+    m_Worker = subprocess.Popen([sys.executable, '-m', 'farm.main', '--start_worker', '--port', str(p_port)] +
+                                p_args, env=p_env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while job_status(p_handler, m_JobID) == 'NEW':
+        time.sleep(0.01)
+    m_start = time.perf_counter()
+    while job_status(p_handler, m_JobID) == 'WORKING':
+        time.sleep(0.05)
+    m_elapsed = time.perf_counter() - m_start
+    m_Status = job_status(p_handler, m_JobID)
+    if '--worker_slots' in p_args:
+        m_Worker.send_signal(signal.SIGTERM)
+    m_Worker.wait()
+    return m_Status, m_elapsed, leftover_processes()
+
+
+if __name__ == '__main__':
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', 1000)
+    m_handler.add_regress('bench_regress', 'main.robot', LIMIT_TIME, 'RF')
+    m_port = start_rpc_server([m_handler.finish_job, m_handler.show_stats, m_handler.report_job_output],
+                              m_handler.batch_transaction, [m_handler.get_todo_job])
+
+    m_src = tempfile.mkdtemp(prefix='farm_bench_src_')
+    os.mkdir(os.path.join(m_src, 'bench_regress'))
+    with open(os.path.join(m_src, 'bench_regress', 'main.robot'), 'w') as f:
+        f.write('*** Settings ***\nLibrary    Process\n\n'
+                '*** Test Cases ***\nHang\n    Start Process    sleep    %s\n    Sleep    %s\n' % (MARKER, MARKER))
+    m_env = dict(os.environ,
+                 PATH=fake_robot() + os.pathsep + os.environ['PATH'],
+                 T_WORK=tempfile.mkdtemp(prefix='farm_bench_work_'),
+                 T_BACKUP=tempfile.mkdtemp(prefix='farm_bench_backup_'),
+                 T_SRCHOME=m_src)
+
+    print('LIMIT_TIME: %ds' % LIMIT_TIME)
+    print('%-28s %10s %22s %10s' % ('', 'status', 'seconds until finished', 'leftover'))
+    for m_Name, m_Args in (('one-shot worker', []),
+                           ('daemon', ['--worker_slots', '1']),
+                           ('daemon --zygote', ['--worker_slots', '1', '--zygote'])):
+        m_Status, m_elapsed, m_Leftover = run(m_handler, m_port, m_env, m_Args)
+        print('%-28s %10s %22.1f %10d' % (m_Name, m_Status, m_elapsed, m_Leftover))
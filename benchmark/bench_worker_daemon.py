@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# 常驻Worker在不同位置数量下的吞吐量
+#   用一个只等待固定时间的robot命令代替真正的测试，只比较调度和进程管理的开销
+#   python benchmark/bench_worker_daemon.py [jobs] [job_seconds] [slots,...]
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchutil import create_farm_home, open_farm_handler, free_port
+from farm.main import RPCHandler, rpc_server
+
+# 和安装以后的farm命令一样启动，不用python -m farm.main
+#   作业进程由forkserver启动，-m运行的主模块在每个作业进程中都会重新执行一次
+FARM = [sys.executable, '-c', 'from farm.main import farm; farm()']
+
+
+# 生成一个假的robot命令，放到PATH的最前面
+def fake_robot(p_seconds):
+    m_bin = tempfile.mkdtemp(prefix='farm_bench_bin_')
+    with open(os.path.join(m_bin, 'robot'), 'w') as f:
+        f.write('#!/bin/sh\nsleep %s\n' % p_seconds)
+    os.chmod(os.path.join(m_bin, 'robot'), 0o755)
+    return m_bin
+
+
+def run(p_handler, p_port, p_env, p_slots, p_jobs):
+    for i in range(p_jobs):
+        p_handler.submit_job('bench', 'bench_regress', 'bench', '')
+    m_start = time.perf_counter()
+    m_Worker = subprocess.Popen(FARM + ['--start_worker',
+                                        '--worker_slots', str(p_slots), '--port', str(p_port)],
+                                env=p_env, cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        m_Left = p_handler.db.reader().query_one(
+            "SELECT COUNT(*) FROM FARM_JOBS WHERE STATUS IN ('NEW', 'WORKING')")[0]
+        if m_Left == 0:
+            break
+        time.sleep(0.02)
+    m_elapsed = time.perf_counter() - m_start
+    m_Worker.send_signal(signal.SIGTERM)
+    m_Worker.wait()
+    return m_elapsed
+
+
+if __name__ == '__main__':
+    m_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    m_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    m_slots = [int(n) for n in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1, 4, 8]
+
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', 1000)
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+
+    # 和farm --start_server同样的注册方式
+    handler = RPCHandler()
+    handler.register_function(m_handler.get_todo_job, waiting=True)
+    handler.register_function(m_handler.finish_job)
+    handler.register_function(m_handler.show_stats, blocking=False)
+    handler.set_transaction(m_handler.batch_transaction)
+    m_port = free_port()
+    t = threading.Thread(target=rpc_server, args=(handler, ('localhost', m_port), b'welcome'))
+    t.daemon = True
+    t.start()
+
+    m_src = tempfile.mkdtemp(prefix='farm_bench_src_')
+    os.mkdir(os.path.join(m_src, 'bench_regress'))
+    open(os.path.join(m_src, 'bench_regress', 'main.robot'), 'w').close()
+    m_env = dict(os.environ,
+                 PATH=fake_robot(m_seconds) + os.pathsep + os.environ['PATH'],
+                 T_WORK=tempfile.mkdtemp(prefix='farm_bench_work_'),
+                 T_BACKUP=tempfile.mkdtemp(prefix='farm_bench_backup_'),
+                 T_SRCHOME=m_src)
+
+    print('jobs: %d, %.1fs each' % (m_jobs, m_seconds))
+    print('%-10s %12s %12s' % ('slots', 'seconds', 'jobs/s'))
+    for m_Slots in m_slots:
+        m_elapsed = run(m_handler, m_port, m_env, m_Slots, m_jobs)
+        print('%-10d %12.2f %12.2f' % (m_Slots, m_elapsed, m_jobs / m_elapsed))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# 比较准备工作目录的时间：清空以后copy_tree，和按照清单增量同步（冷启动和热启动）
+#   热启动前模拟上一个作业：写入一些输出文件，修改一个测试文件
+#   python benchmark/bench_workspace.py [small_files] [big_files] [big_file_mb]
+import distutils.dir_util
+import os
+import shutil
+import sys
+import tempfile
+
+from benchutil import timer
+from farm.workspace import Workspace
+
+
+def make_source(p_small, p_big, p_big_mb):
+    m_src = tempfile.mkdtemp(prefix='farm_bench_src_')
+    for i in range(p_small):
+        m_dir = os.path.join(m_src, 'cases_%02d' % (i % 20))
+        if not os.path.exists(m_dir):
+            os.mkdir(m_dir)
+        with open(os.path.join(m_dir, 'case_%05d.robot' % i), 'wb') as f:
+            f.write(os.urandom(4096))
+    os.mkdir(os.path.join(m_src, 'data'))
+    for i in range(p_big):
+        with open(os.path.join(m_src, 'data', 'reference_%d.bin' % i), 'wb') as f:
+            for j in range(p_big_mb):
+                f.write(os.urandom(1024 * 1024))
+    return m_src
+
+
+# 模拟一个作业在工作目录中留下的痕迹
+def run_fake_job(p_work):
+    for m_name in ('output.xml', 'log.html', 'report.html'):
+        with open(os.path.join(p_work, m_name), 'wb') as f:
+            f.write(os.urandom(65536))
+    with open(os.path.join(p_work, 'cases_00', 'case_00000.robot'), 'ab') as f:
+        f.write(b'modified by test')
+
+
+# 原来的方式：清空工作目录，再复制整个测试目录
+def wipe_and_copy(p_src, p_work):
+    for m_name in os.listdir(p_work):
+        m_path = os.path.join(p_work, m_name)
+        if os.path.isfile(m_path):
+            os.remove(m_path)
+        else:
+            shutil.rmtree(m_path)
+    distutils.dir_util._path_created.clear()
+    distutils.dir_util.copy_tree(p_src, p_work)
+
+
+if __name__ == '__main__':
+    m_small = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    m_big = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    m_big_mb = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    m_src = make_source(m_small, m_big, m_big_mb)
+    print('source: %d small files, %d x %d MB' % (m_small, m_big, m_big_mb))
+
+    m_Results = {}
+    m_work = tempfile.mkdtemp(prefix='farm_bench_work_')
+    with timer(m_Results, 'wipe + copy_tree, cold'):
+        wipe_and_copy(m_src, m_work)
+    run_fake_job(m_work)
+    with timer(m_Results, 'wipe + copy_tree, after a job'):
+        wipe_and_copy(m_src, m_work)
+
+    for m_Mode in Workspace.MODES:
+        m_work = tempfile.mkdtemp(prefix='farm_bench_work_')
+        m_Workspace = Workspace(m_work, m_Mode)
+        with timer(m_Results, '%s sync, cold' % m_Mode):
+            m_Workspace.sync(m_src)
+        run_fake_job(m_work)
+        with timer(m_Results, '%s sync, after a job' % m_Mode):
+            m_Stats = m_Workspace.sync(m_src)
+        assert m_Stats['Copied'] == 1 and m_Stats['Removed'] == 3, m_Stats
+        # 源目录被重新检出，修改时间都变了，内容没有变化
+        for m_root, m_dirs, m_files in os.walk(m_src):
+            for m_name in m_files:
+                os.utime(os.path.join(m_root, m_name))
+        with timer(m_Results, '%s sync, source touched' % m_Mode):
+            m_Workspace.sync(m_src)
+
+    print('%-36s %10s' % ('', 'seconds'))
+    for m_Name, m_elapsed in m_Results.items():
+        print('%-36s %10.3f' % (m_Name, m_elapsed))
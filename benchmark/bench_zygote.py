@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# 比较每个作业的额外开销：
+#   每个作业启动一次farm --start_worker（原来的方式，每个作业要启动两个解释器）
+#   常驻Worker，每个作业一个子进程，再由子进程启动robot
+#   常驻Worker --zygote，预先加载Robot Framework，子进程直接运行测试
+#   测试本身只有一个No Operation，时间基本上都是额外的开销
+#   python benchmark/bench_zygote.py [jobs]
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchutil import create_farm_home, open_farm_handler, start_rpc_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# 和安装以后的farm命令一样启动，不用python -m farm.main
+#   作业进程由forkserver启动，-m运行的主模块在每个作业进程中都会重新执行一次
+FARM = [sys.executable, '-c', 'from farm.main import farm; farm()']
+
+
+def wait_jobs(p_handler):
+    while p_handler.db.reader().query_one(
+            "SELECT COUNT(*) FROM FARM_JOBS WHERE STATUS IN ('NEW', 'WORKING')")[0] > 0:
+        time.sleep(0.01)
+
+
+# 每个作业启动一次Worker
+def run_one_shot(p_handler, p_port, p_env, p_jobs):
+    for i in range(p_jobs):
+        p_handler.submit_job('bench', 'bench_regress', 'bench', '')
+    m_start = time.perf_counter()
+    for i in range(p_jobs):
+        subprocess.run(FARM + ['--start_worker', '--port', str(p_port)],
+                       env=p_env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_jobs(p_handler)
+    return time.perf_counter() - m_start
+
+
+# 常驻Worker，只有一个位置，作业一个接一个地运行
+def run_daemon(p_handler, p_port, p_env, p_jobs, p_args):
+    m_Worker = subprocess.Popen(FARM + ['--start_worker', '--worker_slots', '1',
+                                        '--port', str(p_port)] + p_args,
+                                env=p_env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # 等Worker启动完成以后再提交作业
+    time.sleep(3)
+    m_start = time.perf_counter()
+    for i in range(p_jobs):
+        p_handler.submit_job('bench', 'bench_regress', 'bench', '')
+    wait_jobs(p_handler)
+    m_elapsed = time.perf_counter() - m_start
+    m_Worker.send_signal(signal.SIGTERM)
+    m_Worker.wait()
+    return m_elapsed
+
+
+if __name__ == '__main__':
+    m_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    m_handler = open_farm_handler(create_farm_home())
+    m_handler.create_label('bench', 'A=1', 1000)
+    m_handler.add_regress('bench_regress', 'main.robot', 3600, 'RF')
+    m_port = start_rpc_server([m_handler.finish_job, m_handler.show_stats], m_handler.batch_transaction,
+                              [m_handler.get_todo_job])
+
+    m_src = tempfile.mkdtemp(prefix='farm_bench_src_')
+    os.mkdir(os.path.join(m_src, 'bench_regress'))
+    with open(os.path.join(m_src, 'bench_regress', 'main.robot'), 'w') as f:
+        f.write('*** Test Cases ***\nNothing\n    No Operation\n')
+    m_env = dict(os.environ,
+                 T_WORK=tempfile.mkdtemp(prefix='farm_bench_work_'),
+                 T_BACKUP=tempfile.mkdtemp(prefix='farm_bench_backup_'),
+                 T_SRCHOME=m_src)
+
+    print('jobs: %d' % m_jobs)
+    print('%-36s %12s' % ('', 'ms/job'))
+    for m_Name, m_Func in (('one worker process per job', lambda: run_one_shot(m_handler, m_port, m_env, m_jobs)),
+                           ('daemon, robot subprocess', lambda: run_daemon(m_handler, m_port, m_env, m_jobs, [])),
+                           ('daemon --zygote', lambda: run_daemon(m_handler, m_port, m_env, m_jobs, ['--zygote']))):
+        m_elapsed = m_Func()
+        print('%-36s %12.1f' % (m_Name, m_elapsed * 1000 / m_jobs))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# 性能测试用到的公共函数
+import os
+import sys
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from farm.main import FarmHandler, RPCHandler, rpc_server  # noqa: E402
+
+
+# 在临时目录下初始化一个FARM的配置数据库
+def create_farm_home():
+    m_home = tempfile.mkdtemp(prefix='farm_bench_')
+    m_handler = FarmHandler()
+    m_handler.set_home(m_home)
+    m_handler.init_config_db()
+    return m_home
+
+
+# 连接到临时目录下的FARM配置数据库
+def open_farm_handler(p_home):
+    m_handler = FarmHandler()
+    m_handler.set_home(p_home)
+    m_handler.connect_config_db()
+    return m_handler
+
+
+# 找到一个空闲的端口
+def free_port():
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    m_port = s.getsockname()[1]
+    s.close()
+    return m_port
+
+
+# 在后台线程中启动RPC服务
+#   p_transaction为批量调用使用的事务，p_waiting为可能长时间等待的函数
+def start_rpc_server(p_functions, p_transaction=None, p_waiting=()):
+    handler = RPCHandler()
+    for func in p_functions:
+        handler.register_function(func)
+    for func in p_waiting:
+        handler.register_function(func, waiting=True)
+    if p_transaction is not None:
+        handler.set_transaction(p_transaction)
+    m_port = free_port()
+    t = threading.Thread(target=rpc_server, args=(handler, ('localhost', m_port), b'welcome'))
+    t.daemon = True
+    t.start()
+    time.sleep(0.2)
+    return m_port
+
+
+@contextmanager
+def timer(p_result, p_key):
+    m_start = time.perf_counter()
+    yield
+    p_result[p_key] = time.perf_counter() - m_start
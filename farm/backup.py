@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import time
+from collections import deque
+
+from .workspace import file_digest, CHUNK_SIZE
+
+# 压缩级别，日志的压缩率在6以后基本没有提高，时间却要多很多
+COMPRESS_LEVEL = 6
+
+
+# 作业日志的备份目录（T_BACKUP）
+#   每个作业的输出压缩成一个文件：作业编号.tar.gz
+#   作业使用的测试程序文件按照内容保存在objects目录下，所有作业共用一份，
+#   作业的压缩文件中只记录这些文件的摘要（.farm_shared）
+class BackupStore(object):
+    SHARED = '.farm_shared'
+
+    def __init__(self, p_backup_directory):
+        self.backup_directory = p_backup_directory
+        # (源文件, 大小, 修改时间) -> 摘要，同一个进程中不需要重复计算没有变化的源文件的摘要
+        self.digests = {}
+
+    def archive_path(self, p_job_id):
+        return os.path.join(self.backup_directory, str(p_job_id) + '.tar.gz')
+
+    def object_path(self, p_digest):
+        return os.path.join(self.backup_directory, 'objects', p_digest[0:2], p_digest + '.gz')
+
+    # 按照内容保存一个源文件，返回摘要，源文件在作业结束以后被修改过的返回None
+    def store_object(self, p_source, p_size, p_mtime_ns, p_digest):
+        try:
+            m_Stat = os.stat(p_source)
+        except OSError:
+            return None
+        if [m_Stat.st_size, m_Stat.st_mtime_ns] != [p_size, p_mtime_ns]:
+            return None
+        m_Key = (p_source, p_size, p_mtime_ns)
+        m_Digest = p_digest or self.digests.get(m_Key) or file_digest(p_source)
+        self.digests[m_Key] = m_Digest
+        m_Object = self.object_path(m_Digest)
+        if not os.path.exists(m_Object):
+            os.makedirs(os.path.dirname(m_Object), exist_ok=True)
+            # 可能有多个Worker同时保存同一个文件，先写到临时文件中
+            m_TempFile = m_Object + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+            with open(p_source, 'rb') as fsrc, gzip.open(m_TempFile, 'wb', compresslevel=COMPRESS_LEVEL) as fdst:
+                shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+            os.replace(m_TempFile, m_Object)
+        return m_Digest
+
+    # 备份一个作业的暂存目录（参见Workspace.stage），完成以后删除暂存目录，返回统计信息
+    def write(self, p_job_id, p_staging):
+        m_Stats = {'Files': 0, 'Bytes': 0, 'Shared': 0, 'Lost': 0}
+        try:
+            with open(p_staging + '.json') as f:
+                m_Index = json.load(f)
+        except (OSError, ValueError):
+            # 暂存还没有完成Worker就退出了，只备份已经移过来的文件
+            m_Index = {}
+        m_Shared = {}
+        for m_RelPath, (m_Source, m_Size, m_MTime, m_Digest) in m_Index.items():
+            m_Shared[m_RelPath] = self.store_object(m_Source, m_Size, m_MTime, m_Digest)
+            if m_Shared[m_RelPath] is None:
+                m_Stats['Lost'] = m_Stats['Lost'] + 1
+            else:
+                m_Stats['Shared'] = m_Stats['Shared'] + 1
+
+        if not os.path.exists(self.backup_directory):
+            os.makedirs(self.backup_directory)
+        m_Archive = self.archive_path(p_job_id)
+        m_TempFile = m_Archive + '.tmp'
+        with tarfile.open(m_TempFile, 'w:gz', compresslevel=COMPRESS_LEVEL) as tar:
+            for m_Name in sorted(os.listdir(p_staging)):
+                tar.add(os.path.join(p_staging, m_Name), arcname=m_Name)
+            m_Data = json.dumps(m_Shared).encode('utf-8')
+            m_Info = tarfile.TarInfo(self.SHARED)
+            m_Info.size = len(m_Data)
+            m_Info.mtime = int(time.time())
+            tar.addfile(m_Info, io.BytesIO(m_Data))
+            m_Stats['Files'] = len([m_Member for m_Member in tar.getmembers() if m_Member.isfile()]) - 1
+        os.replace(m_TempFile, m_Archive)
+        m_Stats['Bytes'] = os.path.getsize(m_Archive)
+
+        shutil.rmtree(p_staging)
+        if os.path.exists(p_staging + '.json'):
+            os.remove(p_staging + '.json')
+        return m_Stats
+
+    # 把一个作业的备份恢复到p_target_directory下
+    def restore(self, p_job_id, p_target_directory):
+        with tarfile.open(self.archive_path(p_job_id), 'r:gz') as tar:
+            m_Shared = json.load(tar.extractfile(self.SHARED))
+            m_Members = [m_Member for m_Member in tar.getmembers() if m_Member.name != self.SHARED]
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(p_target_directory, m_Members, filter='data')
+            else:
+                tar.extractall(p_target_directory, m_Members)
+        for m_RelPath, m_Digest in m_Shared.items():
+            if m_Digest is None:
+                continue
+            m_Target = os.path.join(p_target_directory, m_RelPath)
+            os.makedirs(os.path.dirname(m_Target), exist_ok=True)
+            with gzip.open(self.object_path(m_Digest), 'rb') as fsrc, open(m_Target, 'wb') as fdst:
+                shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+
+
+# 在后台线程中备份作业，作业完成以后不需要等待备份就可以报告给服务端
+#   后台线程不输出信息（fork出来的作业进程可能因为输出的锁而死锁），结果放在done中，由调用者输出
+class BackupWriter(object):
+    def __init__(self, p_store):
+        self.store = p_store
+        self.queue = queue.Queue()
+        # 已经完成的备份(作业编号, 统计信息, 错误信息)
+        self.done = deque()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='farm-backup')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, p_job_id, p_staging):
+        self.queue.put((p_job_id, p_staging))
+
+    def run(self):
+        while True:
+            m_Task = self.queue.get()
+            if m_Task is None:
+                break
+            m_JobID, m_Staging = m_Task
+            try:
+                self.done.append((m_JobID, self.store.write(m_JobID, m_Staging), None))
+            except Exception as ex:
+                self.done.append((m_JobID, None, repr(ex)))
+
+    # 等所有提交的备份完成以后结束后台线程
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
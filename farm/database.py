@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# 语句缓存的统计信息
+#   sqlite3在每个连接上按照SQL文本缓存编译好的语句（LRU，大小为cached_statements），但是不提供命中的统计
+#   这里按照同样的规则在Session中模拟一份LRU，命中率是模拟出来的，不是sqlite3实际测量的结果
+#   所以叫做EmulatedHitRate：它只说明cached_statements（CACHED_STATEMENTS）是否装得下程序中用到的SQL，
+#   调整CACHED_STATEMENTS以后需要用实际的耗时（例如benchmark/bench_statements.py）来验证
+class StatementStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.statements = set()
+
+    def record(self, p_sql, p_hit):
+        with self.lock:
+            if p_hit:
+                self.hits = self.hits + 1
+            else:
+                self.misses = self.misses + 1
+                self.statements.add(p_sql)
+
+    def snapshot(self):
+        with self.lock:
+            m_total = self.hits + self.misses
+            return {
+                'Statements': len(self.statements),
+                'Hits': self.hits,
+                'Misses': self.misses,
+                'EmulatedHitRate': (float(self.hits) / m_total) if m_total else 0.0
+            }
+
+
+# 内存中的序列号生成器，服务端启动时从数据库中已有的最大值开始
+#   分配出去的序号如果因为事务回滚没有被使用，只会留下空洞，不会重复
+class Sequence(object):
+    def __init__(self, p_current):
+        self.lock = threading.Lock()
+        self.current = p_current or 0
+
+    # 一次分配p_count个连续的序号，返回其中第一个
+    def allocate(self, p_count=1):
+        with self.lock:
+            m_first = self.current + 1
+            self.current = self.current + p_count
+            return m_first
+
+
+# 对数据库连接的简单封装，所有的SQL都必须使用绑定变量
+class Session(object):
+    def __init__(self, p_conn, p_cache_size, p_stats):
+        self.conn = p_conn
+        self._cache_size = p_cache_size
+        self._cached = OrderedDict()
+        self._stats = p_stats
+        # 写连接上嵌套的事务，每一层记录提交和回滚以后要执行的操作
+        self.frames = []
+
+    # 记录一次语句的使用，按照sqlite3的语句缓存同样的LRU规则模拟是否命中
+    def _touch(self, p_sql):
+        if p_sql in self._cached:
+            self._cached.move_to_end(p_sql)
+            self._stats.record(p_sql, True)
+        else:
+            self._cached[p_sql] = None
+            if len(self._cached) > self._cache_size:
+                self._cached.popitem(last=False)
+            self._stats.record(p_sql, False)
+
+    def execute(self, p_sql, p_params=()):
+        self._touch(p_sql)
+        return self.conn.execute(p_sql, p_params)
+
+    def executemany(self, p_sql, p_seq_params):
+        self._touch(p_sql)
+        return self.conn.executemany(p_sql, p_seq_params)
+
+    # 事务最终提交以后要执行的操作，例如把新的作业放入内存中的队列
+    def on_commit(self, p_func):
+        self.frames[-1][0].append(p_func)
+
+    # 事务回滚以后要执行的操作，例如把已经取出的作业放回队列
+    def on_rollback(self, p_func):
+        self.frames[-1][1].append(p_func)
+
+    # 返回查询结果的第一行，没有结果返回None
+    def query_one(self, p_sql, p_params=()):
+        cursor = self.execute(p_sql, p_params)
+        try:
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    # 返回查询结果的所有行
+    def query_all(self, p_sql, p_params=()):
+        cursor = self.execute(p_sql, p_params)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+# 配置数据库的连接管理
+#   服务端启动后一直持有数据库连接，不再在每一次RPC调用时打开、关闭数据库
+#   每一个线程拥有一个自己的只读连接，所有的写操作都通过一个专用的写连接完成
+class ConnectionManager(object):
+    # 每个连接打开后都要设置的参数
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-65536",
+        "PRAGMA mmap_size=268435456",
+    )
+
+    # 每个连接上缓存的编译语句数量，要大于程序中用到的不同SQL的数量
+    CACHED_STATEMENTS = 256
+
+    def __init__(self, p_db_file, p_busy_timeout=30):
+        if not os.path.exists(p_db_file):
+            raise Exception("Config DB [" + p_db_file + "] not exist!")
+        self.db_file = p_db_file
+        self.busy_timeout = p_busy_timeout
+        self.stats = StatementStats()
+
+        # 写连接只有一个，使用的时候必须持有writer_lock
+        self.writer_lock = threading.RLock()
+        self._writer = self._open(p_readonly=False)
+        self._writer.conn.isolation_level = None
+
+        # 读连接按照线程分配
+        self._local = threading.local()
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+
+    # 打开一个新的数据库连接
+    def _open(self, p_readonly):
+        m_conn = sqlite3.connect(self.db_file, timeout=self.busy_timeout, check_same_thread=False,
+                                 cached_statements=self.CACHED_STATEMENTS)
+        for m_pragma in self.PRAGMAS:
+            m_conn.execute(m_pragma)
+        if p_readonly:
+            m_conn.execute("PRAGMA query_only=ON")
+        return Session(m_conn, self.CACHED_STATEMENTS, self.stats)
+
+    # 获得当前线程的只读连接
+    def reader(self):
+        m_session = getattr(self._local, 'session', None)
+        if m_session is not None:
+            return m_session
+
+        m_session = self._open(p_readonly=True)
+        self._local.session = m_session
+        with self._readers_lock:
+            # 顺便清理已经退出的线程留下来的连接
+            for m_thread in [t for t in self._readers if not t.is_alive()]:
+                self._readers.pop(m_thread).conn.close()
+            self._readers[threading.current_thread()] = m_session
+        return m_session
+
+    # 获得写连接，调用者需要持有writer_lock
+    def writer(self):
+        return self._writer
+
+    # 在写连接上完成一个事务，正常结束时提交，出现异常时回滚
+    #   同一个线程里嵌套的事务使用SAVEPOINT，只有最外层的事务结束时才真正提交
+    #   嵌套的事务出现异常时只回滚到它自己的SAVEPOINT
+    @contextmanager
+    def transaction(self):
+        with self.writer_lock:
+            m_Writer = self._writer
+            m_Depth = len(m_Writer.frames)
+            if m_Depth == 0:
+                m_Writer.conn.execute("BEGIN IMMEDIATE")
+            else:
+                m_Writer.conn.execute("SAVEPOINT farm_%d" % m_Depth)
+            m_Writer.frames.append(([], []))
+            try:
+                yield m_Writer
+            except BaseException:
+                m_OnCommit, m_OnRollback = m_Writer.frames.pop()
+                if m_Depth == 0:
+                    m_Writer.conn.execute("ROLLBACK")
+                else:
+                    m_Writer.conn.execute("ROLLBACK TO farm_%d" % m_Depth)
+                    m_Writer.conn.execute("RELEASE farm_%d" % m_Depth)
+                for m_Func in reversed(m_OnRollback):
+                    m_Func()
+                raise
+            m_OnCommit, m_OnRollback = m_Writer.frames.pop()
+            if m_Depth == 0:
+                try:
+                    m_Writer.conn.execute("COMMIT")
+                except BaseException:
+                    m_Writer.conn.execute("ROLLBACK")
+                    for m_Func in reversed(m_OnRollback):
+                        m_Func()
+                    raise
+                for m_Func in m_OnCommit:
+                    m_Func()
+            else:
+                # 交给外层的事务，外层的事务提交或者回滚时再执行
+                m_Writer.conn.execute("RELEASE farm_%d" % m_Depth)
+                m_Writer.frames[-1][0].extend(m_OnCommit)
+                m_Writer.frames[-1][1].extend(m_OnRollback)
+
+    # 语句缓存的统计信息，命中率按照CACHED_STATEMENTS模拟，见StatementStats
+    def statement_stats(self):
+        m_stats = self.stats.snapshot()
+        m_stats['CachedStatements'] = self.CACHED_STATEMENTS
+        return m_stats
+
+    # 关闭所有的连接
+    def close(self):
+        with self._readers_lock:
+            for m_session in self._readers.values():
+                m_session.conn.close()
+            self._readers.clear()
+        with self.writer_lock:
+            self._writer.conn.close()
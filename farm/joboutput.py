@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from collections import deque
+
+# 每个作业最多保留的输出行数
+TAIL_LINES = 1000
+# 每一行最多保留的字节数，过长的行会被截断
+MAX_LINE_BYTES = 4096
+# 开始查看一个作业时，从日志文件的最后多少字节开始读取
+TAIL_BYTES = 256 * 1024
+# 每次读取的大小
+READ_SIZE = 64 * 1024
+
+
+# Worker一端，读取作业日志（.tlg）中新增加的行
+#   作业进程直接写日志文件，Worker只在有人查看这个作业时才读取，不查看时没有任何开销
+#   新增加的内容超过TAIL_BYTES时，只读取最后的部分，内存和读取的数据量都不会随日志的大小增长
+class LogTail(object):
+    def __init__(self, p_path, p_max_lines=TAIL_LINES):
+        self.path = p_path
+        self.max_lines = p_max_lines
+        # 下次读取的位置，None表示还没有开始读取
+        self.offset = None
+        # 还没有换行符的最后一行
+        self.partial = b''
+
+    # 返回上次读取以后新增加的行，最多p_max_lines行
+    def read(self):
+        m_Lines = deque(maxlen=self.max_lines)
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return []
+        with f:
+            m_Size = os.fstat(f.fileno()).st_size
+            if self.offset is None or m_Size < self.offset or m_Size - self.offset > TAIL_BYTES:
+                # 第一次读取，或者新增加的内容太多，跳过前面的内容，第一行可能不完整，丢掉
+                self.offset = max(0, m_Size - TAIL_BYTES)
+                self.partial = b''
+                if self.offset > 0:
+                    f.seek(self.offset)
+                    m_Skipped = f.readline(MAX_LINE_BYTES)
+                    self.offset = self.offset + len(m_Skipped)
+            f.seek(self.offset)
+            while self.offset < m_Size:
+                m_Buf = f.read(min(READ_SIZE, m_Size - self.offset))
+                if not m_Buf:
+                    break
+                self.offset = self.offset + len(m_Buf)
+                m_Parts = (self.partial + m_Buf).split(b'\n')
+                self.partial = m_Parts.pop()[0:MAX_LINE_BYTES]
+                for m_Part in m_Parts:
+                    m_Lines.append(m_Part[0:MAX_LINE_BYTES].decode('utf-8', 'replace').rstrip('\r'))
+        return list(m_Lines)
+
+
+# 服务端一端，保存正在运行的作业最后的输出
+#   Worker定时报告正在运行的作业，只有正在被查看的作业才带上新的输出
+#   每个作业的输出是一个环形缓冲区，最多保留p_max_lines行
+#   超过p_keep_seconds没有Worker报告的作业（已经结束或者Worker已经退出）被清除
+class JobOutputs(object):
+    def __init__(self, p_max_lines=TAIL_LINES, p_watch_seconds=30, p_keep_seconds=60):
+        self.max_lines = p_max_lines
+        self.watch_seconds = p_watch_seconds
+        self.keep_seconds = p_keep_seconds
+        self.lock = threading.Lock()
+        # 作业编号 -> [输出行, 收到的总行数, 最后查看的时间, 最后报告的时间]
+        self.jobs = {}
+
+    def _entry(self, p_job_id, p_now):
+        m_Entry = self.jobs.get(p_job_id)
+        if m_Entry is None:
+            m_Entry = [deque(maxlen=self.max_lines), 0, 0.0, p_now]
+            self.jobs[p_job_id] = m_Entry
+        return m_Entry
+
+    def _expire(self, p_now):
+        for m_JobID in [m_JobID for m_JobID, m_Entry in self.jobs.items() if p_now - m_Entry[3] > self.keep_seconds]:
+            del self.jobs[m_JobID]
+
+    # Worker报告作业的新输出{作业编号: [输出行]}，返回正在被查看的作业编号
+    def update(self, p_outputs):
+        m_Now = time.monotonic()
+        m_Watched = []
+        with self.lock:
+            self._expire(m_Now)
+            for m_JobID, m_Lines in p_outputs.items():
+                m_Entry = self._entry(int(m_JobID), m_Now)
+                m_Entry[0].extend(m_Lines)
+                m_Entry[1] = m_Entry[1] + len(m_Lines)
+                m_Entry[3] = m_Now
+                if m_Now - m_Entry[2] < self.watch_seconds:
+                    m_Watched.append(m_JobID)
+        return m_Watched
+
+    # 返回作业最后的p_lines行，p_since为上次返回的行号，只返回之后的行
+    #   同时把作业标记为正在被查看，Worker下次报告时开始带上输出
+    #   返回(输出行, 最后一行的行号)
+    def tail(self, p_job_id, p_lines, p_since=0):
+        m_Now = time.monotonic()
+        with self.lock:
+            m_Entry = self._entry(int(p_job_id), m_Now)
+            m_Entry[2] = m_Now
+            m_Count = max(0, min(p_lines, m_Entry[1] - p_since, len(m_Entry[0])))
+            m_Lines = list(m_Entry[0])[len(m_Entry[0]) - m_Count:]
+            return m_Lines, m_Entry[1]
+
+    def watched_count(self):
+        m_Now = time.monotonic()
+        with self.lock:
+            return len([m_Entry for m_Entry in self.jobs.values() if m_Now - m_Entry[2] < self.watch_seconds])
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import threading
+from contextlib import contextmanager
+
+
+# 读写锁
+#   多个只读的调用可以同时持有共享锁，修改配置的调用需要持有排它锁
+#   有线程在等待排它锁时，新的共享锁请求需要等待，避免修改配置的请求被饿死
+#   同一个线程可以重复获得共享锁（批量调用时外层已经持有），但是不能从共享锁升级为排它锁
+class ReadWriteLock(object):
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_shared(self):
+        with self._cond:
+            # 持有排它锁或者已经持有共享锁的线程可以再获得共享锁
+            m_Held = getattr(self._local, 'shared', 0)
+            if self._writer is threading.current_thread() or m_Held > 0:
+                self._readers = self._readers + 1
+                self._local.shared = m_Held + 1
+                return
+            while self._writer is not None or self._writers_waiting > 0:
+                self._cond.wait()
+            self._readers = self._readers + 1
+            self._local.shared = 1
+
+    # 当前线程是否持有共享锁
+    def held_shared(self):
+        return getattr(self._local, 'shared', 0) > 0
+
+    def release_shared(self):
+        with self._cond:
+            self._readers = self._readers - 1
+            self._local.shared = self._local.shared - 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        if getattr(self._local, 'shared', 0) > 0:
+            raise RuntimeError('Cannot acquire exclusive lock while holding shared lock.')
+        with self._cond:
+            self._writers_waiting = self._writers_waiting + 1
+            try:
+                while self._writer is not None or self._readers > 0:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting = self._writers_waiting - 1
+            self._writer = threading.current_thread()
+
+    def release_exclusive(self):
+        with self._cond:
+            self._writer = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    @contextmanager
+    def exclusive(self):
+        self.acquire_exclusive()
+        try:
+            yield
+        finally:
+            self.release_exclusive()
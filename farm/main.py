@@ -1,111 +1,485 @@
 # -*- coding: utf-8 -*-
-import shlex
-import subprocess
 import traceback
 import socket
 
+import asyncio
 import click
-import pickle
-from multiprocessing.connection import Listener, Client
-from threading import Thread
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.connection import Client
 import os
 import sys
 import threading
 import sqlite3
 import time
-import shutil
 from time import strftime, localtime
 import getpass
 import signal
-import copy
-import distutils.dir_util
-from robot.result import ExecutionResult
-from robot import utils
-import csv
 
 from .__init__ import __version__
+from .database import ConnectionManager, Sequence
+from .scheduler import Scheduler, DurationHistory, LeaseTable, DependencyGraph, longest_first, critical_path
+from .locks import ReadWriteLock
+from .joboutput import JobOutputs
+from .rpcserver import AsyncRPCServer, RPC_PROTOCOL, rpc_encode, rpc_decode
+from .backup import BackupStore
+from .worker import run_job, get_test_path, JobContext, WorkerDaemon, Heartbeat, print_backup_result, \
+    read_summary, read_test_results
 
 
 # 处理远程调用
 class RPCHandler:
     def __init__(self):
-        self._functions = {}
-
-    def register_function(self, func):
+        self._functions = {'rpc_batch': self.rpc_batch}
+        self._nonblocking = set()
+        self._waiting = set()
+        self._transaction = None
+
+    # blocking为False的函数只访问内存中的数据，服务端直接在事件循环中调用，不再放到线程池中
+    # waiting为True的函数可能长时间等待（例如等待作业），服务端放到单独的线程池中，不占用普通调用的线程
+    #   这样的函数需要接受p_cancel参数，客户端发来下一个请求时服务端通过它结束等待
+    def register_function(self, func, blocking=True, waiting=False):
         self._functions[func.__name__] = func
+        if not blocking:
+            self._nonblocking.add(func.__name__)
+        if waiting:
+            self._waiting.add(func.__name__)
+
+    # 批量调用时使用的事务，一个批量调用中的所有函数在同一个事务中完成，只提交一次
+    def set_transaction(self, factory):
+        self._transaction = factory
+
+    def is_blocking(self, func_name):
+        return func_name not in self._nonblocking
+
+    def is_waiting(self, func_name):
+        return func_name in self._waiting
+
+    # 完成一次调用，出现异常时把异常作为结果返回给客户端
+    def dispatch(self, func_name, args, kwargs, cancel=None):
+        try:
+            if cancel is not None:
+                kwargs = dict(kwargs, p_cancel=cancel)
+            return self._functions[func_name](*args, **kwargs)
+        except Exception as e:
+            return e
+
+    # 批量调用，calls为[(func_name, args, kwargs), ...]，按照顺序执行，返回每一个调用的结果
+    #   单个调用出错只回滚它自己的修改，不影响同一批中的其他调用
+    def rpc_batch(self, calls):
+        if self._transaction is None:
+            return [self.dispatch(*call) for call in calls]
+        with self._transaction():
+            return [self.dispatch(*call) for call in calls]
+
+    # 协商报文格式，返回(协议版本, (func_name, args, kwargs))
+    #   客户端发送rpc_negotiate时，真正要调用的函数也放在这个请求中，协商不需要额外的往返
+    @staticmethod
+    def negotiate(func_name, args, kwargs):
+        if func_name != 'rpc_negotiate':
+            return 1, (func_name, args, kwargs)
+        version, func_name, args, kwargs = args
+        return min(version, RPC_PROTOCOL), (func_name, args, kwargs)
 
     def handle_connection(self, connection):
+        protocol = None
         try:
             while True:
                 # Receive a message
-                func_name, args, kwargs = pickle.loads(connection.recv())
+                request = rpc_decode(connection.recv_bytes(), protocol or 1)
+                if protocol is None:
+                    version, request = self.negotiate(*request)
                 # Run the RPC and send a response
-                try:
-                    r = self._functions[func_name](*args, **kwargs)
-                    connection.send(pickle.dumps(r))
-                except Exception as e:
-                    connection.send(pickle.dumps(e))
+                result = self.dispatch(*request)
+                if protocol is None:
+                    connection.send_bytes(rpc_encode((version, result) if version > 1 else result, 1))
+                    protocol = version
+                else:
+                    connection.send_bytes(rpc_encode(result, protocol))
         except EOFError:
             pass
 
 
-# 客户端调用RPC
-class RPCProxy:
-    def __init__(self, connection):
-        self._connection = connection
+# 一个已经发出、还没有收到应答的调用
+class RPCFuture:
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._done = False
+        self._result = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def done(self):
+        return self._done
+
+    # 等待应答，远程调用抛出的异常在这里抛出
+    def result(self):
+        while not self._done:
+            self._proxy.receive()
+        if isinstance(self._result, Exception):
+            raise self._result
+        return self._result
+
+
+# 流水线调用，每个调用只发送请求，马上返回RPCFuture
+#   服务端按照顺序处理同一个连接上的请求，应答也按照同样的顺序返回
+class RPCPipeline:
+    def __init__(self, proxy):
+        self._proxy = proxy
 
     def __getattr__(self, name):
         def do_rpc(*args, **kwargs):
-            self._connection.send(pickle.dumps((name, args, kwargs)))
-            result = pickle.loads(self._connection.recv())
-            if isinstance(result, Exception):
-                raise result
-            return result
+            return self._proxy.send(name, args, kwargs)
 
         return do_rpc
 
 
-# 反射方法，用来根据函数名字来调用具体的函数
-class SubTestClassFactory:
-    def __init__(self):
-        pass
+# 批量调用，先收集所有的调用，execute时作为一个请求发送
+#   服务端在同一个事务中按照顺序完成，例如finish_job和下一个get_todo_job只需要一次往返
+class RPCBatch:
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._calls = []
+        self._futures = []
+
+    def __getattr__(self, name):
+        def do_rpc(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            self._futures.append(RPCFuture(self._proxy))
+            return self._futures[-1]
+
+        return do_rpc
+
+    # 发送批量请求，返回整个批量调用的RPCFuture，不等待应答
+    def send(self):
+        m_Calls, m_Futures = self._calls, self._futures
+        self._calls, self._futures = [], []
+        return self._proxy.send('rpc_batch', (m_Calls, ), {}, m_Futures)
+
+    # 发送批量请求并等待应答，返回每一个调用的结果
+    def execute(self):
+        m_Futures = self._futures
+        self.send().result()
+        return [m_Future.result() for m_Future in m_Futures]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None and self._calls:
+            self.send().result()
+
+
+# 客户端调用RPC
+#   protocol为1时使用旧的报文格式，不和服务端协商
+#   同一个连接上最多有max_pending个还没有收到应答的请求，超过时先读取最早的应答
+class RPCProxy:
+    def __init__(self, connection, protocol=RPC_PROTOCOL, max_pending=64):
+        self._connection = connection
+        self._protocol = None if protocol > 1 else 1
+        self._max_pending = max_pending
+        self._pending = deque()
+
+    # 发送一个请求，返回RPCFuture
+    #   batch_futures不为空时，这是一个批量请求，应答中的每一个结果分别交给对应的RPCFuture
+    def send(self, name, args, kwargs, batch_futures=None):
+        future = RPCFuture(self)
+        if self._protocol is None:
+            # 第一次调用时协商报文格式，需要等到应答以后才能发送后面的请求
+            self._connection.send_bytes(rpc_encode(('rpc_negotiate', (RPC_PROTOCOL, name, args, kwargs), {}), 1))
+            result = rpc_decode(self._connection.recv_bytes(), 1)
+            if isinstance(result, KeyError) and result.args == ('rpc_negotiate', ):
+                # 旧版本的服务端不支持协商，重新用旧的格式发送
+                self._protocol = 1
+                return self.send(name, args, kwargs, batch_futures)
+            self._protocol, result = result
+            self._complete(future, result, batch_futures)
+            return future
+        while len(self._pending) >= self._max_pending:
+            self.receive()
+        self._connection.send_bytes(rpc_encode((name, args, kwargs), self._protocol))
+        self._pending.append((future, batch_futures))
+        return future
+
+    # 读取最早的一个应答
+    def receive(self):
+        future, batch_futures = self._pending.popleft()
+        self._complete(future, rpc_decode(self._connection.recv_bytes(), self._protocol), batch_futures)
 
     @staticmethod
-    def get_test(p_module_name, p_class_name):
-        obj_module = __import__(p_module_name)
-        return getattr(obj_module, p_class_name)
+    def _complete(future, result, batch_futures):
+        if batch_futures is not None:
+            if isinstance(result, Exception):
+                for batch_future in batch_futures:
+                    batch_future.set_result(result)
+            else:
+                for batch_future, batch_result in zip(batch_futures, result):
+                    batch_future.set_result(batch_result)
+        future.set_result(result)
+
+    def _call(self, name, args, kwargs):
+        return self.send(name, args, kwargs).result()
+
+    # 返回流水线调用的对象
+    def pipeline(self):
+        return RPCPipeline(self)
+
+    # 返回批量调用的对象
+    def batch(self):
+        return RPCBatch(self)
+
+    def __getattr__(self, name):
+        def do_rpc(*args, **kwargs):
+            return self._call(name, args, kwargs)
+
+        return do_rpc
 
 
 # 处理回归测试
 class FarmHandler(object):
     HomeDirectory = None
     conn = None
+    db = None
     lock = None
+    task_sequence = None
+    job_sequence = None
+    scheduler = None
+    job_outputs = None
+    durations = None
+    leases = None
+    lease_reaper = None
+    dependencies = None
+
+    # 服务端启动时从最近的多少个作业中重建预计运行时间
+    DURATION_HISTORY_JOBS = 100000
+
+    # Worker多久没有心跳以后回收它的作业
+    LEASE_SECONDS = 60
+    # 作业超过LIMIT_TIME多久还没有报告完成时回收，要大于Worker结束超时作业、报告结果需要的时间
+    RECLAIM_GRACE = 300
+    # 一个作业因为Worker丢失最多重新排队的次数，超过以后标记为ERROR
+    MAX_RECLAIMS = 2
+
+    # 派发给Worker的作业信息，claim_jobs按照这个顺序返回每个作业的值，get_todo_job返回同样的键
+    JOB_COLUMNS = ('MAIN_ENTRY', 'REGRESS_TYPE', 'ID', 'REGRESS_NAME', 'LABEL_NAME', 'PROPERTIES',
+                   'LIMIT_TIME', 'TASK_ID', 'REGRESS_OPTIONS')
+    # 按照作业编号批量读取作业时IN列表的长度，不足时用NULL补齐，这样只会用到几条不同的语句
+    CLAIM_QUERY_SIZES = (1, 8, 64, 512)
+
+    # 每一个测试的结果，Worker在作业完成时上传
+    #   按照任务查找失败的测试，按照测试的名字查找历史结果，都只需要读取索引中的一段
+    CREATE_TEST_RESULTS = 'CREATE TABLE FARM_TEST_RESULTS ' + \
+                          '(' + \
+                          '   JOB_ID                 INTEGER,' + \
+                          '   TASK_ID                INTEGER,' + \
+                          '   REGRESS_NAME              TEXT,' + \
+                          '   TEST_NAME                 TEXT,' + \
+                          '   STATUS                    TEXT,' + \
+                          '   ELAPSED                   REAL,' + \
+                          '   MESSAGE                   TEXT' + \
+                          ')'
+    TEST_RESULTS_INDEXES = (
+        'CREATE INDEX IDX_FARM_TEST_RESULTS_JOB ON FARM_TEST_RESULTS(JOB_ID)',
+        'CREATE INDEX IDX_FARM_TEST_RESULTS_TASK ON FARM_TEST_RESULTS(TASK_ID, STATUS)',
+        'CREATE INDEX IDX_FARM_TEST_RESULTS_TEST ON FARM_TEST_RESULTS(TEST_NAME, JOB_ID)',
+    )
+
+    # 资源标签组，同一类可以互相替代的资源（例如多个相同的数据库）放在一个组中
+    #   资源标签组和资源标签使用同一个名字空间，提交作业时可以指定任意一个
+    CREATE_LABEL_GROUPS = (
+        'CREATE TABLE FARM_LABEL_GROUP ' +
+        '(' +
+        '   NAME            TEXT,' +
+        '   DESCRIPTION     TEXT,' +
+        '   CREATED_DATE    TEXT' +
+        ')',
+        'CREATE UNIQUE INDEX IDX_FARM_LABEL_GROUP ON FARM_LABEL_GROUP(NAME)',
+        'CREATE TABLE FARM_LABEL_GROUP_LABEL ' +
+        '(' +
+        '   GROUP_NAME      TEXT,' +
+        '   LABEL_NAME      TEXT' +
+        ')',
+        'CREATE UNIQUE INDEX IDX_FARM_LABEL_GROUP_LABEL ON FARM_LABEL_GROUP_LABEL(GROUP_NAME, LABEL_NAME)',
+    )
+
+    # 作业之间的依赖关系
+    #   FARM_SUITE_DEPENDENCY定义套件中一个回归测试依赖的另一个回归测试
+    #   提交套件时展开为这个任务中作业之间的依赖关系FARM_JOB_DEPENDENCY，前置作业完成时按照依赖它的作业查找
+    CREATE_DEPENDENCIES = (
+        'CREATE TABLE FARM_SUITE_DEPENDENCY ' +
+        '(' +
+        '   SUITE_NAME      TEXT,' +
+        '   REGRESS_NAME    TEXT,' +
+        '   DEPENDS_ON      TEXT' +
+        ')',
+        'CREATE UNIQUE INDEX IDX_FARM_SUITE_DEPENDENCY ON FARM_SUITE_DEPENDENCY(SUITE_NAME, REGRESS_NAME, DEPENDS_ON)',
+        'CREATE TABLE FARM_JOB_DEPENDENCY ' +
+        '(' +
+        '   JOB_ID             INTEGER,' +
+        '   DEPENDS_ON_JOB_ID  INTEGER' +
+        ')',
+        'CREATE INDEX IDX_FARM_JOB_DEPENDENCY ON FARM_JOB_DEPENDENCY(DEPENDS_ON_JOB_ID, JOB_ID)',
+    )
 
     # 初始化构造函数
     def __init__(self, ):
-        self.lock = threading.RLock()
+        # 修改配置（回归测试、资源标签）时持有排它锁，其他的调用都只持有共享锁
+        # 作业的派发和完成只在调度器中锁住涉及到的资源标签
+        self.lock = ReadWriteLock()
+        self.scheduler = Scheduler()
+        # 正在运行的作业最后的输出，由Worker报告
+        self.job_outputs = JobOutputs()
+        # 每个回归测试的预计运行时间，派发时一个任务中预计时间长的作业先运行
+        self.durations = DurationHistory()
+        # 正在运行的作业的租约
+        self.leases = LeaseTable(self.LEASE_SECONDS)
+        # 等待前置作业完成的作业
+        self.dependencies = DependencyGraph()
 
     # 设置FARM的工作目录
     def set_home(self, p_directory):
         self.HomeDirectory = p_directory
 
-    # 连接配置数据库
+    # 连接配置数据库，服务端运行期间一直保持连接
     def connect_config_db(self):
+        if self.db is not None:
+            return
         dir_config_db = os.path.join(self.HomeDirectory, 'db')
         file_config_db = os.path.join(dir_config_db, 'farm.db')
-        if os.path.exists(file_config_db):
-            # 连接数据库
-            self.conn = sqlite3.connect(file_config_db)
-            return
-        else:
-            raise Exception("Config DB [" + file_config_db + "] not exist!")
+        self.db = ConnectionManager(file_config_db)
+        self.upgrade_config_db()
+
+        # 任务和作业的编号在内存中分配
+        m_conn = self.db.reader()
+        self.task_sequence = Sequence(m_conn.query_one("SELECT MAX(ID) FROM FARM_TASKS")[0])
+        self.job_sequence = Sequence(m_conn.query_one("SELECT MAX(ID) FROM FARM_JOBS")[0])
+
+        # 重建预计运行时间
+        self.durations.load(m_conn.query_all(
+            "SELECT REGRESS_NAME, LABEL_NAME, (julianday(COMPLETED_DATE) - julianday(STARTED_DATE)) * 86400 "
+            "FROM   FARM_JOBS "
+            "WHERE  ID > ? AND STATUS IN ('COMPLETED', 'TIMEOUT') AND STARTED_DATE IS NOT NULL "
+            "ORDER BY COMPLETED_DATE, ID", ((self.job_sequence.current or 0) - self.DURATION_HISTORY_JOBS, )))
+
+        # 重建资源容量和等待执行的作业队列，提交到资源标签组、还没有派发的作业放在组的队列中
+        self.scheduler.load_labels(m_conn.query_all("SELECT NAME, LABEL_CAPACITY FROM FARM_LABEL"))
+        self.scheduler.load_label_groups(m_conn.query_all(
+            "SELECT G.NAME, M.LABEL_NAME "
+            "FROM   FARM_LABEL_GROUP G LEFT JOIN FARM_LABEL_GROUP_LABEL M ON M.GROUP_NAME = G.NAME"))
+        # 等待前置作业完成的作业只重建依赖关系，不放入队列
+        m_Edges = m_conn.query_all("SELECT D.JOB_ID, D.DEPENDS_ON_JOB_ID "
+                                   "FROM   FARM_JOBS P, FARM_JOB_DEPENDENCY D "
+                                   "WHERE  P.STATUS IN ('NEW', 'WORKING', 'BLOCKED') AND D.DEPENDS_ON_JOB_ID = P.ID")
+        # 正在运行的作业也要知道优先级、用户和任务，被回收时才能回到原来的位置
+        m_Ordered, m_Blocked, m_Working = self.order_jobs(
+            m_conn.query_all("SELECT COALESCE(J.LABEL_GROUP_NAME, J.LABEL_NAME), J.ID, J.TASK_ID, "
+                             "       J.REGRESS_NAME, COALESCE(T.PRIORITY, 0), T.USER_NAME, J.STATUS, J.LABEL_NAME "
+                             "FROM   FARM_JOBS J LEFT JOIN FARM_TASKS T ON T.ID = J.TASK_ID "
+                             "WHERE  J.STATUS IN ('NEW', 'BLOCKED', 'WORKING') ORDER BY J.ID"), m_Edges)
+        self.dependencies.add(m_Edges, m_Blocked)
+        self.scheduler.load_jobs(m_Ordered, m_Working)
+        self.checkpoint_labels()
+
+        # 正在运行的作业重新给出租约，Worker在LEASE_SECONDS内发来心跳就可以继续运行
+        for m_JobID, m_MachineName, m_OsPid, m_Remaining in m_conn.query_all(
+                "SELECT J.ID, J.WORKER_MACHINE_NAME, J.WORKER_OS_PID, "
+                "       R.LIMIT_TIME - (julianday('now') - julianday(J.STARTED_DATE)) * 86400 "
+                "FROM   FARM_JOBS J LEFT JOIN FARM_REGRESS R ON R.NAME = J.REGRESS_NAME "
+                "WHERE  J.STATUS = 'WORKING'"):
+            self.leases.grant(m_JobID, (str(m_MachineName), str(m_OsPid)),
+                              max(m_Remaining or 0, 0) + self.RECLAIM_GRACE, self.LEASE_SECONDS)
+
+    # 重建等待队列时，每个任务中的作业按照关键路径长度（没有依赖关系时就是预计运行时间）从长到短排列
+    #   p_rows为按照作业编号排序的(队列的名字, ID, TASK_ID, REGRESS_NAME, PRIORITY, USER_NAME, STATUS, LABEL_NAME)
+    #   p_edges为还没有满足的依赖关系(ID, 依赖的作业的ID)
+    #   返回NEW作业[(队列的名字, ID, PRIORITY, USER_NAME, TASK_ID, 预计运行时间, 关键路径长度)]，
+    #   BLOCKED作业{ID: 关键路径长度}，
+    #   和WORKING作业[(LABEL_NAME, ID, PRIORITY, USER_NAME, TASK_ID, 预计运行时间, 关键路径长度)]
+    def order_jobs(self, p_rows, p_edges=()):
+        m_Groups = [(m_Key, list(m_Group))
+                    for m_Key, m_Group in itertools.groupby(p_rows, key=lambda row: (row[2], row[0]))]
+        m_Estimates = {}
+        for (m_TaskID, m_LabelName), m_Group in m_Groups:
+            m_Estimates.update(zip([row[1] for row in m_Group],
+                                   self.durations.estimate([row[3] for row in m_Group], m_LabelName)))
+        m_Ranks = critical_path(m_Estimates, p_edges) or m_Estimates
+
+        m_Ordered = []
+        m_Blocked = {}
+        m_Working = []
+        for (m_TaskID, m_LabelName), m_Group in m_Groups:
+            m_New = [row for row in m_Group if row[6] == 'NEW']
+            m_Blocked.update((row[1], m_Ranks[row[1]]) for row in m_Group if row[6] == 'BLOCKED')
+            m_Working.extend((row[7], row[1], row[4], row[5], m_TaskID, m_Estimates[row[1]], m_Ranks[row[1]])
+                             for row in m_Group if row[6] == 'WORKING')
+            m_Order = longest_first([m_Ranks[row[1]] for row in m_New])
+            m_Ordered.extend((m_LabelName, m_New[i][1], m_New[i][4], m_New[i][5], m_TaskID,
+                              m_Estimates[m_New[i][1]], m_Ranks[m_New[i][1]]) for i in m_Order)
+        return m_Ordered, m_Blocked, m_Working
 
     # 断开数据库连接
     def disconnect_config_db(self):
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        if self.lease_reaper is not None:
+            self.leases.close()
+            self.lease_reaper.join()
+            self.lease_reaper = None
+        if self.db:
+            self.checkpoint_labels()
+            self.db.close()
+            self.db = None
+
+    # 将内存中的资源占用情况写回到FARM_LABEL
+    def checkpoint_labels(self):
+        m_Changes = self.scheduler.checkpoint()
+        if len(m_Changes) == 0:
+            return
+        try:
+            with self.db.transaction() as m_conn:
+                m_conn.executemany("UPDATE FARM_LABEL SET CURRENT_USED = ? WHERE NAME = ?", m_Changes)
+        except Exception:
+            self.scheduler.mark_dirty([m_LabelName for m_Used, m_LabelName in m_Changes])
+            raise
+
+    # 升级之前版本创建的配置数据库
+    def upgrade_config_db(self):
+        with self.db.transaction() as m_conn:
+            # 早期版本的套件索引只包含SUITE_NAME，一个套件里只能放一个测试
+            m_Columns = [row[2] for row in m_conn.query_all("PRAGMA index_info(IDX_FARM_SUITE_REGRESS)")]
+            if m_Columns == ['SUITE_NAME']:
+                m_conn.execute("DROP INDEX IDX_FARM_SUITE_REGRESS")
+                m_conn.execute("CREATE UNIQUE INDEX IDX_FARM_SUITE_REGRESS "
+                               "ON FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME)")
+
+            # 按照状态查找作业的索引，用来重建等待执行的作业队列
+            m_conn.execute("CREATE INDEX IF NOT EXISTS IDX_FARM_JOBS_STATUS ON FARM_JOBS(STATUS, LABEL_NAME, ID)")
+
+            # 作业完成时报告的测试结果统计，作业因为Worker丢失被回收的次数，作业提交到的资源标签组
+            m_Columns = [row[1] for row in m_conn.query_all("PRAGMA table_info(FARM_JOBS)")]
+            for m_Column, m_Type in (('TESTS_TOTAL', 'INTEGER'), ('TESTS_PASSED', 'INTEGER'),
+                                     ('TESTS_FAILED', 'INTEGER'), ('TESTS_SKIPPED', 'INTEGER'),
+                                     ('TESTS_ELAPSED', 'REAL'), ('RECLAIMED_COUNT', 'INTEGER'),
+                                     ('LABEL_GROUP_NAME', 'TEXT')):
+                if m_Column not in m_Columns:
+                    m_conn.execute("ALTER TABLE FARM_JOBS ADD COLUMN " + m_Column + " " + m_Type)
+
+            # 每一个测试的结果
+            m_conn.execute(self.CREATE_TEST_RESULTS.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS'))
+            for m_Index in self.TEST_RESULTS_INDEXES:
+                m_conn.execute(m_Index.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS'))
+
+            # 任务的优先级
+            m_Columns = [row[1] for row in m_conn.query_all("PRAGMA table_info(FARM_TASKS)")]
+            if 'PRIORITY' not in m_Columns:
+                m_conn.execute("ALTER TABLE FARM_TASKS ADD COLUMN PRIORITY INTEGER")
+
+            # 资源标签组，作业之间的依赖关系
+            for sql in self.CREATE_LABEL_GROUPS + self.CREATE_DEPENDENCIES:
+                m_conn.execute(sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS')
+                               .replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX IF NOT EXISTS')
+                               .replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS'))
 
     # 初始化配置数据库
     def init_config_db(self):
@@ -128,8 +502,8 @@ class FarmHandler(object):
               ')'
         self.conn.execute(sql)
         # 插入默认数据
-        sql = "INSERT INTO FARM_CONFIG(CREATED_DATE, VERSION) VALUES(datetime('now'), '" + __version__ + "')"
-        self.conn.execute(sql)
+        sql = "INSERT INTO FARM_CONFIG(CREATED_DATE, VERSION) VALUES(datetime('now'), ?)"
+        self.conn.execute(sql, (__version__,))
 
         sql = 'CREATE TABLE FARM_REGRESS ' + \
               '(' + \
@@ -160,7 +534,7 @@ class FarmHandler(object):
               '   REGRESS_NAME    TEXT' + \
               ')'
         self.conn.execute(sql)
-        sql = 'CREATE UNIQUE INDEX IDX_FARM_SUITE_REGRESS ON FARM_SUITE_REGRESS(SUITE_NAME)'
+        sql = 'CREATE UNIQUE INDEX IDX_FARM_SUITE_REGRESS ON FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME)'
         self.conn.execute(sql)
 
         sql = 'CREATE TABLE FARM_LABEL ' + \
@@ -175,8 +549,15 @@ class FarmHandler(object):
         sql = 'CREATE UNIQUE INDEX IDX_FARM_LABEL ON FARM_LABEL(NAME)'
         self.conn.execute(sql)
 
+        for sql in self.CREATE_LABEL_GROUPS:
+            self.conn.execute(sql)
+
+        for sql in self.CREATE_DEPENDENCIES:
+            self.conn.execute(sql)
+
         '''
             STATUS:
+                BLOCKED      等待依赖的作业完成
                 NEW          未操作
                 WORKING      已经开始执行
                 COMPLETED    执行成功完成
@@ -200,7 +581,14 @@ class FarmHandler(object):
               '   WORKER_WORK_DIRECTORY     TEXT,' + \
               '   WORKER_BACKUP_DIRECTORY   TEXT,' + \
               '   REGRESS_OPTIONS           TEXT,' + \
-              '   NOTES                     TEXT' + \
+              '   NOTES                     TEXT,' + \
+              '   TESTS_TOTAL            INTEGER,' + \
+              '   TESTS_PASSED           INTEGER,' + \
+              '   TESTS_FAILED           INTEGER,' + \
+              '   TESTS_SKIPPED          INTEGER,' + \
+              '   TESTS_ELAPSED             REAL,' + \
+              '   RECLAIMED_COUNT        INTEGER,' + \
+              '   LABEL_GROUP_NAME          TEXT' + \
               ')'
         self.conn.execute(sql)
         sql = 'CREATE UNIQUE INDEX IDX_FARM_JOBS ON FARM_JOBS(ID)'
@@ -209,6 +597,8 @@ class FarmHandler(object):
         self.conn.execute(sql)
         sql = 'CREATE INDEX IDX_FARM_JOBS_LABEL ON FARM_JOBS(LABEL_NAME)'
         self.conn.execute(sql)
+        sql = 'CREATE INDEX IDX_FARM_JOBS_STATUS ON FARM_JOBS(STATUS, LABEL_NAME, ID)'
+        self.conn.execute(sql)
 
         sql = 'CREATE TABLE FARM_TASKS ' + \
               '(' + \
@@ -224,14 +614,21 @@ class FarmHandler(object):
               '   STATUS                      TEXT,' + \
               '   STARTED_DATE                TEXT,' + \
               '   COMPLETED_DATE              TEXT,' + \
-              '   REGRESS_OPTIONS             TEXT' + \
+              '   REGRESS_OPTIONS             TEXT,' + \
+              '   PRIORITY                 INTEGER' + \
               ')'
         self.conn.execute(sql)
         sql = 'CREATE UNIQUE INDEX IDX_FARM_TASKS ON FARM_TASKS(ID)'
         self.conn.execute(sql)
 
+        self.conn.execute(self.CREATE_TEST_RESULTS)
+        for sql in self.TEST_RESULTS_INDEXES:
+            self.conn.execute(sql)
+
         # 提交数据修改
         self.conn.commit()
+        self.conn.close()
+        self.conn = None
 
         print("Database init successful.")
 
@@ -240,36 +637,22 @@ class FarmHandler(object):
                     p_regress_name,
                     p_regress_main_entry, p_regress_limit_time,
                     p_regress_type):
+        self.lock.acquire_exclusive()
         try:
-
-            # 连接数据库
-            self.lock.acquire()
-            self.connect_config_db()
-
-            # 先判断一下是否之前有相关记录
-            m_RowCount = None
-            sql = "SELECT COUNT(*) FROM FARM_REGRESS WHERE NAME='" + p_regress_name + "'"
-            cursor = self.conn.execute(sql)
-            for row in cursor:
-                m_RowCount = str(row[0])
-                break
-            cursor.close()
-            if m_RowCount:
-                if int(m_RowCount) != 0:
+            with self.db.transaction() as m_conn:
+                # 先判断一下是否之前有相关记录
+                row = m_conn.query_one("SELECT COUNT(*) FROM FARM_REGRESS WHERE NAME = ?", (p_regress_name,))
+                if row[0] != 0:
                     return {'Result': False, 'Message': 'Regress [' + p_regress_name + '] already existed. add failed'}
 
-            # 插入新的记录
-            sql = 'INSERT INTO FARM_REGRESS(NAME,MAIN_ENTRY,LIMIT_TIME,REGRESS_TYPE) VALUES(' + \
-                  "'" + p_regress_name + "','" + p_regress_main_entry + "'," + \
-                  str(p_regress_limit_time) + ",'" + p_regress_type + "')"
-            self.conn.execute(sql)
-            self.conn.commit()
+                # 插入新的记录
+                m_conn.execute("INSERT INTO FARM_REGRESS(NAME, MAIN_ENTRY, LIMIT_TIME, REGRESS_TYPE) "
+                               "VALUES(?, ?, ?, ?)",
+                               (p_regress_name, p_regress_main_entry, int(p_regress_limit_time), p_regress_type))
         except Exception as e:
             return {'Result': False, 'Message': str(e)}
         finally:
-            # 断开数据库连接
-            self.disconnect_config_db()
-            self.lock.release()
+            self.lock.release_exclusive()
 
         # 返回结果
         return {'Result': True}
@@ -279,427 +662,698 @@ class FarmHandler(object):
 
     # 增加一个资源
     def create_label(self, p_label_name, p_label_properties, p_label_capacity):
+        self.lock.acquire_exclusive()
         try:
-            # 连接数据库
-            self.lock.acquire()
-            self.connect_config_db()
-
-            # 先判断一下是否之前有相关记录
-            m_RowCount = None
-            sql = "SELECT COUNT(*) FROM FARM_LABEL WHERE NAME='" + p_label_name + "'"
-            cursor = self.conn.execute(sql)
-            for row in cursor:
-                m_RowCount = str(row[0])
-                break
-            cursor.close()
-            if m_RowCount:
-                if int(m_RowCount) != 0:
+            with self.db.transaction() as m_conn:
+                # 先判断一下是否之前有相关记录
+                row = m_conn.query_one("SELECT (SELECT COUNT(*) FROM FARM_LABEL WHERE NAME = ?) + "
+                                       "       (SELECT COUNT(*) FROM FARM_LABEL_GROUP WHERE NAME = ?)",
+                                       (p_label_name, p_label_name))
+                if row[0] != 0:
                     return {'Result': False, 'Message': 'Label [' + p_label_name + '] already existed. add failed'}
 
-            # 插入新的记录
-            sql = 'INSERT INTO FARM_LABEL(NAME,PROPERTIES,LABEL_CAPACITY,CURRENT_USED) VALUES(' + \
-                  "'" + p_label_name + "','" + p_label_properties + "'," + str(p_label_capacity) + ",0)"
-            self.conn.execute(sql)
-
-            # 提交数据库事务
-            self.conn.commit()
-
+                # 插入新的记录
+                m_conn.execute("INSERT INTO FARM_LABEL(NAME, PROPERTIES, LABEL_CAPACITY, CURRENT_USED) "
+                               "VALUES(?, ?, ?, 0)",
+                               (p_label_name, p_label_properties, int(p_label_capacity)))
+                m_conn.on_commit(lambda: self.scheduler.define_label(p_label_name, int(p_label_capacity)))
         except Exception as e:
             return {'Result': False, 'Message': str(e)}
         finally:
-            # 断开数据库连接
-            self.disconnect_config_db()
-            self.lock.release()
+            self.lock.release_exclusive()
 
         # 返回结果
         return {'Result': True}
 
-    # 提交一个JOB
-    def submit_job(self, p_label_name, p_regress_or_suite_name, p_user_name, p_regress_options):
+    # 增加一个资源标签组
+    def create_label_group(self, p_label_group_name):
+        self.lock.acquire_exclusive()
         try:
-            # 连接数据库
-            self.lock.acquire()
-            self.connect_config_db()
-
-            # 记录到TASK中
-            m_TaskID = None
-            sql = "SELECT MAX(ID) FROM FARM_TASKS"
-            cursor = self.conn.execute(sql)
-            for row in cursor:
-                m_TaskID = row[0]
-                break
-            cursor.close()
-            if m_TaskID:
-                m_TaskID = m_TaskID + 1
-            else:
-                m_TaskID = 1
-            sql = 'INSERT INTO FARM_TASKS(' + \
-                  "ID,SUITE_OR_REGRESS_NAME,LABEL_NAME,RUNNING_JOBS,FAILED_JOBS,TOTAL_JOBS,COMPLETED_JOBS," \
-                  "SUBMITTED_DATE,USER_NAME, REGRESS_OPTIONS, STATUS) " + \
-                  'VALUES(' + str(m_TaskID) + "," + \
-                  "'" + p_regress_or_suite_name + "'," + \
-                  "'" + p_label_name + "'," + \
-                  "0,0,0,0,datetime('now')" + ",'" + p_user_name + "','" + str(p_regress_options) + "','NEW')"
-            self.conn.execute(sql)
-
-            # 查看提交的是否是一个测试套件
-            b_isTestSuite = False
-            m_nCountOfTasks = 0
-            sql = "SELECT REGRESS_NAME FROM FARM_SUITE_REGRESS " + \
-                  "WHERE SUITE_NAME = '" + p_regress_or_suite_name + "'"
-            cursor_suite = self.conn.execute(sql)
-            for row_suite in cursor_suite:
-                b_isTestSuite = True
-                # 依次将每一个测试放入到JOBS中
-                m_Regress_Name = row_suite[0]
-
-                # 找到最大的JOB记录
-                m_JobID = None
-                sql = "SELECT MAX(ID) FROM FARM_JOBS"
-                cursor = self.conn.execute(sql)
-                for row in cursor:
-                    m_JobID = row[0]
-                    break
-                cursor.close()
-                if m_JobID:
-                    m_JobID = m_JobID + 1
-                else:
-                    m_JobID = 1
+            with self.db.transaction() as m_conn:
+                # 资源标签组不能和资源标签重名
+                row = m_conn.query_one("SELECT (SELECT COUNT(*) FROM FARM_LABEL WHERE NAME = ?) + "
+                                       "       (SELECT COUNT(*) FROM FARM_LABEL_GROUP WHERE NAME = ?)",
+                                       (p_label_group_name, p_label_group_name))
+                if row[0] != 0:
+                    return {'Result': False,
+                            'Message': 'Label group [' + p_label_group_name + '] already existed. add failed'}
 
                 # 插入新的记录
-                sql = 'INSERT INTO FARM_JOBS(' + \
-                      'ID, TASK_ID, SUITE_NAME, REGRESS_NAME,LABEL_NAME,REGRESS_OPTIONS,SUBMITTED_DATE,STATUS) " +' \
-                      'VALUES(' + \
-                      str(m_JobID) + "," + str(m_TaskID) + "," + \
-                      "'" + p_regress_or_suite_name + "'," \
-                      "'" + m_Regress_Name + "'," \
-                      "'" + p_label_name + "'," \
-                      "'" + p_regress_options + "'," \
-                      "datetime('now')" + ",'NEW')"
-                self.conn.execute(sql)
-
-                m_nCountOfTasks = m_nCountOfTasks + 1
-            cursor_suite.close()
+                m_conn.execute("INSERT INTO FARM_LABEL_GROUP(NAME, CREATED_DATE) VALUES(?, datetime('now'))",
+                               (p_label_group_name,))
+                m_conn.on_commit(lambda: self.scheduler.define_label_group(p_label_group_name))
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+        finally:
+            self.lock.release_exclusive()
 
-            # 不是一个测试组件，就是一个单独的测试, Suite Name和Regress Name一样
-            if not b_isTestSuite:
-                # 找到最大的JOB记录
-                m_JobID = None
-                sql = "SELECT MAX(ID) FROM FARM_JOBS"
-                cursor = self.conn.execute(sql)
-                for row in cursor:
-                    m_JobID = row[0]
-                    break
-                cursor.close()
-                if m_JobID:
-                    m_JobID = m_JobID + 1
+        # 返回结果
+        return {'Result': True}
+
+    # 在资源标签组中加入(p_add为True)或者去掉一个资源标签
+    #   去掉的资源标签上已经开始运行的作业不受影响
+    def update_label_group(self, p_label_group_name, p_label_name, p_add=True):
+        self.lock.acquire_exclusive()
+        try:
+            with self.db.transaction() as m_conn:
+                row = m_conn.query_one("SELECT COUNT(*) FROM FARM_LABEL_GROUP WHERE NAME = ?", (p_label_group_name,))
+                if row[0] == 0:
+                    return {'Result': False, 'Message': 'Label group [' + p_label_group_name + '] does not exist.'}
+                row = m_conn.query_one("SELECT COUNT(*) FROM FARM_LABEL WHERE NAME = ?", (p_label_name,))
+                if row[0] == 0:
+                    return {'Result': False, 'Message': 'Label [' + p_label_name + '] does not exist.'}
+
+                if p_add:
+                    m_conn.execute("INSERT OR IGNORE INTO FARM_LABEL_GROUP_LABEL(GROUP_NAME, LABEL_NAME) VALUES(?, ?)",
+                                   (p_label_group_name, p_label_name))
+                    m_conn.on_commit(lambda: self.scheduler.add_group_label(p_label_group_name, p_label_name))
                 else:
-                    m_JobID = 1
-
-                # 插入新的JOB
-                sql = "INSERT INTO FARM_JOBS(" + \
-                      "ID, TASK_ID, SUITE_NAME, REGRESS_NAME,LABEL_NAME,REGRESS_OPTIONS,SUBMITTED_DATE,STATUS) " + \
-                      'VALUES(' + \
-                      str(m_JobID) + "," + str(m_TaskID) + "," + \
-                      "'" + p_regress_or_suite_name + "'," \
-                      "'" + p_regress_or_suite_name + "'," \
-                      "'" + p_label_name + "'," \
-                      "'" + p_regress_options + "'," \
-                      "datetime('now')" + ",'NEW')"
-                self.conn.execute(sql)
-
-                m_nCountOfTasks = 1
-
-            # 更新累计任务数量
-            sql = 'UPDATE FARM_TASKS ' + \
-                  "SET    TOTAL_JOBS = " + str(m_nCountOfTasks) + " " + \
-                  "WHERE  ID = " + str(m_TaskID)
-            self.conn.execute(sql)
+                    m_conn.execute("DELETE FROM FARM_LABEL_GROUP_LABEL WHERE GROUP_NAME = ? AND LABEL_NAME = ?",
+                                   (p_label_group_name, p_label_name))
+                    m_conn.on_commit(lambda: self.scheduler.remove_group_label(p_label_group_name, p_label_name))
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+        finally:
+            self.lock.release_exclusive()
 
-            # 提交数据库事务
-            self.conn.commit()
+        # 返回结果
+        return {'Result': True}
 
+    # 增加套件中回归测试之间的依赖关系，p_regress_name在p_depends_on完成以后才能派发
+    #   只影响以后提交的任务
+    def add_suite_dependency(self, p_suite_name, p_regress_name, p_depends_on):
+        self.lock.acquire_exclusive()
+        try:
+            with self.db.transaction() as m_conn:
+                for m_Name in (p_regress_name, p_depends_on):
+                    row = m_conn.query_one("SELECT COUNT(*) FROM FARM_SUITE_REGRESS "
+                                           "WHERE  SUITE_NAME = ? AND REGRESS_NAME = ?", (p_suite_name, m_Name))
+                    if row[0] == 0:
+                        return {'Result': False,
+                                'Message': 'Regress [' + m_Name + '] is not in suite [' + p_suite_name + '].'}
+
+                m_Edges = m_conn.query_all("SELECT REGRESS_NAME, DEPENDS_ON FROM FARM_SUITE_DEPENDENCY "
+                                           "WHERE  SUITE_NAME = ?", (p_suite_name,)) + [(p_regress_name, p_depends_on)]
+                if critical_path(dict.fromkeys([m_Name for m_Edge in m_Edges for m_Name in m_Edge], 0.0),
+                                 m_Edges) is None:
+                    return {'Result': False, 'Message': 'Dependency [' + p_regress_name + '] -> [' +
+                                                        p_depends_on + '] would create a cycle.'}
+                m_conn.execute("INSERT OR IGNORE INTO FARM_SUITE_DEPENDENCY(SUITE_NAME, REGRESS_NAME, DEPENDS_ON) "
+                               "VALUES(?, ?, ?)", (p_suite_name, p_regress_name, p_depends_on))
         except Exception as e:
             return {'Result': False, 'Message': str(e)}
         finally:
-            # 断开数据库连接
-            self.disconnect_config_db()
-            self.lock.release()
+            self.lock.release_exclusive()
+
+        # 返回结果
+        return {'Result': True}
+
+    # 提交一个JOB
+    #   p_label_name可以是一个资源标签组，这时作业在派发的时候才绑定到组中的一个资源标签
+    #   p_priority大的任务先派发，优先级相同时不同用户、同一个用户的不同任务之间按照预计运行时间公平分配
+    #   套件中有依赖关系的作业先标记为BLOCKED，前置作业全部完成时才进入等待队列
+    def submit_job(self, p_label_name, p_regress_or_suite_name, p_user_name, p_regress_options, p_priority=0):
+        try:
+            # 查看提交的是否是一个测试套件，这一步不需要持有锁
+            m_Regress_Names = [row[0] for row in self.db.reader().query_all(
+                "SELECT REGRESS_NAME FROM FARM_SUITE_REGRESS WHERE SUITE_NAME = ?", (p_regress_or_suite_name,))]
+
+            # 不是一个测试组件，就是一个单独的测试, Suite Name和Regress Name一样
+            if len(m_Regress_Names) == 0:
+                m_Regress_Names = [p_regress_or_suite_name]
+
+            # 套件中回归测试之间的依赖关系，换算成作业在套件中的序号
+            m_Edges = self.db.reader().query_all(
+                "SELECT REGRESS_NAME, DEPENDS_ON FROM FARM_SUITE_DEPENDENCY WHERE SUITE_NAME = ?",
+                (p_regress_or_suite_name,))
+            if m_Edges:
+                m_Indexes = {}
+                for i, m_Regress_Name in enumerate(m_Regress_Names):
+                    m_Indexes.setdefault(m_Regress_Name, []).append(i)
+                m_Edges = [(i, j) for m_Regress_Name, m_DependsOn in m_Edges
+                           for i in m_Indexes.get(m_Regress_Name, ()) for j in m_Indexes.get(m_DependsOn, ())]
+
+            # 每个作业的关键路径长度：自己和所有依赖它的作业中最长的一条链的预计运行时间
+            m_Estimates = self.durations.estimate(m_Regress_Names, p_label_name)
+            m_Ranks = critical_path(dict(enumerate(m_Estimates)), m_Edges)
+            if m_Ranks is None:
+                return {'Result': False, 'Message': 'Suite [' + p_regress_or_suite_name +
+                                                     '] has circular dependencies.'}
+            m_Blocked = set(i for i, j in m_Edges)
+
+            # 提交到资源标签组的作业在派发之前没有资源标签
+            if self.scheduler.is_group(p_label_name):
+                m_LabelName, m_LabelGroupName = None, p_label_name
+            else:
+                m_LabelName, m_LabelGroupName = p_label_name, None
+
+            # 一次性分配好所有的编号
+            m_TaskID = self.task_sequence.allocate()
+            m_FirstJobID = self.job_sequence.allocate(len(m_Regress_Names))
+
+            with self.lock.shared(), self.db.transaction() as m_conn:
+                # 记录到TASK中
+                m_conn.execute("INSERT INTO FARM_TASKS(ID, SUITE_OR_REGRESS_NAME, LABEL_NAME, "
+                               "       RUNNING_JOBS, FAILED_JOBS, TOTAL_JOBS, COMPLETED_JOBS, "
+                               "       SUBMITTED_DATE, USER_NAME, REGRESS_OPTIONS, STATUS, PRIORITY) "
+                               "VALUES(?, ?, ?, 0, 0, ?, 0, datetime('now'), ?, ?, 'NEW', ?)",
+                               (m_TaskID, p_regress_or_suite_name, p_label_name, len(m_Regress_Names),
+                                p_user_name, str(p_regress_options), int(p_priority)))
+
+                # 将每一个测试放入到JOBS中，有前置作业的测试等待前置作业完成
+                m_conn.executemany("INSERT INTO FARM_JOBS(ID, TASK_ID, SUITE_NAME, REGRESS_NAME, LABEL_NAME, "
+                                   "       LABEL_GROUP_NAME, REGRESS_OPTIONS, SUBMITTED_DATE, STATUS) "
+                                   "VALUES(?, ?, ?, ?, ?, ?, ?, datetime('now'), ?)",
+                                   [(m_FirstJobID + i, m_TaskID, p_regress_or_suite_name, m_Regress_Name,
+                                     m_LabelName, m_LabelGroupName, p_regress_options,
+                                     'BLOCKED' if i in m_Blocked else 'NEW')
+                                    for i, m_Regress_Name in enumerate(m_Regress_Names)])
+                m_conn.executemany("INSERT INTO FARM_JOB_DEPENDENCY(JOB_ID, DEPENDS_ON_JOB_ID) VALUES(?, ?)",
+                                   [(m_FirstJobID + i, m_FirstJobID + j) for i, j in m_Edges])
+
+                # 事务提交以后，新的作业才能够被派发，关键路径长的作业先派发
+                m_Ready = [i for i in range(len(m_Regress_Names)) if i not in m_Blocked]
+                m_Order = [m_Ready[k] for k in longest_first([m_Ranks[i] for i in m_Ready])]
+
+                def m_Submitted():
+                    self.dependencies.add([(m_FirstJobID + i, m_FirstJobID + j) for i, j in m_Edges],
+                                          dict((m_FirstJobID + i, m_Ranks[i]) for i in m_Blocked))
+                    self.scheduler.push(p_label_name, [m_FirstJobID + i for i in m_Order],
+                                        int(p_priority), p_user_name, m_TaskID,
+                                        [m_Estimates[i] for i in m_Order], [m_Ranks[i] for i in m_Order])
+                m_conn.on_commit(m_Submitted)
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
 
         # 返回结果
         return {'Result': True, 'JobID': m_TaskID}
 
     # 列表所有的JOB
-    def show_jobs(self, p_user_name):
+    #   p_compact为True时只返回一次列名，每一行是原始类型的元组，结果集大的时候报文要小得多
+    def show_jobs(self, p_user_name, p_compact=False):
         try:
-            # 连接数据库
-            self.lock.acquire()
-            self.connect_config_db()
+            self.lock.acquire_shared()
+            m_conn = self.db.reader()
 
             # 列出所有的JOB
-            m_Task_Details = []
-            m_Task_Detail = {}
-            sql = "SELECT ID,SUITE_OR_REGRESS_NAME,LABEL_NAME," + \
-                  "       TOTAL_JOBS,RUNNING_JOBS,COMPLETED_JOBS,STATUS,SUBMITTED_DATE FROM FARM_TASKS " + \
-                  "WHERE  USER_NAME = '" + p_user_name + "' " + \
-                  "ORDER BY ID"
-            cursor = self.conn.execute(sql)
-            for row in cursor:
-                m_Task_Detail['ID'] = str(row[0])
-                m_Task_Detail['SUITE_OR_REGRESS_NAME'] = str(row[1])
-                m_Task_Detail['LABEL_NAME'] = str(row[2])
-                m_Task_Detail['TOTAL_JOBS'] = str(row[3])
-                m_Task_Detail['RUNNING_JOBS'] = str(row[4])
-                m_Task_Detail['COMPLETED_JOBS'] = str(row[5])
-                m_Task_Detail['STATUS'] = str(row[6])
-                m_Task_Detail['SUBMITTED_DATE'] = str(row[7])
-                m_Task_Details.append(copy.copy(m_Task_Detail))
-            cursor.close()
-
+            m_Columns = ('ID', 'SUITE_OR_REGRESS_NAME', 'LABEL_NAME',
+                         'TOTAL_JOBS', 'RUNNING_JOBS', 'COMPLETED_JOBS', 'STATUS', 'SUBMITTED_DATE')
+            m_rows = m_conn.query_all("SELECT ID, SUITE_OR_REGRESS_NAME, LABEL_NAME, "
+                                      "       TOTAL_JOBS, RUNNING_JOBS, COMPLETED_JOBS, STATUS, SUBMITTED_DATE "
+                                      "FROM   FARM_TASKS "
+                                      "WHERE  USER_NAME = ? "
+                                      "ORDER BY ID", (p_user_name,))
+            if p_compact:
+                return {'Result': True, 'Columns': m_Columns, 'Rows': m_rows}
+            m_Task_Details = [dict(zip(m_Columns, map(str, row))) for row in m_rows]
         except Exception as e:
             return {'Result': False, 'Message': str(e)}
         finally:
-            # 断开数据库连接
-            self.disconnect_config_db()
-            self.lock.release()
+            self.lock.release_shared()
 
         # 返回结果
         return {'Result': True, 'Details': m_Task_Details}
 
     # 获得可以运行的JOB
-    def get_todo_job(self, p_worker_user_name, p_os_pid, p_machine_name, p_work_directory, p_backup_directory):
+    #   p_labels           只从这些资源标签中取作业，None表示任意资源标签
+    #   p_wait_timeout     没有可以执行的作业时最多等待的秒数，0表示不等待
+    #                      等待期间submit_job、finish_job让匹配的作业可以执行时马上被唤醒
+    #   p_cancel           服务端用来提前结束等待
+    def get_todo_job(self, p_worker_user_name, p_os_pid, p_machine_name, p_work_directory, p_backup_directory,
+                     p_labels=None, p_wait_timeout=0, p_cancel=None):
+        # 批量调用中已经持有共享锁和数据库事务，不能等待
+        if p_wait_timeout <= 0 or self.lock.held_shared():
+            return self._dispatch_job(p_worker_user_name, p_os_pid, p_machine_name,
+                                      p_work_directory, p_backup_directory, p_labels)
+
+        m_Deadline = time.monotonic() + p_wait_timeout
+        m_Waiter = self.scheduler.park(p_labels)
+        if p_cancel is not None:
+            p_cancel.add_callback(lambda: m_Waiter.wake(None))
         try:
-            # 连接数据库
-            self.lock.acquire()
-            self.connect_config_db()
-
-            # 列出可以执行的JOB
-            m_JobInfo = {'Result': False}
-            sql = "SELECT R.MAIN_ENTRY, R.REGRESS_TYPE," + \
-                  "       J.ID, J.REGRESS_NAME, J.LABEL_NAME, L.PROPERTIES," + \
-                  "       R.LIMIT_TIME, J.TASK_ID, J.REGRESS_OPTIONS " + \
-                  "FROM   FARM_LABEL L, FARM_JOBS J, FARM_REGRESS R " + \
-                  "WHERE  L.NAME = J.LABEL_NAME AND R.NAME = J.REGRESS_NAME " + \
-                  "AND    L.CURRENT_USED < L.LABEL_CAPACITY AND J.STATUS = 'NEW' " + \
-                  "LIMIT 1"
-            cursor = self.conn.execute(sql)
-            for row in cursor:
-                m_JobInfo['MAIN_ENTRY'] = str(row[0])
-                m_JobInfo['REGRESS_TYPE'] = str(row[1])
-                m_JobInfo['ID'] = str(row[2])
-                m_JobInfo['REGRESS_NAME'] = str(row[3])
-                m_JobInfo['LABEL_NAME'] = str(row[4])
-                m_JobInfo['PROPERTIES'] = str(row[5])
-                m_JobInfo['LIMIT_TIME'] = str(row[6])
-                m_JobInfo['TASK_ID'] = str(row[7])
-                m_JobInfo['REGRESS_OPTIONS'] = str(row[8])
-                m_JobInfo['Result'] = True
-                break
-            cursor.close()
-
-            if m_JobInfo['Result']:
-                # 标记当前作业已经开始执行
-                sql = 'UPDATE FARM_JOBS ' + \
-                      "SET STARTED_DATE = datetime('now'), " + \
-                      "    STATUS = 'WORKING' ," + \
-                      "    WORKER_USER_NAME = '" + p_worker_user_name + "' ," + \
-                      "    WORKER_OS_PID = '" + p_os_pid + "' ," + \
-                      "    WORKER_MACHINE_NAME = '" + p_machine_name + "' ," + \
-                      "    WORKER_WORK_DIRECTORY = '" + p_work_directory + "' ," + \
-                      "    WORKER_BACKUP_DIRECTORY = '" + p_backup_directory + "' " + \
-                      " WHERE ID = " + m_JobInfo['ID']
-                self.conn.execute(sql)
-                sql = 'SELECT RUNNING_JOBS FROM FARM_TASKS WHERE ID = ' + str(m_JobInfo['TASK_ID'])
-                cursor = self.conn.execute(sql)
-                m_Running_Jobs = 0
-                for row in cursor:
-                    m_Running_Jobs = str(row[0])
-                    break
-                cursor.close()
-                if m_Running_Jobs == 0:
-                    sql = 'UPDATE FARM_TASKS ' + \
-                          "SET STARTED_DATE = datetime('now') " + \
-                          "    RUNNING_JOBS = RUNNING_JOBS + 1 " + \
-                          "    STARTED_DATE = datetime('now') " + \
-                          "    STATUS = 'RUNNING' " + \
-                          " WHERE ID = " + m_JobInfo['TASK_ID']
-                else:
-                    sql = 'UPDATE FARM_TASKS ' + \
-                          "SET RUNNING_JOBS = RUNNING_JOBS + 1 " + \
-                          " WHERE ID = " + m_JobInfo['TASK_ID']
-                self.conn.execute(sql)
+            while True:
+                m_Waiter.clear()
+                m_Result = self._dispatch_job(p_worker_user_name, p_os_pid, p_machine_name,
+                                              p_work_directory, p_backup_directory, p_labels)
+                m_Remaining = m_Deadline - time.monotonic()
+                if m_Result['Result'] or m_Remaining <= 0 or (p_cancel is not None and p_cancel.cancelled):
+                    return m_Result
+                # 等待的时候不持有任何锁
+                m_Waiter.wait(m_Remaining)
+        finally:
+            self.scheduler.unpark(m_Waiter)
 
-                # 提交数据库事务
-                self.conn.commit()
-            else:
-                return {'Result': False, 'Message': 'No TASK TO DO ....'}
+    # 派发一个JOB，没有可以执行的JOB时马上返回
+    def _dispatch_job(self, p_worker_user_name, p_os_pid, p_machine_name, p_work_directory, p_backup_directory,
+                      p_labels):
+        m_Result = self._claim_jobs(p_worker_user_name, p_os_pid, p_machine_name, p_work_directory,
+                                    p_backup_directory, p_labels, 1)
+        if not m_Result['Result']:
+            return m_Result
+        if not m_Result['Rows']:
+            return {'Result': False, 'Message': 'No TASK TO DO ....'}
+        m_JobInfo = dict(zip(self.JOB_COLUMNS, m_Result['Rows'][0]))
+        m_JobInfo['Result'] = True
+        return m_JobInfo
+
+    # 一次派发最多p_max_jobs个作业，有多个空闲位置的Worker只需要一次调用
+    #   所有作业在同一个事务中标记为WORKING，返回{'Result': True, 'Columns': JOB_COLUMNS, 'Rows': [...]}
+    #   没有可以执行的作业时Rows为空，不会等待
+    def claim_jobs(self, p_worker_user_name, p_os_pid, p_machine_name, p_work_directory, p_backup_directory,
+                   p_labels=None, p_max_jobs=1):
+        return self._claim_jobs(p_worker_user_name, p_os_pid, p_machine_name, p_work_directory,
+                                p_backup_directory, p_labels, int(p_max_jobs))
+
+    # 读取取出的作业派发需要的信息，p_claimed为scheduler.claim_many的返回值
+    #   资源标签组中的作业使用派发时绑定的资源标签
+    #   返回{ID: row}，回归测试或者资源标签不存在的作业不在结果中
+    def _read_claimed_jobs(self, p_conn, p_claimed):
+        m_Bound = {}
+        m_Properties = {}
+        for m_QueueName, m_LabelName, m_JobID in p_claimed:
+            m_Bound[m_JobID] = m_LabelName
+            if m_LabelName not in m_Properties:
+                m_Properties[m_LabelName] = p_conn.query_one("SELECT PROPERTIES FROM FARM_LABEL WHERE NAME = ?",
+                                                             (m_LabelName,))
+        m_JobIDs = list(m_Bound)
+        m_Rows = {}
+        m_MaxSize = self.CLAIM_QUERY_SIZES[-1]
+        for i in range(0, len(m_JobIDs), m_MaxSize):
+            m_Chunk = m_JobIDs[i:i + m_MaxSize]
+            m_Size = next(m_Size for m_Size in self.CLAIM_QUERY_SIZES if m_Size >= len(m_Chunk))
+            for row in p_conn.query_all("SELECT R.MAIN_ENTRY, R.REGRESS_TYPE, J.ID, J.REGRESS_NAME, "
+                                        "       R.LIMIT_TIME, J.TASK_ID, J.REGRESS_OPTIONS "
+                                        "FROM   FARM_JOBS J, FARM_REGRESS R "
+                                        "WHERE  J.ID IN (" + ', '.join(['?'] * m_Size) + ") "
+                                        "AND    J.STATUS = 'NEW' AND R.NAME = J.REGRESS_NAME",
+                                        m_Chunk + [None] * (m_Size - len(m_Chunk))):
+                m_LabelName = m_Bound[row[2]]
+                if m_Properties[m_LabelName] is None:
+                    continue
+                m_Rows[row[2]] = row[:4] + (m_LabelName, m_Properties[m_LabelName][0]) + row[4:]
+        return m_Rows
+
+    def _claim_jobs(self, p_worker_user_name, p_os_pid, p_machine_name, p_work_directory, p_backup_directory,
+                    p_labels, p_max_jobs):
+        m_Claimed = []
+        try:
+            self.lock.acquire_shared()
+            m_Reader = self.db.reader()
+            # 从等待队列中取出最多p_max_jobs个可以执行的JOB，同时占用资源的容量
+            m_Rows = []
+            m_Missing = []
+            while len(m_Rows) < p_max_jobs:
+                m_Batch = self.scheduler.claim_many(p_labels, p_max_jobs - len(m_Rows))
+                if not m_Batch:
+                    break
+                m_Claimed.extend(m_Batch)
+                m_Found = self._read_claimed_jobs(m_Reader, m_Batch)
+                for m_Claim in m_Batch:
+                    m_JobID = m_Claim[2]
+                    if m_JobID in m_Found:
+                        m_Rows.append(m_Found[m_JobID])
+                        continue
+                    # 回归测试或者资源标签没有定义，这个JOB不会被执行，在派发的事务中标记为ERROR
+                    m_Missing.append(m_JobID)
+            if not m_Rows and not m_Missing:
+                return {'Result': True, 'Columns': self.JOB_COLUMNS, 'Rows': []}
+
+            with self.db.transaction() as m_conn:
+                # 事务回滚时（包括外层的批量调用回滚），作业还回到队列里
+                m_Owned, m_Claimed = m_Claimed, []
+                m_conn.on_rollback(lambda: self.scheduler.unclaim_many(m_Owned))
+                # 事务提交以后作业由这个Worker持有，从派发开始LEASE_SECONDS内需要发送心跳，
+                # 第一次心跳之前就崩溃的Worker，作业不会一直等到LIMIT_TIME以后才回收
+                m_Owner = (str(p_machine_name), str(p_os_pid))
+
+                def grant_leases():
+                    for row in m_Rows:
+                        self.leases.grant(row[2], m_Owner, int(row[6] or 0) + self.RECLAIM_GRACE,
+                                          self.LEASE_SECONDS)
+                m_conn.on_commit(grant_leases)
+
+                for m_JobID in m_Missing:
+                    self._fail_missing_job(m_conn, m_JobID)
+
+                # 标记作业已经开始执行，资源标签组中的作业同时记录绑定的资源标签
+                m_conn.executemany("UPDATE FARM_JOBS "
+                                   "SET    STARTED_DATE = datetime('now'), "
+                                   "       STATUS = 'WORKING', "
+                                   "       LABEL_NAME = ?, "
+                                   "       WORKER_USER_NAME = ?, "
+                                   "       WORKER_OS_PID = ?, "
+                                   "       WORKER_MACHINE_NAME = ?, "
+                                   "       WORKER_WORK_DIRECTORY = ?, "
+                                   "       WORKER_BACKUP_DIRECTORY = ? "
+                                   "WHERE  ID = ?",
+                                   [(row[4], p_worker_user_name, p_os_pid, p_machine_name,
+                                     p_work_directory, p_backup_directory, row[2]) for row in m_Rows])
+                # 第一个开始运行的JOB同时记录TASK的开始时间，同一个任务的作业只更新一次
+                m_TaskJobs = {}
+                for row in m_Rows:
+                    m_TaskJobs[row[7]] = m_TaskJobs.get(row[7], 0) + 1
+                m_conn.executemany("UPDATE FARM_TASKS "
+                                   "SET    RUNNING_JOBS = RUNNING_JOBS + ?, "
+                                   "       STARTED_DATE = COALESCE(STARTED_DATE, datetime('now')), "
+                                   "       STATUS = 'RUNNING' "
+                                   "WHERE  ID = ?", [(m_Count, m_TaskID) for m_TaskID, m_Count in m_TaskJobs.items()])
         except Exception as e:
+            # 没有派发成功，作业还回到队列里
+            self.scheduler.unclaim_many(m_Claimed)
             print('str(e):  ', str(e))
             print('repr(e):  ', repr(e))
             print('traceback.print_exc():\n%s' % traceback.print_exc())
             print('traceback.format_exc():\n%s' % traceback.format_exc())
             return {'Result': False, 'Message': str(e)}
         finally:
-            # 断开数据库连接
-            self.disconnect_config_db()
-            self.lock.release()
-
-        return m_JobInfo
+            self.lock.release_shared()
+
+        return {'Result': True, 'Columns': self.JOB_COLUMNS,
+                'Rows': [tuple(str(m_Value) for m_Value in row) for row in m_Rows]}
+
+    # 回归测试或者资源标签不存在的作业不能执行，标记为ERROR
+    #   和其他结束的作业一样计入任务的完成数和失败数，依赖它的作业也可以继续派发
+    #   作业已经占用的资源容量在事务提交以后释放，事务回滚时和其他取出的作业一起放回队列
+    def _fail_missing_job(self, p_conn, p_job_id):
+        p_conn.on_commit(lambda: self.scheduler.release(p_job_id))
+        m_Cursor = p_conn.execute("UPDATE FARM_JOBS "
+                                  "SET    STATUS = 'ERROR', "
+                                  "       COMPLETED_DATE = datetime('now'), "
+                                  "       NOTES = 'Regress or label not exist.' "
+                                  "WHERE  ID = ? AND STATUS = 'NEW'", (p_job_id, ))
+        if m_Cursor.rowcount == 0:
+            return
+        self._release_dependents(p_conn, p_job_id)
+        p_conn.execute("UPDATE FARM_TASKS "
+                       "SET    COMPLETED_JOBS = COMPLETED_JOBS + 1, "
+                       "       FAILED_JOBS = FAILED_JOBS + 1, "
+                       "       COMPLETED_DATE = datetime('now') "
+                       "WHERE  ID IN (SELECT TASK_ID FROM FARM_JOBS WHERE ID = ?)", (p_job_id, ))
+        p_conn.on_commit(lambda: print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                                       'JOB [' + str(p_job_id) + '] failed, regress or label not exist.'))
 
     # 完成一个任务
-    def finish_job(self, p_job_id, p_job_status, p_notes):
+    #   p_summary为Worker汇总output.xml得到的测试结果统计{'Tests', 'Passed', 'Failed', 'Skipped', 'Elapsed'}
+    #   p_machine_name、p_os_pid为报告完成的Worker，作业被回收并且派发给了其他Worker以后，原来的Worker不能再完成它
+    #   服务端自己结束作业时（例如回收时超过了最终期限）不指定Worker
+    def finish_job(self, p_job_id, p_job_status, p_notes, p_summary=None, p_machine_name=None, p_os_pid=None):
+        m_Owner = None if p_machine_name is None else (str(p_machine_name), str(p_os_pid))
         try:
-            # 连接数据库
-            self.lock.acquire()
-            self.connect_config_db()
-
-            sql = "UPDATE FARM_JOBS " + \
-                  "SET    STATUS = ' " + p_job_status + "', " + \
-                  "       COMPLETED_DATE = datetime('now'), " + \
-                  "       NOTES = '" + p_notes + "'" + \
-                  "WHERE  ID = " + str(p_job_id)
-            self.conn.execute(sql)
+            self.lock.acquire_shared()
+            with self.db.transaction() as m_conn:
+                m_Sql = "UPDATE FARM_JOBS " \
+                        "SET    STATUS = ?, " \
+                        "       COMPLETED_DATE = datetime('now'), " \
+                        "       NOTES = ?, " \
+                        "       TESTS_TOTAL = ?, " \
+                        "       TESTS_PASSED = ?, " \
+                        "       TESTS_FAILED = ?, " \
+                        "       TESTS_SKIPPED = ?, " \
+                        "       TESTS_ELAPSED = ? " \
+                        "WHERE  ID = ? AND STATUS = 'WORKING'"
+                m_Parameters = (p_job_status, p_notes) + \
+                    tuple((p_summary or {}).get(m_Key)
+                          for m_Key in ('Tests', 'Passed', 'Failed', 'Skipped', 'Elapsed')) + \
+                    (int(p_job_id), )
+                if m_Owner is not None:
+                    m_Sql = m_Sql + " AND WORKER_MACHINE_NAME = ? AND WORKER_OS_PID = ?"
+                    m_Parameters = m_Parameters + m_Owner
+                m_Cursor = m_conn.execute(m_Sql, m_Parameters)
+                if m_Cursor.rowcount == 0:
+                    if m_Owner is not None:
+                        return {'Result': False, 'Message': 'Job [' + str(p_job_id) + '] is not running on worker [' +
+                                                            m_Owner[0] + ':' + m_Owner[1] + '].'}
+                    return {'Result': False, 'Message': 'Job [' + str(p_job_id) + '] is not running.'}
+                m_conn.on_commit(lambda: self.leases.drop(int(p_job_id), m_Owner))
+
+                # 事务提交以后才释放作业占用的资源容量、唤醒等待的请求
+                #   提交之前作业还是WORKING，其他请求不能占用这个容量，事务回滚时也不需要再重新占用
+                #   同一个批量调用中后面的claim_jobs取不到这个容量，Worker接着发出的长轮询在提交后马上被唤醒
+                m_conn.on_commit(lambda: self.scheduler.release(int(p_job_id)))
+
+                # 正常完成和超时的作业记录运行时间，出错的作业（例如测试程序不存在）不能反映真实的运行时间
+                if p_job_status in ('COMPLETED', 'TIMEOUT'):
+                    m_row = m_conn.query_one("SELECT REGRESS_NAME, LABEL_NAME, "
+                                             "       (julianday(COMPLETED_DATE) - julianday(STARTED_DATE)) * 86400 "
+                                             "FROM   FARM_JOBS WHERE ID = ?", (int(p_job_id), ))
+                    m_conn.on_commit(lambda: self.record_duration(*m_row))
+
+                # 依赖这个作业的其他前置作业都已经完成的作业马上可以派发
+                self._release_dependents(m_conn, int(p_job_id))
+
+                m_conn.execute("UPDATE FARM_TASKS "
+                               "SET    RUNNING_JOBS = RUNNING_JOBS - 1, "
+                               "       COMPLETED_JOBS = COMPLETED_JOBS + 1, "
+                               "       FAILED_JOBS = FAILED_JOBS + ?, "
+                               "       COMPLETED_DATE = datetime('now') "
+                               "WHERE  ID IN (SELECT TASK_ID FROM FARM_JOBS WHERE ID = ?)",
+                               (0 if p_job_status == 'COMPLETED' else 1, int(p_job_id)))
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+        finally:
+            self.lock.release_shared()
 
-            sql = "UPDATE FARM_TASKS " + \
-                  "SET    RUNNING_JOBS = RUNNING_JOBS - 1, " + \
-                  "       COMPLETED_JOBS = COMPLETED_JOBS + 1 ," + \
-                  "       COMPLETED_DATE = datetime('now') " + \
-                  "WHERE  ID IN (SELECT TASK_ID FROM FARM_JOBS WHERE ID = " + str(p_job_id) + ")"
-            self.conn.execute(sql)
+        # 返回结果
+        return {'Result': True}
+
+    # 一个作业完成以后，释放所有前置作业都已经完成的作业
+    #   不需要等待整个阶段结束，每个作业在它自己的前置作业完成时就进入等待队列，按照关键路径长度派发
+    def _release_dependents(self, p_conn, p_job_id):
+        m_Dependents, m_Released = self.dependencies.finish(p_job_id)
+        if not m_Dependents:
+            return
+        p_conn.on_rollback(lambda: self.dependencies.undo(p_job_id, m_Dependents, m_Released))
+        if not m_Released:
+            return
+        m_rows = p_conn.query_all("SELECT COALESCE(J.LABEL_GROUP_NAME, J.LABEL_NAME), J.ID, J.REGRESS_NAME, "
+                                  "       COALESCE(T.PRIORITY, 0), T.USER_NAME, J.TASK_ID "
+                                  "FROM   FARM_JOB_DEPENDENCY D, FARM_JOBS J LEFT JOIN FARM_TASKS T ON T.ID = J.TASK_ID "
+                                  "WHERE  D.DEPENDS_ON_JOB_ID = ? AND J.ID = D.JOB_ID", (p_job_id, ))
+        m_Ready = []
+        for m_row in sorted((m_row for m_row in m_rows if m_row[1] in m_Released),
+                            key=lambda row: -m_Released[row[1]]):
+            m_Cursor = p_conn.execute("UPDATE FARM_JOBS SET STATUS = 'NEW' WHERE ID = ? AND STATUS = 'BLOCKED'",
+                                      (m_row[1], ))
+            if m_Cursor.rowcount == 1:
+                m_Ready.append(m_row + (self.durations.estimate([m_row[2]], m_row[0])[0], m_Released[m_row[1]]))
+
+        # 事务提交以后才能够被派发
+        def m_Push():
+            for m_QueueName, m_JobID, m_RegressName, m_Priority, m_UserName, m_TaskID, m_Cost, m_Rank in m_Ready:
+                self.scheduler.push(m_QueueName, (m_JobID, ), m_Priority, m_UserName, m_TaskID,
+                                    (m_Cost, ), (m_Rank, ))
+        p_conn.on_commit(m_Push)
+
+    # 记录一个作业的运行时间
+    #   同时记录和预计运行时间（不区分资源标签）之比，资源标签组在空闲容量相同的资源标签中选择最快的
+    def record_duration(self, p_regress_name, p_label_name, p_seconds):
+        self.scheduler.record_latency(p_label_name, p_seconds, self.durations.estimate([p_regress_name], None)[0])
+        self.durations.record(p_regress_name, p_label_name, p_seconds)
+
+    # Worker的心跳，延长p_job_ids的租约
+    #   返回已经不属于这个Worker的作业（租约到期以后已经被回收），Worker应该结束这些作业，不再报告
+    def heartbeat_jobs(self, p_machine_name, p_os_pid, p_job_ids):
+        try:
+            m_Lost = self.leases.renew([int(m_JobID) for m_JobID in p_job_ids], (str(p_machine_name), str(p_os_pid)))
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+
+        # 返回结果
+        return {'Result': True, 'Lost': m_Lost}
+
+    # 回收一个租约到期的作业
+    #   Worker没有心跳时重新排队，重新排队超过MAX_RECLAIMS次或者超过了最终期限时标记为ERROR
+    def reclaim_job(self, p_job_id, p_deadline_passed=False):
+        try:
+            with self.lock.shared(), self.db.transaction() as m_conn:
+                m_row = m_conn.query_one("SELECT STATUS, LABEL_NAME, TASK_ID, COALESCE(RECLAIMED_COUNT, 0), "
+                                         "       WORKER_MACHINE_NAME, WORKER_OS_PID, LABEL_GROUP_NAME "
+                                         "FROM   FARM_JOBS WHERE ID = ?", (int(p_job_id), ))
+                if m_row is None or m_row[0] != 'WORKING':
+                    return {'Result': False, 'Message': 'Job [' + str(p_job_id) + '] is not running.'}
+                m_Worker = str(m_row[4]) + ':' + str(m_row[5])
+                if p_deadline_passed or m_row[3] >= self.MAX_RECLAIMS:
+                    if p_deadline_passed:
+                        m_Notes = 'Worker [' + m_Worker + '] did not report after LIMIT TIME.'
+                    else:
+                        m_Notes = 'Worker lost ' + str(m_row[3] + 1) + ' times, last [' + m_Worker + '].'
+                    m_Result = self.finish_job(p_job_id, 'ERROR', m_Notes)
+                    if not m_Result['Result']:
+                        return m_Result
+                    m_Action = 'ERROR'
+                else:
+                    # 资源标签组中的作业回到组的队列中，重新选择资源标签
+                    m_conn.execute("UPDATE FARM_JOBS "
+                                   "SET    STATUS = 'NEW', "
+                                   "       STARTED_DATE = NULL, "
+                                   "       LABEL_NAME = ?, "
+                                   "       RECLAIMED_COUNT = ?, "
+                                   "       NOTES = ? "
+                                   "WHERE  ID = ?",
+                                   (m_row[1] if m_row[6] is None else None, m_row[3] + 1,
+                                    'Worker [' + m_Worker + '] lost, requeued.', int(p_job_id)))
+                    m_conn.execute("UPDATE FARM_TASKS "
+                                   "SET    RUNNING_JOBS = RUNNING_JOBS - 1 "
+                                   "WHERE  ID = ?", (m_row[2], ))
+                    # 作业放回队列的最前面，同时释放占用的资源容量
+                    m_conn.on_commit(lambda: self.scheduler.unclaim(m_row[6] or m_row[1], int(p_job_id)))
+                    m_Action = 'NEW'
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
 
-            # 提交数据库事务
-            self.conn.commit()
+        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+              'Reclaimed JOB ' + str(p_job_id) + ' from worker [' + m_Worker + '], status ' + m_Action)
+        # 返回结果
+        return {'Result': True, 'Status': m_Action}
+
+    # 回收线程：等待最早到期的租约，回收到期的作业
+    def reap_leases(self):
+        while True:
+            m_Expired = self.leases.wait_expired()
+            if m_Expired is None:
+                return
+            for m_JobID, m_DeadlinePassed in m_Expired:
+                m_Result = self.reclaim_job(m_JobID, m_DeadlinePassed)
+                if not m_Result['Result'] and 'is not running' not in m_Result['Message']:
+                    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                          'Reclaim JOB ' + str(m_JobID) + ' failed. ' + str(m_Result['Message']))
+
+    # 启动回收线程
+    def start_lease_reaper(self):
+        if self.lease_reaper is None:
+            self.lease_reaper = threading.Thread(target=self.reap_leases, name='lease_reaper')
+            self.lease_reaper.daemon = True
+            self.lease_reaper.start()
+
+    # 上传一个作业中每个测试的结果[(长名字, 状态, 用时秒, 失败的信息)]
+    #   在一个事务中批量插入，重复上传时替换掉之前的结果
+    def upload_test_results(self, p_job_id, p_test_results):
+        try:
+            with self.lock.shared(), self.db.transaction() as m_conn:
+                m_row = m_conn.query_one("SELECT TASK_ID, REGRESS_NAME FROM FARM_JOBS WHERE ID = ?", (int(p_job_id),))
+                if m_row is None:
+                    return {'Result': False, 'Message': 'Job [' + str(p_job_id) + '] does not exist.'}
+                m_conn.execute("DELETE FROM FARM_TEST_RESULTS WHERE JOB_ID = ?", (int(p_job_id),))
+                m_conn.executemany("INSERT INTO FARM_TEST_RESULTS(JOB_ID, TASK_ID, REGRESS_NAME, "
+                                   "       TEST_NAME, STATUS, ELAPSED, MESSAGE) "
+                                   "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                                   [(int(p_job_id), m_row[0], m_row[1], m_Name, m_Status, m_Elapsed, m_Message)
+                                    for m_Name, m_Status, m_Elapsed, m_Message in p_test_results])
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
 
+        # 返回结果
+        return {'Result': True, 'Tests': len(p_test_results)}
+
+    # 列出一个任务中失败的测试
+    def show_failed_tests(self, p_task_id):
+        try:
+            self.lock.acquire_shared()
+            m_Columns = ('JOB_ID', 'REGRESS_NAME', 'TEST_NAME', 'STATUS', 'ELAPSED', 'MESSAGE')
+            m_rows = self.db.reader().query_all("SELECT JOB_ID, REGRESS_NAME, TEST_NAME, STATUS, ELAPSED, MESSAGE "
+                                                "FROM   FARM_TEST_RESULTS "
+                                                "WHERE  TASK_ID = ? AND STATUS = 'FAIL' "
+                                                "ORDER BY JOB_ID, ROWID", (int(p_task_id),))
         except Exception as e:
             return {'Result': False, 'Message': str(e)}
         finally:
-            # 断开数据库连接
-            self.disconnect_config_db()
-            self.lock.release()
+            self.lock.release_shared()
 
         # 返回结果
-        return {'Result': True}
+        return {'Result': True, 'Columns': m_Columns, 'Rows': m_rows}
+
+    # 列出一个测试最近p_limit次的结果，最新的在前面
+    #   p_regress_name不为None时只列出这个回归测试中的结果
+    def show_test_history(self, p_test_name, p_regress_name=None, p_limit=20):
+        try:
+            self.lock.acquire_shared()
+            m_Columns = ('JOB_ID', 'TASK_ID', 'REGRESS_NAME', 'STATUS', 'ELAPSED', 'COMPLETED_DATE', 'MESSAGE')
+            m_rows = self.db.reader().query_all("SELECT R.JOB_ID, R.TASK_ID, R.REGRESS_NAME, R.STATUS, R.ELAPSED, "
+                                                "       J.COMPLETED_DATE, R.MESSAGE "
+                                                "FROM   FARM_TEST_RESULTS R LEFT JOIN FARM_JOBS J ON J.ID = R.JOB_ID "
+                                                "WHERE  R.TEST_NAME = ? AND (? IS NULL OR R.REGRESS_NAME = ?) "
+                                                "ORDER BY R.JOB_ID DESC LIMIT ?",
+                                                (p_test_name, p_regress_name, p_regress_name, int(p_limit)))
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+        finally:
+            self.lock.release_shared()
+
+        # 返回结果
+        return {'Result': True, 'Columns': m_Columns, 'Rows': m_rows}
+
+    # Worker定时报告正在运行的作业的输出{作业编号: [新的输出行]}
+    #   只有正在被查看的作业才会带上输出，返回正在被查看的作业，Worker下次报告时带上这些作业的输出
+    def report_job_output(self, p_outputs):
+        try:
+            m_Watched = self.job_outputs.update(p_outputs)
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+
+        # 返回结果
+        return {'Result': True, 'Watched': m_Watched}
+
+    # 查看正在运行的作业最后的p_lines行输出
+    #   p_since为上次返回的LineNo，只返回之后的输出，用来持续地查看
+    #   第一次查看一个作业时还没有输出，Worker下次报告以后才会有
+    def tail_job(self, p_job_id, p_lines=50, p_since=0):
+        try:
+            self.lock.acquire_shared()
+            m_row = self.db.reader().query_one("SELECT STATUS FROM FARM_JOBS WHERE ID = ?", (int(p_job_id),))
+            if m_row is None:
+                return {'Result': False, 'Message': 'Job [' + str(p_job_id) + '] does not exist.'}
+            if m_row[0] != 'WORKING' and int(p_job_id) not in self.job_outputs.jobs:
+                return {'Result': False, 'Message': 'Job [' + str(p_job_id) + '] is not running. Status [' +
+                                                    str(m_row[0]) + ']'}
+            m_Lines, m_LineNo = self.job_outputs.tail(p_job_id, p_lines, p_since)
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+        finally:
+            self.lock.release_shared()
+
+        # 返回结果
+        return {'Result': True, 'Status': m_row[0], 'Lines': m_Lines, 'LineNo': m_LineNo}
+
+    # 批量调用使用的事务
+    #   先获得共享锁再开始事务，和单独的调用保持同样的加锁顺序
+    #   批量调用中的每一个调用在自己的SAVEPOINT中完成，整个批量调用只提交一次
+    @contextmanager
+    def batch_transaction(self):
+        with self.lock.shared(), self.db.transaction() as m_conn:
+            yield m_conn
+
+    # 服务端的运行统计信息
+    def show_stats(self):
+        try:
+            m_Stats = {
+                'StatementCache': self.db.statement_stats(),
+                'Scheduler': {
+                    'ReadyJobs': self.scheduler.ready_count(),
+                    'RunningJobs': self.scheduler.running_count(),
+                    'WaitingWorkers': self.scheduler.waiting_count(),
+                    'KnownDurations': self.durations.known_count(),
+                    'Leases': self.leases.count(),
+                    'BlockedJobs': self.dependencies.blocked_count()
+                },
+                'JobOutputs': {
+                    'WatchedJobs': self.job_outputs.watched_count()
+                }
+            }
+        except Exception as e:
+            return {'Result': False, 'Message': str(e)}
+
+        # 返回结果
+        return {'Result': True, 'Details': m_Stats}
 
 
 # 启动一个RPC服务，远程Worker能够连接上来
-def rpc_server(handler, address, authkey):
-    sock = Listener(address, authkey=authkey)
-    while True:
-        client = sock.accept()
-        t = Thread(target=handler.handle_connection, args=(client,))
-        t.daemon = True
-        t.start()
-
-
-# 运行具体的测试程序
-def run_test(p_test_main_file, p_test_main_class, p_sys_argv):
-    SubTestClassFactory().get_test(p_test_main_file, p_test_main_class)().run(p_sys_argv)
-
-
-# 运行RF测试程序
-def run_robot_framework_test(
-        p_test_main_entry,
-        p_test_module_name,
-        p_test_label_properties,
-        p_sys_argv):
-    def process_file(inpath, outpath, items):
-        suite = ExecutionResult(inpath).suite
-        outfile = open(outpath, 'w')
-        writer = csv.writer(outfile)
-        writer.writerow(['TYPE', 'NAME', 'STATUS', 'START', 'END', 'ELAPSED',
-                         'ELAPSED SECS'])
-        process_suite(suite, writer, items.lower())
-        outfile.close()
-
-    def process_suite(suite, writer, items, level=0):
-        if 'suite' in items:
-            process_item(suite, writer, level, 'Suite')
-        if 'keyword' in items:
-            for kw in suite.keywords:
-                process_keyword(kw, writer, level + 1)
-        for subsuite in suite.suites:
-            process_suite(subsuite, writer, items, level + 1)
-        for test in suite.tests:
-            process_test(test, writer, items, level + 1)
-
-    def process_test(test, writer, items, level):
-        if 'test' in items:
-            process_item(test, writer, level, 'Test', 'suite' not in items)
-        if 'keyword' in items:
-            for kw in test.keywords:
-                process_keyword(kw, writer, level + 1)
-
-    def process_keyword(kw, writer, level):
-        if kw is None:
-            return
-        process_item(kw, writer, level, kw.type.capitalize())
-        for subkw in kw.keywords:
-            process_keyword(subkw, writer, level + 1)
-
-    def process_item(item, writer, level, item_type, long_name=False):
-        indent = '' if level == 0 else ('|  ' * (level - 1) + '|- ')
-        name = (item.longname if long_name else item.name).encode('UTF-8')
-        elapsed = utils.elapsed_time_to_string(item.elapsedtime)
-        writer.writerow([indent + item_type, name, item.status, item.starttime,
-                         item.endtime, elapsed, item.elapsedtime / 1000.0])
-
-    m_robot_syslog = os.path.join(os.environ['T_WORK'], p_test_module_name + "_syslog.log")
-    m_robot_outputdir = os.environ['T_WORK']
-    os.environ['ROBOT_OPTIONS'] = "--critical regression --suitestatlevel 3"
-    os.environ['ROBOT_SYSLOG_FILE'] = m_robot_syslog
-    Commands = "robot --loglevel DEBUG:INFO --outputdir " + m_robot_outputdir + " " + p_test_main_entry
-
-    # 将p_test_label_properties中的信息变成环境变量
-    m_robot_environs = shlex.shlex(p_test_label_properties)
-    m_robot_environs.whitespace = ','
-    m_robot_environs.quotes = "'"
-    m_robot_environs.whitespace_split = True
-    for m_robot_environ_str in list(m_robot_environs):
-        m_nPos = m_robot_environ_str.find('=')
-        if m_nPos != -1:
-            m_robot_environ_key = m_robot_environ_str[0:m_nPos].strip()
-            m_robot_environ_value = m_robot_environ_str[m_nPos+1:].strip()
-        else:
-            m_robot_environ_key = m_robot_environ_str
-            m_robot_environ_value = "1"
-        os.environ[m_robot_environ_key] = m_robot_environ_value
-        print('label ENV [' + m_robot_environ_key + ']=[' + m_robot_environ_value + ']')
-
-    # 将p_sys_argv中的信息变成环境变量
-    m_robot_environs = shlex.shlex(p_sys_argv)
-    m_robot_environs.whitespace = ','
-    m_robot_environs.quotes = "'"
-    m_robot_environs.whitespace_split = True
-    for m_robot_environ_str in list(m_robot_environs):
-        m_nPos = m_robot_environ_str.find('=')
-        if m_nPos != -1:
-            m_robot_environ_key = m_robot_environ_str[0:m_nPos].strip()
-            m_robot_environ_value = m_robot_environ_str[m_nPos+1:].strip()
-        else:
-            m_robot_environ_key = m_robot_environ_str
-            m_robot_environ_value = "1"
-        os.environ[m_robot_environ_key] = m_robot_environ_value
-        print('Options ENV [' + m_robot_environ_key + ']=[' + m_robot_environ_value + ']')
-
-    # 启动RF程序
-    print("Will run robot command [" + Commands + "]")
-    if 'win32' in str(sys.platform).lower():
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags = subprocess.CREATE_NEW_CONSOLE | subprocess.STARTF_USESHOWWINDOW
-        startupinfo.wShowWindow = subprocess.SW_HIDE
-        p = subprocess.Popen(Commands,
-                             startupinfo=startupinfo)
-        p.communicate()
-    else:
-        p = subprocess.Popen(Commands,
-                             shell=True,
-                             stdout=subprocess.PIPE)
-        for output in p.stdout.readlines():
-            print(output.strip())
-    print("Finished command [" + Commands + "]")
-
-    # 处理一下报告日志，记录运行时间
-    process_file("output.xml", "output.csv", "suite-test-keyword")
+#   所有的连接由一个事件循环处理，RPC调用在有限大小的线程池中完成
+#   等待作业的调用使用另外一个线程池，最多max_waiters个请求同时等待
+def rpc_server(handler, address, authkey, max_connections=4096, max_workers=32, max_waiters=1024):
+    server = AsyncRPCServer(handler, address, authkey,
+                            p_max_connections=max_connections, p_max_workers=max_workers,
+                            p_max_waiters=max_waiters)
+    asyncio.run(server.serve_forever())
 
 
 # 定义中断信号的处理
@@ -718,17 +1372,46 @@ def signal_handler(signum, frame):
 @click.option("--regress_main_entry", type=str, help="Regress main file.")
 @click.option("--regress_limit_time", default=3600*1000, type=int, help="Regress limit time(S).")
 @click.option("--regress_options", default='', type=str, help="Regress options.")
+@click.option("--priority", default=0, type=int, help="Priority of submitted task, higher runs first.")
 @click.option("--regress_type", default='RF', type=str, help="Regress type.")
 @click.option("--create_label", is_flag=True, help="create a label resource")
 @click.option("--label_name", type=str, help="label resource name")
 @click.option("--label_properties", type=str, help="label resource properties")
 @click.option("--label_capacity", default=100, type=int, help="label resource capacity")
+@click.option("--create_label_group", is_flag=True, help="create a label group")
+@click.option("--update_label_group", is_flag=True, help="add a label to or remove a label from a label group")
+@click.option("--label_group_name", type=str, help="label group name")
+@click.option("--add", is_flag=True, help="add --label_name to --label_group_name")
+@click.option("--remove", is_flag=True, help="remove --label_name from --label_group_name")
+@click.option("--add_suite_dependency", is_flag=True,
+              help="--regress_name of --suite_name runs after --depends_on finished")
+@click.option("--suite_name", type=str, help="suite name")
+@click.option("--depends_on", type=str, help="regress name --regress_name depends on")
 @click.option("--submit", is_flag=True, help="Submit Job to Farm")
 @click.option("--show_jobs", is_flag=True, help="Display all jobs")
+@click.option("--show_stats", is_flag=True, help="Display server statistics")
+@click.option("--tail_job", default=None, type=int, help="Display last output lines of a running job")
+@click.option("--tail_lines", default=50, type=int, help="Output lines displayed by --tail_job")
+@click.option("--follow", is_flag=True, help="Keep displaying new output of --tail_job until the job finished")
+@click.option("--show_failed_tests", default=None, type=int, help="Display failed tests of a task")
+@click.option("--test_history", default=None, type=str,
+              help="Display latest results of a test (long name), --regress_name limits to one regress")
+@click.option("--history_limit", default=20, type=int, help="Results displayed by --test_history")
 @click.option("--start_server", is_flag=True, help="Start Farm Server")
 @click.option("--port", default=15000, type=int, help="Server Port")
 @click.option("--server", default='localhost', type=str, help="Server IP address")
+@click.option("--max_connections", default=4096, type=int, help="Max concurrent client connections of server")
+@click.option("--rpc_threads", default=32, type=int, help="Threads used by server to run RPC calls")
+@click.option("--max_waiters", default=1024, type=int, help="Max workers of server waiting for jobs at same time")
 @click.option("--start_worker", is_flag=True, help="Start Farm Worker")
+@click.option("--wait_timeout", default=0, type=int, help="Seconds worker waits for a job, 0 for no wait")
+@click.option("--worker_labels", default=None, type=str, help="Labels worker accepts jobs from, split by comma")
+@click.option("--worker_slots", default=0, type=int, help="Jobs a long-running worker runs at same time, "
+                                                            "0 to run one job and exit")
+@click.option("--workspace_mode", default='copy', type=click.Choice(['copy', 'hardlink', 'reflink']),
+              help="How worker fills work directory from T_SRCHOME, only changed files are synced")
+@click.option("--zygote", is_flag=True, help="Long-running worker preloads Robot Framework and forks every job "
+                                              "from itself")
 def farm(
         version,
         init,
@@ -737,17 +1420,41 @@ def farm(
         regress_main_entry,
         regress_limit_time,
         regress_options,
+        priority,
         regress_type,
         create_label,
         label_name,
         label_properties,
         label_capacity,
+        create_label_group,
+        update_label_group,
+        label_group_name,
+        add,
+        remove,
+        add_suite_dependency,
+        suite_name,
+        depends_on,
         submit,
         start_server,
         server,
         port,
+        max_connections,
+        rpc_threads,
+        max_waiters,
         start_worker,
-        show_jobs
+        wait_timeout,
+        worker_labels,
+        worker_slots,
+        workspace_mode,
+        zygote,
+        show_jobs,
+        show_stats,
+        tail_job,
+        tail_lines,
+        follow,
+        show_failed_tests,
+        test_history,
+        history_limit
 ):
     # 打印版本信息
     if version:
@@ -817,7 +1524,65 @@ def farm(
             print(m_Result['Message'])
             sys.exit(1)
 
+    # 增加一个资源标签组
+    if create_label_group:
+        if not label_group_name:
+            # 用户输入的参数有误
+            print('Missed necessary information.  Please set it and try again')
+            print("--create_label_group --label_group_name xxx")
+            sys.exit(1)
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_Result = proxy.create_label_group(p_label_group_name=label_group_name)
+        if m_Result['Result']:
+            print('Add label group successful.')
+            sys.exit(0)
+        else:
+            print(m_Result['Message'])
+            sys.exit(1)
+
+    # 在资源标签组中加入或者去掉一个资源标签
+    if update_label_group:
+        if not (label_group_name and label_name) or add == remove:
+            # 用户输入的参数有误
+            print('Missed necessary information.  Please set it and try again')
+            print("--update_label_group --label_group_name xxx --label_name xxx [--add|--remove]")
+            sys.exit(1)
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_Result = proxy.update_label_group(
+            p_label_group_name=label_group_name,
+            p_label_name=label_name,
+            p_add=add)
+        if m_Result['Result']:
+            print('Update label group successful.')
+            sys.exit(0)
+        else:
+            print(m_Result['Message'])
+            sys.exit(1)
+
+    # 增加套件中回归测试之间的依赖关系
+    if add_suite_dependency:
+        if not (suite_name and regress_name and depends_on):
+            # 用户输入的参数有误
+            print('Missed necessary information.  Please set it and try again')
+            print("--add_suite_dependency --suite_name xxx --regress_name xxx --depends_on xxx")
+            sys.exit(1)
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_Result = proxy.add_suite_dependency(
+            p_suite_name=suite_name,
+            p_regress_name=regress_name,
+            p_depends_on=depends_on)
+        if m_Result['Result']:
+            print('Add suite dependency successful.')
+            sys.exit(0)
+        else:
+            print(m_Result['Message'])
+            sys.exit(1)
+
     # 提交一个任务
+    #   --label_name可以是一个资源标签组，作业在派发时绑定到组中空闲容量最多的资源标签
     if submit:
         if not (label_name and regress_name):
             # 用户输入的参数有误
@@ -831,7 +1596,8 @@ def farm(
             p_label_name=label_name,
             p_regress_or_suite_name=regress_name,
             p_regress_options=regress_options,
-            p_user_name=getpass.getuser())
+            p_user_name=getpass.getuser(),
+            p_priority=priority)
         if m_Result['Result']:
             print('Job add successful. JobID = [' + str(m_Result['JobID']) + ']')
             sys.exit(0)
@@ -843,7 +1609,7 @@ def farm(
     if show_jobs:
         c = Client((server, port), authkey=b'welcome')
         proxy = RPCProxy(c)
-        m_Result = proxy.show_jobs(p_user_name=getpass.getuser())
+        m_Result = proxy.show_jobs(p_user_name=getpass.getuser(), p_compact=True)
         if m_Result['Result']:
             print('%5s %15s %10s %10s %15s %10s %20s' %
                   ('ID',
@@ -853,7 +1619,8 @@ def farm(
                    'TOTAL',
                    'STATUS',
                    'SUBMITTED_DATE'))
-            for result_detail in m_Result['Details']:
+            for row in m_Result['Rows']:
+                result_detail = dict(zip(m_Result['Columns'], map(str, row)))
                 print('%5s %15s %10s %10s %15s %10s %20s' %
                       (result_detail['ID'],
                        result_detail['SUITE_OR_REGRESS_NAME'],
@@ -868,6 +1635,86 @@ def farm(
             print(m_Result['Message'])
             sys.exit(1)
 
+    # 显示服务端的运行统计信息
+    if show_stats:
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_Result = proxy.show_stats()
+        if m_Result['Result']:
+            for m_Group, m_Stats in m_Result['Details'].items():
+                for m_Key, m_Value in m_Stats.items():
+                    print('%-20s %-20s %s' % (m_Group, m_Key, m_Value))
+            sys.exit(0)
+        else:
+            print(m_Result['Message'])
+            sys.exit(1)
+
+    # 显示正在运行的作业的输出
+    if tail_job is not None:
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_LineNo = 0
+        # 第一次查看时，要等Worker下一次报告以后才有输出
+        m_Deadline = time.time() + 10
+        while True:
+            m_Result = proxy.tail_job(p_job_id=tail_job, p_lines=tail_lines, p_since=m_LineNo)
+            if not m_Result['Result']:
+                if m_LineNo > 0:
+                    # 作业已经结束
+                    sys.exit(0)
+                print(m_Result['Message'])
+                sys.exit(1)
+            for m_Line in m_Result['Lines']:
+                print(m_Line)
+            m_LineNo = m_Result['LineNo']
+            if m_Result['Status'] != 'WORKING' or (not follow and (m_LineNo > 0 or time.time() > m_Deadline)):
+                sys.exit(0)
+            time.sleep(1)
+
+    # 显示一个任务中失败的测试
+    if show_failed_tests is not None:
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_Result = proxy.show_failed_tests(p_task_id=show_failed_tests)
+        if m_Result['Result']:
+            print('%8s %20s %-50s %10s  %s' % ('JOB_ID', 'REGRESS', 'TEST', 'ELAPSED', 'MESSAGE'))
+            for row in m_Result['Rows']:
+                result_detail = dict(zip(m_Result['Columns'], row))
+                print('%8s %20s %-50s %10.3f  %s' %
+                      (result_detail['JOB_ID'],
+                       result_detail['REGRESS_NAME'],
+                       result_detail['TEST_NAME'],
+                       result_detail['ELAPSED'] or 0,
+                       str(result_detail['MESSAGE'] or '').split('\n')[0]))
+            sys.exit(0)
+        else:
+            print(m_Result['Message'])
+            sys.exit(1)
+
+    # 显示一个测试最近的结果
+    if test_history is not None:
+        c = Client((server, port), authkey=b'welcome')
+        proxy = RPCProxy(c)
+        m_Result = proxy.show_test_history(p_test_name=test_history, p_regress_name=regress_name,
+                                           p_limit=history_limit)
+        if m_Result['Result']:
+            print('%8s %8s %20s %8s %10s %20s  %s' %
+                  ('JOB_ID', 'TASK_ID', 'REGRESS', 'STATUS', 'ELAPSED', 'COMPLETED_DATE', 'MESSAGE'))
+            for row in m_Result['Rows']:
+                result_detail = dict(zip(m_Result['Columns'], row))
+                print('%8s %8s %20s %8s %10.3f %20s  %s' %
+                      (result_detail['JOB_ID'],
+                       result_detail['TASK_ID'],
+                       result_detail['REGRESS_NAME'],
+                       result_detail['STATUS'],
+                       result_detail['ELAPSED'] or 0,
+                       result_detail['COMPLETED_DATE'],
+                       str(result_detail['MESSAGE'] or '').split('\n')[0]))
+            sys.exit(0)
+        else:
+            print(m_Result['Message'])
+            sys.exit(1)
+
     # 启动Farm服务端
     if start_server:
         try:
@@ -885,24 +1732,46 @@ def farm(
             m_FarmHandler.connect_config_db()
             print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Database connected.')
 
+            # 回收租约到期的作业
+            m_FarmHandler.start_lease_reaper()
+
             # 注册RPC服务
             handler = RPCHandler()
             handler.register_function(m_FarmHandler.show_jobs)
             handler.register_function(m_FarmHandler.submit_job)
             handler.register_function(m_FarmHandler.create_label)
+            handler.register_function(m_FarmHandler.create_label_group)
+            handler.register_function(m_FarmHandler.update_label_group)
+            handler.register_function(m_FarmHandler.add_suite_dependency)
             handler.register_function(m_FarmHandler.add_regress)
-            handler.register_function(m_FarmHandler.get_todo_job)
+            handler.register_function(m_FarmHandler.get_todo_job, waiting=True)
+            handler.register_function(m_FarmHandler.claim_jobs)
             handler.register_function(m_FarmHandler.finish_job)
+            handler.register_function(m_FarmHandler.show_stats, blocking=False)
+            handler.register_function(m_FarmHandler.report_job_output, blocking=False)
+            handler.register_function(m_FarmHandler.heartbeat_jobs, blocking=False)
+            handler.register_function(m_FarmHandler.tail_job)
+            handler.register_function(m_FarmHandler.upload_test_results)
+            handler.register_function(m_FarmHandler.show_failed_tests)
+            handler.register_function(m_FarmHandler.show_test_history)
+            handler.set_transaction(m_FarmHandler.batch_transaction)
             print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'RPC service registered.')
 
             # 启动服务
-            worker_thread = threading.Thread(target=rpc_server, args=(handler, ('localhost', port), b'welcome'))
+            worker_thread = threading.Thread(target=rpc_server,
+                                             args=(handler, ('localhost', port), b'welcome',
+                                                   max_connections, rpc_threads, max_waiters))
             worker_thread.setDaemon(True)
             worker_thread.start()
             print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'RPC service started.')
             while True:
                 # 打印一下当前的状态吧
                 time.sleep(20)
+                m_FarmHandler.checkpoint_labels()
+                m_Stats = m_FarmHandler.db.statement_stats()
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                      'Statement cache hit rate (emulated): %.2f%% (%d hits, %d misses, %d statements)' %
+                      (m_Stats['EmulatedHitRate'] * 100, m_Stats['Hits'], m_Stats['Misses'], m_Stats['Statements']))
 
         except Exception as e:
             print('str(e):  ', str(e))
@@ -936,10 +1805,20 @@ def farm(
             os.mkdir(m_backup_directory)
         print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Backup directory：' + m_backup_directory)
 
+        # 常驻的Worker，同时运行多个作业
+        if worker_slots > 0:
+            c = Client((server, port), authkey=b'welcome')
+            proxy = RPCProxy(c)
+            WorkerDaemon(proxy, c, worker_slots, m_work_directory, m_backup_directory,
+                         p_labels=worker_labels.split(',') if worker_labels else None,
+                         p_wait_timeout=wait_timeout, p_zygote=zygote, p_workspace_mode=workspace_mode).run()
+            c.close()
+            sys.exit(0)
+
         # 检查作业任务
         print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Checking TODO list .......")
 
-        # 查看是否有需要完成的JOB
+        # 查看是否有需要完成的JOB，整个作业过程中只使用这一个连接
         c = Client((server, port), authkey=b'welcome')
         proxy = RPCProxy(c)
         m_Result = proxy.get_todo_job(
@@ -947,12 +1826,14 @@ def farm(
             p_os_pid=str(os.getpid()),
             p_machine_name=socket.gethostname(),
             p_work_directory=m_work_directory,
-            p_backup_directory=m_backup_directory
+            p_backup_directory=m_backup_directory,
+            p_labels=worker_labels.split(',') if worker_labels else None,
+            p_wait_timeout=wait_timeout
         )
-        c.close()
 
         # 如果没有需要完成的工作,就退出
         if not m_Result['Result']:
+            c.close()
             print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Info:: " + str(m_Result['Message']))
             sys.exit(0)
 
@@ -960,33 +1841,15 @@ def farm(
         print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
               'Will do JOB [' + str(m_Result['ID']) + '] ....')
 
-        # 获得当前程序工作路径
-        m_current_directory = os.getcwd()
-        if not os.path.exists(m_work_directory):
-            os.mkdir(m_work_directory)
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Work directory ：' + m_work_directory)
-        os.chdir(m_work_directory)
-
-        # 清空工作目录下所有内容
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
-              'Cleaning all files under [' + m_work_directory + ']')
-        fileList = list(os.listdir(m_work_directory))
-        for file in fileList:
-            if os.path.isfile(file):
-                os.remove(file)
-            else:
-                shutil.rmtree(file)
-
-        # 复制测试目录下所有文件到当前工作目录
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Copying test ')
-        m_TestPath = os.path.join(os.environ['T_SRCHOME'], str(m_Result['REGRESS_NAME']))
+        # 检查测试目录是否存在
+        m_TestPath = get_test_path(m_Result)
         if not os.path.exists(m_TestPath):
-            c = Client((server, port), authkey=b'welcome')
-            proxy = RPCProxy(c)
             m_Finished_Result = proxy.finish_job(
                 p_job_id=m_Result['ID'],
                 p_job_status='ERROR',
-                p_notes='TestPath not exist. [' + str(m_TestPath) + "]"
+                p_notes='TestPath not exist. [' + str(m_TestPath) + "]",
+                p_machine_name=socket.gethostname(),
+                p_os_pid=str(os.getpid())
             )
             c.close()
             if not m_Finished_Result['Result']:
@@ -994,74 +1857,70 @@ def farm(
                 sys.exit(1)
             print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Aborted JOB ' + str(m_Result['ID']))
             sys.exit(0)
-        else:
-            distutils.dir_util.copy_tree(m_TestPath, m_work_directory)
-
-        # 程序输出、错误定向到新的目录
-        m_module_name = m_Result['REGRESS_NAME']
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Will write output log to ：' + m_module_name + '.tlg')
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Will write error log to ：' + m_module_name + '.err')
-        sys.stdout = open(m_module_name + '.tlg', 'w')
-        sys.stderr = open(m_module_name + '.err', 'w')
-
-        # 运行Case
-        m_test_option = m_Result['REGRESS_OPTIONS']
-        if m_Result['REGRESS_TYPE'].upper() == 'RF':
-            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
-                  'Started RF test ' + m_module_name)
-            worker_thread = threading.Thread(
-                target=run_robot_framework_test,
-                args=(
-                    str(m_Result['MAIN_ENTRY']),
-                    m_module_name,
-                    str(m_Result['PROPERTIES']),
-                    m_test_option))
-            worker_thread.setDaemon(True)
-            worker_thread.start()
-            worker_thread.join(int(m_Result['LIMIT_TIME']))
-            if worker_thread.is_alive():
-                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
-                      'Error:  MAX LIMIT TIME EXCEED: ' + str(m_Result['LIMIT_TIME']))
-        else:
-            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
-                  "Error:: UNKNOWN REGRESS_TYPE [" + m_Result['REGRESS_TYPE'] + "]")
-
-        # 还原程序输出、错误输出的位置
-        sys.stdout.close()
-        sys.stderr.close()
-        sys.stdout = sys.__stdout__
-        sys.stderr = sys.__stderr__
-
-        # 备份工作日志
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'backup log ' + str(m_Result['ID']))
-        m_backup_directory = os.path.join(m_backup_directory, str(m_Result['ID']))
-        if os.path.exists(m_backup_directory):
-            os.chdir(m_backup_directory)
-            fileList = list(os.listdir(m_backup_directory))
-            for file in fileList:
-                if os.path.isfile(file):
-                    os.remove(file)
-                else:
-                    shutil.rmtree(file)
-            os.chdir(m_current_directory)
-            os.rmdir(m_backup_directory)
-        shutil.copytree(os.environ.get('T_WORK'), m_backup_directory)
 
-        # 还原工作路径
-        os.chdir(m_current_directory)
-
-        # 报告一下，已经完成工作
-        c = Client((server, port), authkey=b'welcome')
-        proxy = RPCProxy(c)
-        m_Finished_Result = proxy.finish_job(
-            p_job_id=m_Result['ID'],
-            p_job_status='COMPLETED',
-            p_notes="")
+        # 运行作业，工作日志先放到暂存目录中
+        # 运行期间在后台发送心跳，服务端才不会回收这个作业
+        m_Context = JobContext(m_Result, m_work_directory)
+        m_Heartbeat = Heartbeat(proxy, m_Result['ID'], p_log_path=m_Context.path(m_Context.module_name + '.tlg'))
+        m_Heartbeat.start()
+        try:
+            m_Staging = run_job(m_Context, p_workspace_mode=workspace_mode)
+        finally:
+            m_Heartbeat.stop()
+
+        # 报告一下，已经完成工作，超时的作业报告为TIMEOUT
+        #   超时以后运行测试的线程没有结束时没有暂存目录，日志不完整，不汇总测试结果
+        # 每个测试的结果和完成状态在同一个批量调用中报告
+        m_TestResults = read_test_results(m_Staging)
+        with proxy.batch() as m_Batch:
+            if m_Heartbeat.tail is not None:
+                m_Batch.report_job_output(p_outputs=m_Heartbeat.collect_outputs())
+            if m_TestResults:
+                m_Upload_Result = m_Batch.upload_test_results(p_job_id=m_Result['ID'], p_test_results=m_TestResults)
+            if m_Context.timed_out:
+                m_Finished_Result = m_Batch.finish_job(
+                    p_job_id=m_Result['ID'],
+                    p_job_status='TIMEOUT',
+                    p_notes='MAX LIMIT TIME EXCEED: ' + str(m_Result['LIMIT_TIME']) +
+                            (', logs incomplete.' if m_Staging is None else ''),
+                    p_summary=read_summary(m_Staging),
+                    p_machine_name=socket.gethostname(),
+                    p_os_pid=str(os.getpid()))
+            else:
+                m_Finished_Result = m_Batch.finish_job(
+                    p_job_id=m_Result['ID'],
+                    p_job_status='COMPLETED',
+                    p_notes="",
+                    p_summary=read_summary(m_Staging),
+                    p_machine_name=socket.gethostname(),
+                    p_os_pid=str(os.getpid()))
         c.close()
+        m_Finished_Result = m_Finished_Result.result()
+        if m_TestResults:
+            try:
+                m_Upload_Result = m_Upload_Result.result()
+                if not m_Upload_Result['Result']:
+                    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Error:: " + str(m_Upload_Result['Message']))
+            except KeyError:
+                # 旧版本的服务端不支持上传测试结果
+                pass
+
+        # 已经报告了完成，资源标签不用再等待备份
+        #   运行测试的线程还在写日志，不备份写了一半的文件，日志留在工作目录中
+        if m_Staging is None:
+            print_backup_result(m_Result['ID'], None, 'logs incomplete, left in ' + m_work_directory)
+        else:
+            try:
+                print_backup_result(m_Result['ID'], BackupStore(m_backup_directory).write(m_Result['ID'], m_Staging))
+            except Exception as ex:
+                print_backup_result(m_Result['ID'], None, repr(ex))
         if not m_Finished_Result['Result']:
             print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Error:: " + str(m_Finished_Result['Message']))
             sys.exit(1)
-        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Completed JOB ' + str(m_Result['ID']))
+        if m_Context.timed_out:
+            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Timeout JOB ' + str(m_Result['ID']))
+        else:
+            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Completed JOB ' + str(m_Result['ID']))
         sys.exit(0)
 
 
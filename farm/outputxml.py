@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+import struct
+import tempfile
+from xml.etree.ElementTree import iterparse
+
+# 需要输出的元素，kw以外的是Robot Framework 4.0以后的控制结构
+SUITE_TAGS = ('suite', )
+TEST_TAGS = ('test', )
+KEYWORD_TAGS = ('kw', 'for', 'iter', 'if', 'branch', 'try', 'while', 'group')
+ITEM_TAGS = SUITE_TAGS + TEST_TAGS + KEYWORD_TAGS
+# 只有在这些元素下面的才是执行结果，<statistics>下面也有<suite>
+ITEM_PARENTS = ('robot', ) + ITEM_TAGS
+
+# 第一遍扫描时每个元素的状态记录：状态、开始时间、结束时间、用时（毫秒）
+RECORD = struct.Struct('12s24s24sq')
+
+
+# 'YYYYMMDD HH:MM:SS.mmm'格式的时间转换为毫秒，比strptime快得多
+def _timestamp_ms(p_time):
+    m_Days = datetime.date(int(p_time[0:4]), int(p_time[4:6]), int(p_time[6:8])).toordinal()
+    return (((m_Days * 24 + int(p_time[9:11])) * 60 + int(p_time[12:14])) * 60 + int(p_time[15:17])) * 1000 + \
+        int(p_time[18:21])
+
+
+# 和robot.utils.elapsed_time_to_string一样的格式
+def _format_elapsed(p_elapsed_ms):
+    m_Seconds, m_Millis = divmod(p_elapsed_ms, 1000)
+    m_Minutes, m_Seconds = divmod(m_Seconds, 60)
+    m_Hours, m_Minutes = divmod(m_Minutes, 60)
+    return '%02d:%02d:%02d.%03d' % (m_Hours, m_Minutes, m_Seconds, m_Millis)
+
+
+def _format_time(p_datetime):
+    return '%04d%02d%02d %02d:%02d:%02d.%03d' % (p_datetime.year, p_datetime.month, p_datetime.day, p_datetime.hour,
+                                                 p_datetime.minute, p_datetime.second, p_datetime.microsecond // 1000)
+
+
+# 解析<status>元素，返回(状态, 开始时间, 结束时间, 用时毫秒)，时间都是Robot Framework 7.0以前的格式
+#   7.0以前：<status status="PASS" starttime="20200101 00:00:00.000" endtime="20200101 00:00:01.000"/>
+#   7.0以后：<status status="PASS" start="2020-01-01T00:00:00.000000" elapsed="1.000000"/>
+def parse_status(p_attrib):
+    m_Status = p_attrib.get('status', '')
+    if 'elapsed' in p_attrib or 'start' in p_attrib:
+        m_Elapsed = float(p_attrib.get('elapsed', 0))
+        if 'start' not in p_attrib:
+            return m_Status, 'N/A', 'N/A', int(round(m_Elapsed * 1000))
+        m_Start = datetime.datetime.fromisoformat(p_attrib['start'])
+        return m_Status, _format_time(m_Start), \
+            _format_time(m_Start + datetime.timedelta(seconds=m_Elapsed)), int(round(m_Elapsed * 1000))
+    m_StartTime = p_attrib.get('starttime', 'N/A')
+    m_EndTime = p_attrib.get('endtime', 'N/A')
+    if m_StartTime == 'N/A' or m_EndTime == 'N/A':
+        return m_Status, m_StartTime, m_EndTime, 0
+    return m_Status, m_StartTime, m_EndTime, _timestamp_ms(m_EndTime) - _timestamp_ms(m_StartTime)
+
+
+# 流式地遍历output.xml，每个元素处理完以后就从树上删除，内存占用和文件大小无关
+#   产生(事件, 元素, 父元素的标签)
+def _iterate(p_output_xml):
+    m_Stack = []
+    for m_Event, m_Elem in iterparse(p_output_xml, events=('start', 'end')):
+        if m_Event == 'start':
+            yield m_Event, m_Elem, m_Stack[-1].tag if m_Stack else None
+            m_Stack.append(m_Elem)
+        else:
+            m_Stack.pop()
+            yield m_Event, m_Elem, m_Stack[-1].tag if m_Stack else None
+            m_Elem.clear()
+            if m_Stack:
+                m_Stack[-1].remove(m_Elem)
+
+
+# 第一遍：按照元素开始的顺序编号，元素结束时把状态写到p_records中对应的位置
+#   同时统计测试的结果，p_on_test不为None时，每个测试调用一次p_on_test(长名字, 状态, 用时秒, 失败的信息)
+def _collect_status(p_output_xml, p_records, p_on_test):
+    m_Summary = {'Tests': 0, 'Passed': 0, 'Failed': 0, 'Skipped': 0, 'Elapsed': 0.0}
+    m_Index = 0
+    # 正在处理的元素[编号, 标签, 名字, 状态, 状态中的信息]
+    m_Items = []
+    m_SuiteNames = []
+    for m_Event, m_Elem, m_ParentTag in _iterate(p_output_xml):
+        m_Tag = m_Elem.tag
+        if m_Event == 'start':
+            if m_Tag in ITEM_TAGS and m_ParentTag in ITEM_PARENTS:
+                m_Items.append([m_Index, m_Tag, m_Elem.get('name', ''), ('', 'N/A', 'N/A', 0), ''])
+                m_Index = m_Index + 1
+                if m_Tag == 'suite':
+                    m_SuiteNames.append(m_Elem.get('name', ''))
+            continue
+        if m_Tag == 'status' and m_ParentTag in ITEM_TAGS:
+            m_Items[-1][3] = parse_status(m_Elem.attrib)
+            m_Items[-1][4] = m_Elem.text or ''
+        elif m_Tag in ITEM_TAGS and m_ParentTag in ITEM_PARENTS:
+            m_ItemIndex, m_ItemTag, m_Name, m_Status, m_Message = m_Items.pop()
+            p_records.seek(m_ItemIndex * RECORD.size)
+            p_records.write(RECORD.pack(m_Status[0].encode('utf-8'), m_Status[1].encode('utf-8'),
+                                        m_Status[2].encode('utf-8'), m_Status[3]))
+            if m_ItemTag == 'test':
+                m_Summary['Tests'] = m_Summary['Tests'] + 1
+                if m_Status[0] == 'PASS':
+                    m_Summary['Passed'] = m_Summary['Passed'] + 1
+                elif m_Status[0] == 'FAIL':
+                    m_Summary['Failed'] = m_Summary['Failed'] + 1
+                elif m_Status[0] == 'SKIP':
+                    m_Summary['Skipped'] = m_Summary['Skipped'] + 1
+                if p_on_test is not None:
+                    p_on_test('.'.join(m_SuiteNames + [m_Name]), m_Status[0], m_Status[3] / 1000.0, m_Message)
+            elif m_ItemTag == 'suite':
+                m_SuiteNames.pop()
+                if not m_SuiteNames:
+                    m_Summary['Elapsed'] = m_Summary['Elapsed'] + m_Status[3] / 1000.0
+    return m_Summary
+
+
+# 元素在CSV中的类型，和robot.result中对应对象的type一致
+def _item_type(p_elem, p_schema):
+    m_Tag = p_elem.tag
+    if m_Tag == 'suite':
+        return 'Suite'
+    if m_Tag == 'test':
+        return 'Test'
+    if m_Tag == 'kw':
+        # 4.0以前普通关键字的type是kw，以后是KEYWORD
+        return p_elem.get('type', 'KEYWORD' if p_schema else 'kw').capitalize()
+    return p_elem.get('type', m_Tag).capitalize()
+
+
+def _item_name(p_elem):
+    m_Name = p_elem.get('name') or p_elem.get('condition') or p_elem.get('flavor') or ''
+    # 7.0以前的关键字名字包括库名
+    m_Library = p_elem.get('library') or p_elem.get('owner')
+    if p_elem.tag == 'kw' and m_Library:
+        return m_Library + '.' + m_Name
+    return m_Name
+
+
+# 流式地汇总output.xml，写出和原来用robot.result.ExecutionResult生成的同样的CSV：
+#   TYPE, NAME, STATUS, START, END, ELAPSED, ELAPSED SECS
+#   p_items为需要输出的元素，'suite-test-keyword'的任意组合
+#   状态在每个元素的最后，而CSV中父元素在子元素前面，所以需要读两遍：
+#     第一遍把每个元素的状态按照编号写到临时文件中，第二遍按照顺序读出来写CSV，内存占用是常数
+#   返回测试结果的统计 {'Tests', 'Passed', 'Failed', 'Skipped', 'Elapsed'}
+def summarize_output(p_output_xml, p_csv_file, p_items='suite-test-keyword', p_on_test=None):
+    p_items = p_items.lower()
+    m_Types = ((SUITE_TAGS if 'suite' in p_items else ()) +
+               (TEST_TAGS if 'test' in p_items else ()) +
+               (KEYWORD_TAGS if 'keyword' in p_items else ()))
+    with tempfile.TemporaryFile() as m_Records:
+        m_Summary = _collect_status(p_output_xml, m_Records, p_on_test)
+        m_Records.seek(0)
+
+        with open(p_csv_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['TYPE', 'NAME', 'STATUS', 'START', 'END', 'ELAPSED', 'ELAPSED SECS'])
+            m_Schema = None
+            m_Level = 0
+            m_SuiteNames = []
+            for m_Event, m_Elem, m_ParentTag in _iterate(p_output_xml):
+                m_Tag = m_Elem.tag
+                if m_Tag not in ITEM_TAGS or m_ParentTag not in ITEM_PARENTS:
+                    if m_Tag == 'robot' and m_Event == 'start':
+                        m_Schema = m_Elem.get('schemaversion')
+                    continue
+                if m_Event == 'end':
+                    m_Level = m_Level - 1
+                    if m_Tag == 'suite':
+                        m_SuiteNames.pop()
+                    continue
+                m_Status, m_Start, m_End, m_Elapsed = RECORD.unpack(m_Records.read(RECORD.size))
+                m_Level = m_Level + 1
+                if m_Tag == 'suite':
+                    m_SuiteNames.append(m_Elem.get('name', ''))
+                if m_Tag not in m_Types:
+                    continue
+                m_Name = _item_name(m_Elem)
+                if m_Tag == 'test' and 'suite' not in p_items:
+                    m_Name = '.'.join(m_SuiteNames + [m_Name])
+                # 最外层的套件level为0
+                m_Indent = '' if m_Level == 1 else ('|  ' * (m_Level - 2) + '|- ')
+                writer.writerow([m_Indent + _item_type(m_Elem, m_Schema), m_Name,
+                                 m_Status.rstrip(b'\0').decode('utf-8'), m_Start.rstrip(b'\0').decode('utf-8'),
+                                 m_End.rstrip(b'\0').decode('utf-8'), _format_elapsed(m_Elapsed),
+                                 m_Elapsed / 1000.0])
+    return m_Summary
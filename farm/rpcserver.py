@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hmac
+import os
+import pickle
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import AuthenticationError
+
+# multiprocessing.connection中定义的认证消息
+CHALLENGE = b'#CHALLENGE#'
+WELCOME = b'#WELCOME#'
+FAILURE = b'#FAILURE#'
+MESSAGE_LENGTH = 20
+
+# RPC报文格式的版本
+#   1  请求和应答先pickle.dumps，再由Connection.send再pickle一次
+#   2  请求和应答只做一次pickle（协议5），直接通过send_bytes/recv_bytes发送
+#   客户端的第一个请求用版本1发送rpc_negotiate，服务端在应答中返回双方都支持的版本
+RPC_PROTOCOL = 2
+
+
+# 按照协议版本编码一个请求或者应答
+def rpc_encode(p_obj, p_protocol):
+    if p_protocol >= 2:
+        return pickle.dumps(p_obj, protocol=5)
+    return pickle.dumps(pickle.dumps(p_obj))
+
+
+# 按照协议版本解码一个请求或者应答
+def rpc_decode(p_buf, p_protocol):
+    if p_protocol >= 2:
+        return pickle.loads(p_buf)
+    return pickle.loads(pickle.loads(p_buf))
+
+
+# 取消一个正在等待的调用
+#   客户端在同一个连接上发来新的请求时，服务端取消这个连接上正在等待的调用，
+#   这样客户端不需要第二个连接就可以在等待作业的同时报告作业完成
+class CancelToken(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.callbacks = []
+
+    # 取消的时候调用p_func，已经取消了的马上调用
+    def add_callback(self, p_func):
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(p_func)
+                return
+        p_func()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            m_Callbacks, self.callbacks = self.callbacks, []
+        for m_Func in m_Callbacks:
+            m_Func()
+
+
+# 基于asyncio的RPC服务
+#   和multiprocessing.connection.Listener使用同样的报文格式和认证方式，客户端不需要做任何修改
+#   所有的连接都在一个事件循环中处理，具体的RPC调用放到一个有限大小的线程池中完成
+#   可能长时间等待的调用放到另外一个线程池中，等待的请求再多也不会影响其他的调用
+#   等待的过程中继续读取这个连接上的下一个请求，收到以后取消等待，应答仍然按照请求的顺序返回
+class AsyncRPCServer(object):
+    def __init__(self, p_handler, p_address, p_authkey, p_max_connections=4096, p_max_workers=32,
+                 p_max_waiters=1024):
+        self.handler = p_handler
+        self.address = p_address
+        self.authkey = p_authkey
+        self.max_connections = p_max_connections
+        self.executor = ThreadPoolExecutor(max_workers=p_max_workers, thread_name_prefix='farm-rpc')
+        self.wait_executor = ThreadPoolExecutor(max_workers=p_max_waiters, thread_name_prefix='farm-wait')
+        self.connections = 0
+        self.calls = 0
+        self._slots = None
+        self._server = None
+
+    # 读取一个报文
+    @staticmethod
+    async def _recv_bytes(p_reader, p_maxsize=None):
+        m_Size, = struct.unpack("!i", await p_reader.readexactly(4))
+        if m_Size == -1:
+            m_Size, = struct.unpack("!Q", await p_reader.readexactly(8))
+        if p_maxsize is not None and m_Size > p_maxsize:
+            raise AuthenticationError('message too long')
+        return await p_reader.readexactly(m_Size)
+
+    # 写入一个报文，和Connection.send_bytes的格式一致
+    @staticmethod
+    def _send_bytes(p_writer, p_buf):
+        m_Size = len(p_buf)
+        if m_Size > 0x7fffffff:
+            p_writer.write(struct.pack("!i", -1) + struct.pack("!Q", m_Size))
+            p_writer.write(p_buf)
+        else:
+            p_writer.write(struct.pack("!i", m_Size) + p_buf)
+
+    # 服务端发起认证，对应multiprocessing.connection.deliver_challenge
+    async def _deliver_challenge(self, p_reader, p_writer):
+        m_Message = os.urandom(MESSAGE_LENGTH)
+        self._send_bytes(p_writer, CHALLENGE + m_Message)
+        await p_writer.drain()
+        m_Response = await self._recv_bytes(p_reader, 256)
+        if m_Response.startswith(b'{') and b'}' in m_Response[:20]:
+            # 新版本的客户端在回应前加上了摘要算法的名字
+            m_DigestName, m_Digest = m_Response[1:].split(b'}', 1)
+            m_Expected = hmac.new(self.authkey, m_Message, m_DigestName.decode('ascii')).digest()
+        else:
+            m_Digest = m_Response
+            m_Expected = hmac.new(self.authkey, m_Message, 'md5').digest()
+        if hmac.compare_digest(m_Digest, m_Expected):
+            self._send_bytes(p_writer, WELCOME)
+        else:
+            self._send_bytes(p_writer, FAILURE)
+            raise AuthenticationError('digest received was wrong')
+
+    # 回应客户端发起的认证，对应multiprocessing.connection.answer_challenge
+    async def _answer_challenge(self, p_reader, p_writer):
+        m_Message = await self._recv_bytes(p_reader, 256)
+        if m_Message[:len(CHALLENGE)] != CHALLENGE:
+            raise AuthenticationError('message = %r' % m_Message)
+        m_Message = m_Message[len(CHALLENGE):]
+        if m_Message.startswith(b'{') and b'}' in m_Message[:20]:
+            # 新版本的客户端在认证消息前加上了摘要算法的名字，回应的时候也要带上
+            m_DigestName = m_Message[1:m_Message.index(b'}')]
+            m_Digest = b'{' + m_DigestName + b'}' + \
+                hmac.new(self.authkey, m_Message, m_DigestName.decode('ascii')).digest()
+        else:
+            m_Digest = hmac.new(self.authkey, m_Message, 'md5').digest()
+        self._send_bytes(p_writer, m_Digest)
+        await p_writer.drain()
+        if await self._recv_bytes(p_reader, 256) != WELCOME:
+            raise AuthenticationError('digest sent was rejected')
+
+    # 处理一个客户端连接
+    async def _handle_connection(self, p_reader, p_writer):
+        async with self._slots:
+            self.connections = self.connections + 1
+            m_Loop = asyncio.get_running_loop()
+            m_Next = None
+            try:
+                await self._deliver_challenge(p_reader, p_writer)
+                await self._answer_challenge(p_reader, p_writer)
+                m_Protocol = None
+                while True:
+                    if m_Next is None:
+                        m_Buf = await self._recv_bytes(p_reader)
+                    else:
+                        m_Buf = await m_Next
+                        m_Next = None
+                    m_Request = rpc_decode(m_Buf, m_Protocol or 1)
+                    if m_Protocol is None:
+                        # 连接上的第一个请求决定了报文格式
+                        m_Version, m_Request = self.handler.negotiate(*m_Request)
+                    if self.handler.is_waiting(m_Request[0]):
+                        m_Cancel = CancelToken()
+                        m_Call = m_Loop.run_in_executor(self.wait_executor, self.handler.dispatch,
+                                                        *m_Request, m_Cancel)
+                        m_Next = asyncio.ensure_future(self._recv_bytes(p_reader))
+                        await asyncio.wait((m_Call, m_Next), return_when=asyncio.FIRST_COMPLETED)
+                        if not m_Call.done():
+                            m_Cancel.cancel()
+                        m_Result = await m_Call
+                    elif self.handler.is_blocking(m_Request[0]):
+                        m_Result = await m_Loop.run_in_executor(self.executor, self.handler.dispatch, *m_Request)
+                    else:
+                        m_Result = self.handler.dispatch(*m_Request)
+                    self.calls = self.calls + 1
+                    if m_Protocol is None:
+                        if m_Version > 1:
+                            m_Result = (m_Version, m_Result)
+                        self._send_bytes(p_writer, rpc_encode(m_Result, 1))
+                        m_Protocol = m_Version
+                    else:
+                        self._send_bytes(p_writer, rpc_encode(m_Result, m_Protocol))
+                    await p_writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError, AuthenticationError,
+                    ValueError, pickle.UnpicklingError):
+                pass
+            finally:
+                if m_Next is not None:
+                    m_Next.cancel()
+                self.connections = self.connections - 1
+                p_writer.close()
+
+    # 启动服务，直到程序退出
+    async def serve_forever(self):
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._server = await asyncio.start_server(self._handle_connection, self.address[0], self.address[1],
+                                                  backlog=1024)
+        async with self._server:
+            await self._server.serve_forever()
@@ -0,0 +1,845 @@
+# -*- coding: utf-8 -*-
+import heapq
+import threading
+import time
+from collections import deque
+
+
+# 在几个队列（用户或者任务）之间按照虚拟时间公平地分配
+#   每个队列记录已经得到的服务pass，每次选择pass最小的非空队列，取出一个作业以后pass加上作业的大小
+#   相当于按照作业大小计算份额的差额轮询（deficit round-robin），选择和计费都是堆操作，O(log n)
+#   空队列重新有作业时pass至少为当前的虚拟时间（最近一次被选中的pass），空闲期间不能积攒份额
+#   堆中的记录在pass变化时不删除，到达堆顶时和active中的记录不一致的直接丢弃
+#   p_forget为True时，队列空了以后不再记住它的pass（任务的数量没有上限）
+class FairShare(object):
+    def __init__(self, p_forget=False):
+        self.forget = p_forget
+        self.passes = {}
+        self.active = {}
+        self.heap = []
+        self.vtime = 0.0
+        self.seq = 0
+
+    def _push(self, p_key):
+        self.seq = self.seq + 1
+        m_Entry = (self.passes[p_key], self.seq, p_key)
+        self.active[p_key] = m_Entry
+        heapq.heappush(self.heap, m_Entry)
+
+    # 队列从空变成非空，或者有作业被放回队列时退还p_refund
+    def add(self, p_key, p_refund=0.0):
+        m_Pass = self.passes.get(p_key, self.vtime)
+        if p_key not in self.active:
+            m_Pass = max(m_Pass, self.vtime)
+        self.passes[p_key] = m_Pass - p_refund
+        self._push(p_key)
+
+    # 返回pass最小的非空队列在堆中的记录(pass, 序号, 队列)，都是空的时候返回None
+    def select(self):
+        while self.heap:
+            m_Entry = self.heap[0]
+            if self.active.get(m_Entry[2]) is m_Entry:
+                return m_Entry
+            heapq.heappop(self.heap)
+        return None
+
+    # 从select选中的队列中取出了一个大小为p_cost的作业，p_empty为这个队列是否已经空了
+    def charge(self, p_key, p_cost, p_empty):
+        heapq.heappop(self.heap)
+        self.vtime = self.passes[p_key]
+        self.passes[p_key] = self.vtime + p_cost
+        if not p_empty:
+            self._push(p_key)
+            return
+        del self.active[p_key]
+        if self.forget:
+            del self.passes[p_key]
+
+    def empty(self):
+        return len(self.active) == 0
+
+
+# 等待执行的作业队列
+#   不同优先级之间严格按照优先级从高到低（PRIORITY从大到小）派发
+#   同一个优先级中，用户之间公平分配，同一个用户的任务之间公平分配
+#   一个任务中的作业按照关键路径的长度从长到短派发，相同时按照放入的顺序，
+#   这样有依赖关系的任务中，后面还有很多作业要等待的作业先开始
+#   分配的份额按照作业的预计运行时间计算，一个用户提交的大套件不会让其他用户的小任务一直等待
+#   每个作业的信息为(PRIORITY, USER_NAME, TASK_ID, 预计运行时间, 关键路径长度)
+class FairQueue(object):
+    # 预计运行时间的下限（秒），不知道运行时间的作业按照作业的个数分配
+    MIN_COST = 1.0
+
+    def __init__(self):
+        self.count = 0
+        # 有作业的优先级，取负数放在堆中，空了的优先级到达堆顶时删除
+        self.priorities = []
+        self.queued_priorities = set()
+        # PRIORITY -> 用户之间的分配
+        self.users = {}
+        # (PRIORITY, USER_NAME) -> 任务之间的分配
+        self.tasks = {}
+        # (PRIORITY, USER_NAME, TASK_ID) -> 堆[(-关键路径长度, 序号, ID, 作业的信息)]
+        self.jobs = {}
+        # 放入的序号，放回队列的作业使用负数，排在关键路径长度相同的作业前面
+        self.seq = 0
+        self.front_seq = 0
+
+    def __len__(self):
+        return self.count
+
+    def _put(self, p_job_id, p_info, p_left):
+        m_Priority, m_UserName, m_TaskID, m_Cost, m_Rank = p_info
+        m_Key = (m_Priority, m_UserName, m_TaskID)
+        m_Jobs = self.jobs.get(m_Key)
+        if m_Jobs is None:
+            m_Jobs = []
+            self.jobs[m_Key] = m_Jobs
+        m_Tasks = self.tasks.get(m_Key[:2])
+        if m_Tasks is None:
+            m_Tasks = FairShare(p_forget=True)
+            self.tasks[m_Key[:2]] = m_Tasks
+        m_Users = self.users.get(m_Priority)
+        if m_Users is None:
+            m_Users = FairShare()
+            self.users[m_Priority] = m_Users
+        if m_Priority not in self.queued_priorities:
+            self.queued_priorities.add(m_Priority)
+            heapq.heappush(self.priorities, -m_Priority)
+
+        # 放回队列的作业退还已经计算的份额
+        m_Refund = m_Cost if p_left else 0.0
+        if p_left:
+            self.front_seq = self.front_seq - 1
+            heapq.heappush(m_Jobs, (-m_Rank, self.front_seq, p_job_id, p_info))
+        else:
+            self.seq = self.seq + 1
+            heapq.heappush(m_Jobs, (-m_Rank, self.seq, p_job_id, p_info))
+        if len(m_Jobs) == 1 or p_left:
+            if m_Tasks.empty() or p_left:
+                m_Users.add(m_UserName, m_Refund)
+            m_Tasks.add(m_TaskID, m_Refund)
+        self.count = self.count + 1
+
+    # 放入一个新的作业
+    def append(self, p_job_id, p_info):
+        m_Priority, m_UserName, m_TaskID, m_Cost, m_Rank = p_info
+        self._put(p_job_id, (m_Priority, m_UserName, m_TaskID, max(m_Cost or 0.0, self.MIN_COST), m_Rank or 0.0),
+                  False)
+
+    # 作业派发失败，放回它的任务的最前面
+    def appendleft(self, p_job_id, p_info):
+        self._put(p_job_id, p_info, True)
+
+    # 下一个作业的(PRIORITY, 它的用户的虚拟时间)，队列为空时返回None，不取出作业
+    #   同一个资源标签上的几个队列按照它比较，决定先从哪个队列取
+    def peek(self):
+        while self.priorities:
+            m_Priority = -self.priorities[0]
+            m_Entry = self.users[m_Priority].select()
+            if m_Entry is None:
+                heapq.heappop(self.priorities)
+                self.queued_priorities.discard(m_Priority)
+                continue
+            return m_Priority, m_Entry[0]
+        return None
+
+    # 取出下一个作业，返回(ID, 作业的信息)
+    def popleft(self):
+        while self.priorities:
+            m_Priority = -self.priorities[0]
+            m_Users = self.users[m_Priority]
+            m_Entry = m_Users.select()
+            if m_Entry is None:
+                heapq.heappop(self.priorities)
+                self.queued_priorities.discard(m_Priority)
+                continue
+            m_UserName = m_Entry[2]
+            m_Tasks = self.tasks[(m_Priority, m_UserName)]
+            m_TaskID = m_Tasks.select()[2]
+            m_Key = (m_Priority, m_UserName, m_TaskID)
+            m_Jobs = self.jobs[m_Key]
+            m_JobID, m_Info = heapq.heappop(m_Jobs)[2:]
+            if not m_Jobs:
+                del self.jobs[m_Key]
+            m_Tasks.charge(m_TaskID, m_Info[3], not m_Jobs)
+            if m_Tasks.empty():
+                del self.tasks[(m_Priority, m_UserName)]
+            m_Users.charge(m_UserName, m_Info[3], m_Tasks.empty())
+            self.count = self.count - 1
+            return m_JobID, m_Info
+        raise IndexError('pop from an empty queue')
+
+
+# 一个资源标签的调度状态，由这个标签自己的锁保护
+#   queue     状态为NEW的作业编号，按照优先级和公平分配的顺序派发
+#   capacity  资源标签的容量
+#   used      已经占用的容量，按照计数信号量来管理
+#   waiters   等待这个资源标签上出现可以执行的作业的请求，先进先出
+#   latency   最近完成的作业实际运行时间和预计运行时间之比的指数加权平均，没有记录时为None
+#   vtimes    PRIORITY -> 这个资源标签上最后派发的作业的虚拟时间
+#   offsets   (队列的名字, PRIORITY) -> 这个队列的虚拟时间换算到这个资源标签上需要加上的差值
+#             资源标签自己的队列和包含它的资源标签组的队列各自计算虚拟时间，比较之前需要换算
+class LabelState(object):
+    def __init__(self, p_capacity=0):
+        self.lock = threading.Lock()
+        self.queue = FairQueue()
+        self.capacity = p_capacity
+        self.used = 0
+        self.dirty = True
+        self.waiters = deque()
+        self.latency = None
+        self.vtimes = {}
+        self.offsets = {}
+
+
+# 一个资源标签组的调度状态，由这个组自己的锁保护
+#   提交到资源标签组的作业放在组的队列中，派发时才绑定到组中的一个资源标签
+#   需要同时持有组的锁和资源标签的锁时，先取得组的锁
+#   queue     状态为NEW的作业编号，先进先出
+#   members   组中的资源标签
+class LabelGroupState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = FairQueue()
+        self.members = []
+
+
+# 一个等待作业的请求，相当于只属于这个请求的条件变量
+#   一个请求可以同时等待多个资源标签，所以不能直接等待资源标签上的条件变量
+#   signals记录上次clear以后是哪些资源标签唤醒了这个请求，请求被取消时记录None
+class Waiter(object):
+    def __init__(self, p_label_names):
+        self.label_names = p_label_names
+        self.cond = threading.Condition(threading.Lock())
+        self.signals = []
+
+    # 唤醒这个请求，已经被唤醒、还没有重新尝试的请求返回False
+    def wake(self, p_label_name):
+        with self.cond:
+            if self.signals:
+                return False
+            self.signals.append(p_label_name)
+            self.cond.notify()
+            return True
+
+    # 准备再尝试一次取作业，之后的唤醒才对下一次等待有效
+    def clear(self):
+        with self.cond:
+            m_Signals = self.signals
+            self.signals = []
+            return m_Signals
+
+    # 等待被唤醒，超时返回False
+    def wait(self, p_timeout):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.signals, p_timeout)
+
+
+# 每个回归测试在每个资源标签上的预计运行时间（秒），按照历史运行时间的指数加权平均计算
+#   最近的运行时间权重为alpha，回归测试变长或者变短以后，几次运行就能反映出来
+#   回归测试在这个资源标签上没有运行过时，使用它在其他资源标签上的平均值，
+#   从来没有运行过的回归测试使用所有已知时间的平均值，都没有时为0
+class DurationHistory(object):
+    def __init__(self, p_alpha=0.3):
+        self.lock = threading.Lock()
+        self.alpha = p_alpha
+        # (REGRESS_NAME, LABEL_NAME) -> 预计的秒数
+        self.durations = {}
+        # REGRESS_NAME -> 预计的秒数，不区分资源标签
+        self.regress_durations = {}
+
+    def _update(self, p_durations, p_key, p_seconds):
+        m_Old = p_durations.get(p_key)
+        p_durations[p_key] = p_seconds if m_Old is None else m_Old + self.alpha * (p_seconds - m_Old)
+
+    # 记录一次运行时间
+    def record(self, p_regress_name, p_label_name, p_seconds):
+        if p_seconds is None or p_seconds < 0:
+            return
+        with self.lock:
+            self._update(self.durations, (p_regress_name, p_label_name), p_seconds)
+            self._update(self.regress_durations, p_regress_name, p_seconds)
+
+    # 从数据库中重建，p_rows为按照完成顺序排列的(REGRESS_NAME, LABEL_NAME, 秒数)
+    def load(self, p_rows):
+        for m_RegressName, m_LabelName, m_Seconds in p_rows:
+            self.record(m_RegressName, m_LabelName, m_Seconds)
+
+    # 返回每一个回归测试的预计运行时间
+    def estimate(self, p_regress_names, p_label_name):
+        with self.lock:
+            m_Default = (sum(self.regress_durations.values()) / len(self.regress_durations)
+                         if self.regress_durations else 0.0)
+            return [self.durations.get((m_RegressName, p_label_name),
+                                       self.regress_durations.get(m_RegressName, m_Default))
+                    for m_RegressName in p_regress_names]
+
+    # 已知运行时间的回归测试数量
+    def known_count(self):
+        with self.lock:
+            return len(self.regress_durations)
+
+
+# 正在运行的作业的租约
+#   派发作业时给出租约，Worker定时发送心跳延长租约，Worker崩溃、机器重启以后租约到期，作业被回收
+#   每个租约有两个期限：
+#     心跳期限  派发或者最后一次心跳以后p_lease_seconds秒
+#     最终期限  作业的LIMIT_TIME再加上Worker结束作业、报告结果的时间，心跳不能延长这个期限
+#   到期时间放在一个小顶堆中，回收线程只等待堆顶的租约，不需要定时扫描所有的作业
+#   心跳只修改租约的到期时间，不修改堆，堆中的记录到达堆顶时租约已经被延长的，按照新的到期时间重新放入堆中
+#   所以每个租约在堆中通常只有一条记录，心跳的开销和堆的大小无关
+class LeaseTable(object):
+    def __init__(self, p_lease_seconds=60):
+        self.cond = threading.Condition(threading.Lock())
+        self.lease_seconds = p_lease_seconds
+        # 作业编号 -> [到期时间, 最终期限, 持有者, 堆中记录的时间]
+        self.leases = {}
+        # (时间, 作业编号)
+        self.heap = []
+        self.closed = False
+
+    def _schedule(self, p_job_id, p_lease, p_time):
+        p_lease[3] = p_time
+        heapq.heappush(self.heap, (p_time, p_job_id))
+        if self.heap[0][1] == p_job_id:
+            # 最早到期的租约变了，回收线程重新计算等待的时间
+            self.cond.notify_all()
+
+    # 给出一个租约，p_seconds秒以后到达最终期限，p_heartbeat_seconds不为None时已经有了心跳期限
+    #   p_owner为持有租约的Worker，只有这个Worker的心跳才能延长租约
+    def grant(self, p_job_id, p_owner, p_seconds, p_heartbeat_seconds=None):
+        m_Now = time.monotonic()
+        m_Deadline = m_Now + p_seconds
+        m_Expiry = m_Deadline if p_heartbeat_seconds is None else min(m_Now + p_heartbeat_seconds, m_Deadline)
+        with self.cond:
+            m_Lease = [m_Expiry, m_Deadline, p_owner, None]
+            self.leases[p_job_id] = m_Lease
+            self._schedule(p_job_id, m_Lease, m_Expiry)
+
+    # Worker的心跳，延长p_job_ids的租约，返回已经不属于这个Worker的作业编号
+    def renew(self, p_job_ids, p_owner):
+        m_Expiry = time.monotonic() + self.lease_seconds
+        m_Lost = []
+        with self.cond:
+            for m_JobID in p_job_ids:
+                m_Lease = self.leases.get(m_JobID)
+                if m_Lease is None or m_Lease[2] != p_owner:
+                    m_Lost.append(m_JobID)
+                    continue
+                m_Lease[0] = min(m_Expiry, m_Lease[1])
+                # 到期时间比堆中的记录提前时（例如lease_seconds被调小），需要在堆中放一条更早的记录，原来的记录作废
+                if m_Lease[0] < m_Lease[3]:
+                    self._schedule(m_JobID, m_Lease, m_Lease[0])
+        return m_Lost
+
+    # 作业已经结束，取消租约，p_owner不为None时只取消这个Worker持有的租约
+    def drop(self, p_job_id, p_owner=None):
+        with self.cond:
+            m_Lease = self.leases.get(p_job_id)
+            if m_Lease is not None and (p_owner is None or m_Lease[2] == p_owner):
+                del self.leases[p_job_id]
+
+    # 等待到期的租约，返回[(作业编号, 是否到达了最终期限)]，最多等待p_timeout秒，关闭以后返回None
+    def wait_expired(self, p_timeout=None):
+        m_Until = None if p_timeout is None else time.monotonic() + p_timeout
+        with self.cond:
+            while not self.closed:
+                m_Now = time.monotonic()
+                m_Expired = []
+                while self.heap and self.heap[0][0] <= m_Now:
+                    m_Time, m_JobID = heapq.heappop(self.heap)
+                    m_Lease = self.leases.get(m_JobID)
+                    if m_Lease is None or m_Lease[3] != m_Time:
+                        # 作废的记录
+                        continue
+                    if m_Lease[0] > m_Now:
+                        # 租约已经被延长
+                        self._schedule(m_JobID, m_Lease, m_Lease[0])
+                        continue
+                    del self.leases[m_JobID]
+                    m_Expired.append((m_JobID, m_Lease[0] >= m_Lease[1]))
+                if m_Expired:
+                    return m_Expired
+                m_Timeout = None
+                if self.heap:
+                    m_Timeout = self.heap[0][0] - m_Now
+                if m_Until is not None:
+                    if m_Now >= m_Until:
+                        return []
+                    m_Timeout = m_Until - m_Now if m_Timeout is None else min(m_Timeout, m_Until - m_Now)
+                self.cond.wait(m_Timeout)
+            return None
+
+    # 结束回收线程的等待
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    # 当前的租约数量
+    def count(self):
+        with self.cond:
+            return len(self.leases)
+
+
+# 按照预计运行时间从长到短排列一个任务中的作业，预计时间相同的保持原来的顺序
+#   一个任务的完成时间取决于最后完成的作业，最长的作业最先开始，最后一批作业的长度最短
+#   返回排列以后的下标
+def longest_first(p_estimates):
+    return sorted(range(len(p_estimates)), key=lambda i: -p_estimates[i])
+
+
+# 计算有依赖关系的作业的关键路径长度：作业自己的预计运行时间加上依赖它的作业中最长的关键路径
+#   p_estimates为{作业: 预计运行时间}，p_edges为(作业, 它依赖的作业)，不在p_estimates中的作业忽略
+#   没有依赖关系的作业关键路径长度就是预计运行时间，按照它从长到短派发就是longest_first
+#   返回{作业: 关键路径长度}，有循环依赖时返回None
+def critical_path(p_estimates, p_edges):
+    if not p_edges:
+        return dict(p_estimates)
+    m_Dependents = dict((m_Job, []) for m_Job in p_estimates)
+    m_InDegree = dict((m_Job, 0) for m_Job in p_estimates)
+    for m_Job, m_DependsOn in p_edges:
+        if m_Job in m_InDegree and m_DependsOn in m_InDegree:
+            m_Dependents[m_DependsOn].append(m_Job)
+            m_InDegree[m_Job] = m_InDegree[m_Job] + 1
+    # 拓扑排序，前置作业排在前面
+    m_Order = [m_Job for m_Job in p_estimates if m_InDegree[m_Job] == 0]
+    for m_DependsOn in m_Order:
+        for m_Job in m_Dependents[m_DependsOn]:
+            m_InDegree[m_Job] = m_InDegree[m_Job] - 1
+            if m_InDegree[m_Job] == 0:
+                m_Order.append(m_Job)
+    if len(m_Order) < len(p_estimates):
+        return None
+    m_Ranks = {}
+    for m_Job in reversed(m_Order):
+        m_Ranks[m_Job] = p_estimates[m_Job] + max([m_Ranks[m_Next] for m_Next in m_Dependents[m_Job]] or [0.0])
+    return m_Ranks
+
+
+# 作业之间还没有满足的依赖关系
+#   每个等待中的作业记录还没有完成的前置作业的数量（入度），前置作业完成时减一，减到0的作业马上可以派发，
+#   不需要定时检查
+#   前置作业无论以什么状态结束（COMPLETED、ERROR、TIMEOUT）都算完成，例如清理的作业总是需要运行
+class DependencyGraph(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # 前置作业 -> [依赖它的作业]
+        self.dependents = {}
+        # 等待中的作业 -> 还没有完成的前置作业数量
+        self.indegree = {}
+        # 等待中的作业 -> 关键路径长度，派发时使用
+        self.ranks = {}
+
+    # 加入依赖关系，p_edges为(作业, 它依赖的还没有完成的作业)，p_ranks为{等待中的作业: 关键路径长度}
+    def add(self, p_edges, p_ranks):
+        with self.lock:
+            for m_JobID, m_DependsOn in p_edges:
+                self.dependents.setdefault(m_DependsOn, []).append(m_JobID)
+                self.indegree[m_JobID] = self.indegree.get(m_JobID, 0) + 1
+            self.ranks.update(p_ranks)
+
+    # 一个作业完成，返回依赖它的作业和因此可以派发的作业{作业: 关键路径长度}
+    def finish(self, p_job_id):
+        m_Released = {}
+        with self.lock:
+            m_Dependents = self.dependents.pop(p_job_id, [])
+            for m_JobID in m_Dependents:
+                m_Count = self.indegree[m_JobID] - 1
+                if m_Count > 0:
+                    self.indegree[m_JobID] = m_Count
+                    continue
+                del self.indegree[m_JobID]
+                m_Released[m_JobID] = self.ranks.pop(m_JobID, 0.0)
+        return m_Dependents, m_Released
+
+    # 完成作业的事务被回滚，恢复finish之前的状态
+    def undo(self, p_job_id, p_dependents, p_released):
+        with self.lock:
+            self.dependents[p_job_id] = p_dependents
+            for m_JobID in p_dependents:
+                self.indegree[m_JobID] = self.indegree.get(m_JobID, 0) + 1
+            self.ranks.update(p_released)
+
+    # 等待前置作业完成的作业数量
+    def blocked_count(self):
+        with self.lock:
+            return len(self.indegree)
+
+
+# 作业调度的内存状态
+#   每个资源标签有自己的等待队列、容量计数和锁，派发和完成作业只锁住涉及到的资源标签
+#   取出作业和占用容量在同一把锁下完成
+#   资源标签组和资源标签使用同一个名字空间，作业队列的名字可以是资源标签，也可以是资源标签组
+#   服务端启动时从数据库中重建，派发作业时不再需要访问数据库
+class Scheduler(object):
+    # 最近运行时间之比的权重
+    LATENCY_ALPHA = 0.3
+
+    def __init__(self):
+        # 只保护资源标签和资源标签组的注册，以及正在运行的作业所在的资源标签
+        self.lock = threading.Lock()
+        self.labels = {}
+        self.groups = {}
+        self.running = {}
+        # 正在运行的作业在队列中的信息(PRIORITY, USER_NAME, TASK_ID, 预计运行时间, 关键路径长度)，派发失败时放回原来的位置
+        self.claimed = {}
+        # 等待任意资源标签的请求，由self.lock保护
+        self.waiters = deque()
+
+    # 获得资源标签的状态，不存在的时候创建一个容量为0的资源标签
+    def _label(self, p_label_name):
+        with self.lock:
+            m_State = self.labels.get(p_label_name)
+            if m_State is None:
+                m_State = LabelState()
+                self.labels[p_label_name] = m_State
+            return m_State
+
+    # 从数据库中重建资源标签的容量, p_rows为(NAME, LABEL_CAPACITY)
+    def load_labels(self, p_rows):
+        for m_LabelName, m_Capacity in p_rows:
+            self.define_label(m_LabelName, m_Capacity or 0)
+
+    # 从数据库中重建资源标签组, p_rows为(GROUP_NAME, LABEL_NAME)，没有资源标签的组LABEL_NAME为None
+    def load_label_groups(self, p_rows):
+        for m_GroupName, m_LabelName in p_rows:
+            self.define_label_group(m_GroupName)
+            if m_LabelName is not None:
+                self.add_group_label(m_GroupName, m_LabelName)
+
+    # 从数据库中重建作业队列
+    #   p_new_rows为按照派发顺序排列的NEW作业
+    #   (队列的名字, ID, PRIORITY, USER_NAME, TASK_ID, 预计运行时间, 关键路径长度)，
+    #   提交到资源标签组的作业放在组的队列中
+    #   p_working_rows为正在运行的作业(LABEL_NAME, ID, PRIORITY, USER_NAME, TASK_ID, 预计运行时间, 关键路径长度)，
+    #   用来计算已经占用的容量，被回收时回到原来的优先级、用户和任务中
+    def load_jobs(self, p_new_rows, p_working_rows):
+        for m_LabelName, m_JobID, m_Priority, m_UserName, m_TaskID, m_Cost, m_Rank in p_new_rows:
+            self.push(m_LabelName, (m_JobID, ), m_Priority, m_UserName, m_TaskID, (m_Cost, ), (m_Rank, ))
+        for m_LabelName, m_JobID, m_Priority, m_UserName, m_TaskID, m_Cost, m_Rank in p_working_rows:
+            m_State = self._label(m_LabelName)
+            with m_State.lock:
+                m_State.used = m_State.used + 1
+                m_State.dirty = True
+            with self.lock:
+                self.running[m_JobID] = m_LabelName
+                self.claimed[m_JobID] = (m_Priority, m_UserName, m_TaskID,
+                                         max(m_Cost or 0.0, FairQueue.MIN_COST), m_Rank or 0.0)
+
+    # 增加一个新的资源标签
+    def define_label(self, p_label_name, p_capacity):
+        m_State = self._label(p_label_name)
+        with m_State.lock:
+            m_State.capacity = p_capacity
+            m_State.dirty = True
+        self._notify(p_label_name, p_capacity)
+
+    # 增加一个新的资源标签组
+    def define_label_group(self, p_group_name):
+        with self.lock:
+            if p_group_name not in self.groups:
+                self.groups[p_group_name] = LabelGroupState()
+
+    # 资源标签组中加入一个资源标签，组中等待的作业马上可以在这个资源标签上运行
+    def add_group_label(self, p_group_name, p_label_name):
+        self._label(p_label_name)
+        with self.lock:
+            m_Group = self.groups[p_group_name]
+        with m_Group.lock:
+            if p_label_name in m_Group.members:
+                return
+            m_Group.members.append(p_label_name)
+            m_Count = len(m_Group.queue)
+        self._notify(p_label_name, m_Count)
+
+    # 从资源标签组中去掉一个资源标签，已经绑定到这个资源标签上的作业继续运行
+    def remove_group_label(self, p_group_name, p_label_name):
+        with self.lock:
+            m_Group = self.groups[p_group_name]
+        with m_Group.lock:
+            if p_label_name in m_Group.members:
+                m_Group.members.remove(p_label_name)
+
+    # 是否是一个资源标签组
+    def is_group(self, p_name):
+        with self.lock:
+            return p_name in self.groups
+
+    # 将p_label_names中的资源标签组展开为组中的资源标签，None表示任意资源标签
+    def _expand(self, p_label_names):
+        if p_label_names is None:
+            return None
+        m_LabelNames = []
+        with self.lock:
+            m_Groups = [(m_Name, self.groups.get(m_Name)) for m_Name in p_label_names]
+        for m_Name, m_Group in m_Groups:
+            if m_Group is None:
+                m_LabelNames.append(m_Name)
+                continue
+            with m_Group.lock:
+                m_LabelNames.extend(m_Group.members)
+        return m_LabelNames
+
+    # 将新提交的作业放入队列，p_label_name是资源标签组时放入组的队列，唤醒等待组中资源标签的请求
+    #   p_costs为每个作业的预计运行时间，用来计算用户和任务的份额
+    #   同一个任务的作业按照p_ranks（关键路径长度）从大到小派发，相同或者没有给出时按照p_job_ids的顺序
+    def push(self, p_label_name, p_job_ids, p_priority=0, p_user_name=None, p_task_id=None, p_costs=None,
+             p_ranks=None):
+        m_Jobs = list(p_job_ids)
+        m_Costs = p_costs if p_costs is not None else [None] * len(m_Jobs)
+        m_Ranks = p_ranks if p_ranks is not None else [None] * len(m_Jobs)
+        with self.lock:
+            m_Group = self.groups.get(p_label_name)
+        m_State = m_Group if m_Group is not None else self._label(p_label_name)
+        with m_State.lock:
+            for m_JobID, m_Cost, m_Rank in zip(m_Jobs, m_Costs, m_Ranks):
+                m_State.queue.append(m_JobID, (p_priority, p_user_name, p_task_id, m_Cost, m_Rank))
+            m_Members = list(m_Group.members) if m_Group is not None else [p_label_name]
+        for m_LabelName in m_Members:
+            self._notify(m_LabelName, len(m_Jobs))
+
+    # 从资源标签中取出一个作业，同时占用这个资源标签的一个容量
+    #   返回(队列的名字, LABEL_NAME, ID)，没有可以执行的作业时返回None
+    def claim(self, p_label_names=None):
+        m_Claimed = self.claim_many(p_label_names, 1)
+        return m_Claimed[0] if m_Claimed else None
+
+    # 从资源标签和资源标签组中取出最多p_count个作业，同时占用相应的容量
+    #   p_label_names中可以有资源标签组，表示组中所有的资源标签
+    #   每次在空闲容量最多的资源标签上取一个作业，空闲容量相同时选择最近运行时间之比最小（最快）的资源标签，
+    #   大的套件可以用满组中所有的资源
+    #   返回[(队列的名字, LABEL_NAME, ID), ...]，按照取出的顺序排列，
+    #   直接提交到资源标签的作业队列的名字就是LABEL_NAME
+    def claim_many(self, p_label_names=None, p_count=1):
+        m_LabelNames = self._expand(p_label_names)
+        with self.lock:
+            if m_LabelNames is None:
+                m_Labels = dict(self.labels)
+            else:
+                m_Labels = dict((m_LabelName, self.labels[m_LabelName])
+                                for m_LabelName in m_LabelNames if m_LabelName in self.labels)
+            m_Groups = sorted(self.groups.items())
+        # 每个资源标签可以取作业的资源标签组
+        m_LabelGroups = {}
+        for m_GroupName, m_Group in m_Groups:
+            with m_Group.lock:
+                m_Members = list(m_Group.members)
+            for m_LabelName in m_Members:
+                if m_LabelName in m_Labels:
+                    m_LabelGroups.setdefault(m_LabelName, []).append((m_GroupName, m_Group))
+        m_Candidates = []
+        for m_LabelName, m_State in m_Labels.items():
+            if not m_State.queue and not any(m_Group.queue for m_GroupName, m_Group in
+                                             m_LabelGroups.get(m_LabelName, ())):
+                continue
+            with m_State.lock:
+                m_Free = m_State.capacity - m_State.used
+                m_Latency = 1.0 if m_State.latency is None else m_State.latency
+            if m_Free > 0:
+                m_Candidates.append((-m_Free, m_Latency, m_LabelName))
+        heapq.heapify(m_Candidates)
+
+        m_Claimed = []
+        m_Jobs = []
+        while m_Candidates and len(m_Claimed) < p_count:
+            m_LabelName = m_Candidates[0][2]
+            m_Result = self._claim_label(m_LabelName, m_Labels[m_LabelName], m_LabelGroups.get(m_LabelName, []))
+            if m_Result is None:
+                heapq.heappop(m_Candidates)
+                continue
+            m_QueueName, m_JobID, m_Info, m_Free, m_Latency = m_Result
+            m_Claimed.append((m_QueueName, m_LabelName, m_JobID))
+            m_Jobs.append((m_LabelName, m_JobID, m_Info))
+            if m_Free > 0:
+                heapq.heapreplace(m_Candidates, (-m_Free, m_Latency, m_LabelName))
+            else:
+                heapq.heappop(m_Candidates)
+        with self.lock:
+            for m_LabelName, m_JobID, m_Info in m_Jobs:
+                self.running[m_JobID] = m_LabelName
+                self.claimed[m_JobID] = m_Info
+        return m_Claimed
+
+    # 在一个资源标签上取出一个作业，同时占用一个容量
+    #   候选的队列是资源标签自己的队列和包含它的资源标签组p_groups的队列，比较每个队列中下一个作业：
+    #   先比较优先级，优先级相同时比较换算到这个资源标签上的虚拟时间，小的先派发
+    #   一个队列第一次参加比较、或者落后于资源标签的虚拟时间（例如一直没有作业）时，从资源标签的虚拟时间开始算，
+    #   不会因为以前没有用过这个资源标签而连续占用
+    #   返回(队列的名字, ID, 作业的信息, 剩余的空闲容量, 最近运行时间之比)，没有容量或者没有作业时返回None
+    def _claim_label(self, p_label_name, p_state, p_groups):
+        # 先取得资源标签组的锁，再取得资源标签的锁
+        m_Locks = [m_Group.lock for m_GroupName, m_Group in p_groups] + [p_state.lock]
+        for m_Lock in m_Locks:
+            m_Lock.acquire()
+        try:
+            if p_state.used >= p_state.capacity:
+                return None
+            m_Heads = []
+            for m_QueueName, m_Queue in [(p_label_name, p_state.queue)] + \
+                    [(m_GroupName, m_Group.queue) for m_GroupName, m_Group in p_groups]:
+                m_Head = m_Queue.peek()
+                if m_Head is not None:
+                    m_Heads.append((m_QueueName, m_Queue, m_Head[0], m_Head[1]))
+            if not m_Heads:
+                return None
+            m_Priority = max(m_Head[2] for m_Head in m_Heads)
+            m_VTime = p_state.vtimes.get(m_Priority)
+            m_Best = None
+            for m_QueueName, m_Queue, m_HeadPriority, m_Pass in m_Heads:
+                if m_HeadPriority != m_Priority:
+                    continue
+                m_Offset = p_state.offsets.get((m_QueueName, m_Priority))
+                if m_Offset is None:
+                    m_Offset = 0.0 if m_VTime is None else m_VTime - m_Pass
+                elif m_VTime is not None and m_Pass + m_Offset < m_VTime:
+                    m_Offset = m_VTime - m_Pass
+                p_state.offsets[(m_QueueName, m_Priority)] = m_Offset
+                # 相同时资源标签自己的队列在前
+                if m_Best is None or m_Pass + m_Offset < m_Best[2]:
+                    m_Best = (m_QueueName, m_Queue, m_Pass + m_Offset)
+            m_QueueName, m_Queue, m_VTime = m_Best
+            m_JobID, m_Info = m_Queue.popleft()
+            p_state.vtimes[m_Priority] = m_VTime
+            p_state.used = p_state.used + 1
+            p_state.dirty = True
+            return (m_QueueName, m_JobID, m_Info, p_state.capacity - p_state.used,
+                    1.0 if p_state.latency is None else p_state.latency)
+        finally:
+            for m_Lock in reversed(m_Locks):
+                m_Lock.release()
+
+    # 记录资源标签上一个作业的实际运行时间和预计运行时间，用来在资源标签组中选择最快的资源标签
+    def record_latency(self, p_label_name, p_seconds, p_expected_seconds):
+        if p_seconds is None or p_seconds < 0 or not p_expected_seconds:
+            return
+        m_Ratio = p_seconds / p_expected_seconds
+        m_State = self._label(p_label_name)
+        with m_State.lock:
+            if m_State.latency is None:
+                m_State.latency = m_Ratio
+            else:
+                m_State.latency = m_State.latency + self.LATENCY_ALPHA * (m_Ratio - m_State.latency)
+
+    # 作业派发失败，释放容量，并将作业放回队列的最前面
+    #   p_label_name是作业原来所在的队列，可以是资源标签组
+    #   先放回队列再释放容量，释放容量时唤醒的请求才能取到这个作业
+    #   作业回到原来的优先级、用户和任务中，并退还计算过的份额
+    def unclaim(self, p_label_name, p_job_id):
+        with self.lock:
+            m_Group = self.groups.get(p_label_name)
+            m_Info = self.claimed.get(p_job_id, (0, None, None, FairQueue.MIN_COST, 0.0))
+        m_State = m_Group if m_Group is not None else self._label(p_label_name)
+        with m_State.lock:
+            m_State.queue.appendleft(p_job_id, m_Info)
+        self.release(p_job_id)
+
+    # 一批作业派发失败，按照相反的顺序放回队列，队列中保持原来的顺序
+    #   p_claimed为claim_many的返回值
+    def unclaim_many(self, p_claimed):
+        for m_QueueName, m_LabelName, m_JobID in reversed(p_claimed):
+            self.unclaim(m_QueueName, m_JobID)
+
+    # 作业不再运行，释放占用的容量，返回作业所在的资源标签
+    def release(self, p_job_id):
+        with self.lock:
+            self.claimed.pop(p_job_id, None)
+            m_LabelName = self.running.pop(p_job_id, None)
+            if m_LabelName is None:
+                return None
+            m_State = self.labels[m_LabelName]
+        with m_State.lock:
+            m_State.used = m_State.used - 1
+            m_State.dirty = True
+        self._notify(m_LabelName, 1)
+        return m_LabelName
+
+    # 资源标签上可能有了可以执行的作业，按照先来后到唤醒最多p_count个等待的请求
+    #   先唤醒只等待这个资源标签的请求，再唤醒等待任意资源标签的请求
+    def _notify(self, p_label_name, p_count):
+        if p_count <= 0:
+            return
+        m_State = self._label(p_label_name)
+        with m_State.lock:
+            for m_Waiter in m_State.waiters:
+                if p_count <= 0:
+                    return
+                if m_Waiter.wake(p_label_name):
+                    p_count = p_count - 1
+        with self.lock:
+            for m_Waiter in self.waiters:
+                if p_count <= 0:
+                    return
+                if m_Waiter.wake(p_label_name):
+                    p_count = p_count - 1
+
+    # 登记一个等待作业的请求，p_label_names为None时等待任意资源标签
+    #   需要在尝试取作业之前登记，避免错过在两者之间发出的唤醒
+    #   p_label_names中的资源标签组等待组中的资源标签
+    def park(self, p_label_names=None):
+        m_Waiter = Waiter(self._expand(p_label_names))
+        if m_Waiter.label_names is None:
+            with self.lock:
+                self.waiters.append(m_Waiter)
+        else:
+            for m_LabelName in m_Waiter.label_names:
+                m_State = self._label(m_LabelName)
+                with m_State.lock:
+                    m_State.waiters.append(m_Waiter)
+        return m_Waiter
+
+    # 取消等待
+    #   请求在最后一次尝试以后又被唤醒，但是不会再去取作业了，把唤醒转交给其他等待的请求
+    def unpark(self, p_waiter):
+        if p_waiter.label_names is None:
+            with self.lock:
+                self.waiters.remove(p_waiter)
+        else:
+            for m_LabelName in p_waiter.label_names:
+                m_State = self._label(m_LabelName)
+                with m_State.lock:
+                    m_State.waiters.remove(p_waiter)
+        for m_LabelName in p_waiter.clear():
+            if m_LabelName is not None:
+                self._notify(m_LabelName, 1)
+
+    # 返回上次检查点之后发生变化的资源标签占用情况[(CURRENT_USED, NAME), ...]
+    def checkpoint(self):
+        m_Changes = []
+        with self.lock:
+            m_Labels = list(self.labels.items())
+        for m_LabelName, m_State in m_Labels:
+            with m_State.lock:
+                if m_State.dirty:
+                    m_Changes.append((m_State.used, m_LabelName))
+                    m_State.dirty = False
+        return m_Changes
+
+    # 检查点没有写成功，下次重新写入
+    def mark_dirty(self, p_label_names):
+        for m_LabelName in p_label_names:
+            m_State = self._label(m_LabelName)
+            with m_State.lock:
+                m_State.dirty = True
+
+    # 当前等待执行的作业数量
+    def ready_count(self):
+        with self.lock:
+            m_States = list(self.labels.values()) + list(self.groups.values())
+        return sum(len(m_State.queue) for m_State in m_States)
+
+    # 当前正在运行的作业数量
+    def running_count(self):
+        with self.lock:
+            return len(self.running)
+
+    # 当前正在等待作业的请求数量
+    def waiting_count(self):
+        with self.lock:
+            m_Waiters = set(self.waiters)
+            m_States = list(self.labels.values())
+        for m_State in m_States:
+            with m_State.lock:
+                m_Waiters.update(m_State.waiters)
+        return len(m_Waiters)
@@ -0,0 +1,913 @@
+# -*- coding: utf-8 -*-
+import getpass
+import importlib
+import json
+import multiprocessing
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import wait
+from time import strftime, localtime
+
+from robot.version import VERSION as ROBOT_VERSION
+from robot import run_cli
+
+from .backup import BackupStore, BackupWriter
+from .joboutput import LogTail
+from .outputxml import summarize_output
+from .workspace import Workspace
+
+# 运行测试时使用的ROBOT_OPTIONS，Robot Framework 4.0以后取消了--critical选项
+if int(ROBOT_VERSION.split('.')[0]) < 4:
+    ROBOT_OPTIONS = "--critical regression --suitestatlevel 3"
+else:
+    ROBOT_OPTIONS = "--suitestatlevel 3"
+
+# 作业超时以后先发送SIGTERM，等待KILL_GRACE秒以后还没有结束的进程发送SIGKILL
+KILL_GRACE = 10
+# 作业因为超时被结束时，作业进程的退出码
+EXIT_TIMEOUT = 124
+
+# 测试结果的统计，参见summarize_output
+SUMMARY_FILE = 'output_summary.json'
+# 每一个测试的结果[长名字, 状态, 用时秒, 失败的信息]，报告作业完成时上传到服务端
+TEST_RESULTS_FILE = 'output_tests.json'
+# 作业超时以后运行测试的线程没有结束时，在工作目录中留下这个文件，说明日志和输出文件不完整
+INCOMPLETE_FILE = 'output_incomplete'
+# 上传的失败信息最多保留的字符数
+MAX_MESSAGE_LENGTH = 1000
+
+# Worker定时向服务端报告正在运行的作业的间隔（秒），有作业正在被查看时每秒报告一次
+OUTPUT_INTERVAL = 5
+WATCHED_OUTPUT_INTERVAL = 1
+# 一次性的Worker运行作业期间发送心跳的间隔（秒），放在定时报告中一起发送，常驻Worker每次定时报告都发送心跳
+#   要比服务端的LEASE_SECONDS短得多
+HEARTBEAT_INTERVAL = 15
+
+# 预先加载模式下，Worker启动时就加载的模块
+PRELOAD_MODULES = (
+    'robot.running',
+    'robot.reporting',
+    'robot.libraries.BuiltIn',
+    'robot.libraries.Collections',
+    'robot.libraries.OperatingSystem',
+    'robot.libraries.String',
+)
+
+
+# 反射方法，用来根据函数名字来调用具体的函数
+class SubTestClassFactory:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def get_test(p_module_name, p_class_name):
+        obj_module = __import__(p_module_name)
+        return getattr(obj_module, p_class_name)
+
+
+# 运行具体的测试程序
+def run_test(p_test_main_file, p_test_main_class, p_sys_argv):
+    SubTestClassFactory().get_test(p_test_main_file, p_test_main_class)().run(p_sys_argv)
+
+
+# 一个作业的运行环境
+#   作业需要的环境变量只放在自己的env中，启动robot进程时传进去，不修改当前进程的os.environ，
+#   作业的输出也只写到自己的日志文件中，同一个进程中的多个作业互相不影响
+#   资源标签属性的解析结果按照属性字符串缓存，同一个资源标签的作业只解析一次
+class JobContext(object):
+    _properties_cache = {}
+    _properties_lock = threading.Lock()
+
+    def __init__(self, p_job, p_work_directory):
+        self.job = p_job
+        self.work_directory = p_work_directory
+        self.module_name = str(p_job['REGRESS_NAME'])
+        self.label_environs = self.parse_properties(str(p_job['PROPERTIES']), p_cache=True)
+        self.option_environs = self.parse_properties(str(p_job['REGRESS_OPTIONS']))
+        self.env = dict(os.environ)
+        self.env['T_WORK'] = p_work_directory
+        self.env['ROBOT_OPTIONS'] = ROBOT_OPTIONS
+        self.env['ROBOT_SYSLOG_FILE'] = os.path.join(p_work_directory, self.module_name + "_syslog.log")
+        self.env.update(self.label_environs)
+        self.env.update(self.option_environs)
+        # 作业的输出和错误日志，打开以前输出到当前进程的标准输出
+        self.stdout = None
+        self.stderr = None
+        # 运行测试的robot进程，它是自己的进程组的组长，超时的时候结束整个进程组
+        self.process = None
+        self.timed_out = False
+
+    # 将"A=1,B='x,y',C"格式的属性解析为[(KEY, VALUE), ...]，没有值的属性值为"1"
+    @classmethod
+    def parse_properties(cls, p_properties, p_cache=False):
+        if p_cache:
+            with cls._properties_lock:
+                m_Environs = cls._properties_cache.get(p_properties)
+            if m_Environs is not None:
+                return m_Environs
+
+        m_Environs = []
+        m_robot_environs = shlex.shlex(p_properties)
+        m_robot_environs.whitespace = ','
+        m_robot_environs.quotes = "'"
+        m_robot_environs.whitespace_split = True
+        for m_robot_environ_str in list(m_robot_environs):
+            m_nPos = m_robot_environ_str.find('=')
+            if m_nPos != -1:
+                m_robot_environ_key = m_robot_environ_str[0:m_nPos].strip()
+                m_robot_environ_value = m_robot_environ_str[m_nPos+1:].strip()
+            else:
+                m_robot_environ_key = m_robot_environ_str
+                m_robot_environ_value = "1"
+            m_Environs.append((m_robot_environ_key, m_robot_environ_value))
+
+        if p_cache:
+            with cls._properties_lock:
+                cls._properties_cache[p_properties] = m_Environs
+        return m_Environs
+
+    def path(self, p_file_name):
+        return os.path.join(self.work_directory, p_file_name)
+
+    # 打开作业的输出和错误日志
+    def open_logs(self):
+        self.stdout = open(self.path(self.module_name + '.tlg'), 'w')
+        self.stderr = open(self.path(self.module_name + '.err'), 'w')
+
+    def close_logs(self):
+        self.stdout.close()
+        self.stderr.close()
+        self.stdout = None
+        self.stderr = None
+
+    # 输出一行到作业的日志中
+    def log(self, p_message):
+        print(p_message, file=self.stdout or sys.stdout, flush=True)
+
+    # 结束运行测试的robot进程和它启动的所有进程
+    def kill(self, p_grace=KILL_GRACE):
+        if self.process is not None:
+            kill_process_group(self.process, p_grace)
+
+
+# 一个进程的所有子孙进程，包括自己建立了新的进程组或者会话的（例如Robot Framework的Process库启动的进程）
+#   只在有/proc的系统上支持，其他系统返回空的列表
+def descendant_pids(p_pid):
+    if not os.path.isdir('/proc'):
+        return []
+    m_Children = {}
+    for m_Name in os.listdir('/proc'):
+        if not m_Name.isdigit():
+            continue
+        try:
+            with open('/proc/' + m_Name + '/stat', 'rb') as f:
+                m_Stat = f.read()
+        except OSError:
+            continue
+        # 进程名中可能有空格和括号，父进程号在最后一个右括号后面的第二个字段
+        m_PPid = int(m_Stat[m_Stat.rindex(b')') + 2:].split()[1])
+        m_Children.setdefault(m_PPid, []).append(int(m_Name))
+    m_Pids = []
+    m_Stack = [p_pid]
+    while m_Stack:
+        for m_Child in m_Children.get(m_Stack.pop(), []):
+            m_Pids.append(m_Child)
+            m_Stack.append(m_Child)
+    return m_Pids
+
+
+# 向进程组p_pgid和进程p_pids发送信号，返回是否还有进程存在（僵尸进程不算）
+def signal_processes(p_pgid, p_pids, p_signal):
+    m_Alive = False
+    if p_pgid is not None:
+        try:
+            os.killpg(p_pgid, p_signal)
+            m_Alive = True
+        except (ProcessLookupError, PermissionError):
+            pass
+    for m_Pid in p_pids:
+        try:
+            with open('/proc/' + str(m_Pid) + '/stat', 'rb') as f:
+                if f.read().rsplit(b')', 1)[1].split()[0] == b'Z':
+                    continue
+        except OSError:
+            pass
+        try:
+            os.kill(m_Pid, p_signal)
+            m_Alive = True
+        except (ProcessLookupError, PermissionError):
+            pass
+    return m_Alive
+
+
+# 结束进程组p_pgid和进程p_pids，先发送SIGTERM，p_grace秒以后还没有结束的再发送SIGKILL
+#   进程组的组长已经结束，组里还有其他进程的时候，组长的编号不会被重用，可以继续用来结束这些进程
+def terminate_processes(p_pgid, p_pids, p_grace=KILL_GRACE):
+    if not signal_processes(p_pgid, p_pids, signal.SIGTERM):
+        return
+    m_Deadline = time.monotonic() + p_grace
+    while time.monotonic() < m_Deadline:
+        time.sleep(0.1)
+        if not signal_processes(p_pgid, p_pids, 0):
+            return
+    signal_processes(p_pgid, p_pids, signal.SIGKILL)
+
+
+# 结束robot进程所在的进程组，以及它启动的、已经离开这个进程组的进程
+def kill_process_group(p_process, p_grace=KILL_GRACE):
+    if not hasattr(os, 'killpg'):
+        p_process.kill()
+        return
+    terminate_processes(p_process.pid, descendant_pids(p_process.pid), p_grace)
+
+
+# 强制结束一个进程组中还在运行的进程，例如测试结束以后留在后台的进程
+def cleanup_process_group(p_pgid):
+    if not hasattr(os, 'killpg'):
+        return
+    signal_processes(p_pgid, [], signal.SIGKILL)
+
+
+# 运行RF测试程序
+#   p_in_process为True时直接在当前进程中调用Robot Framework，调用者需要保证当前进程只运行这一个作业
+def run_robot_framework_test(p_context, p_test_main_entry, p_in_process=False):
+    m_robot_outputdir = p_context.work_directory
+    Commands = "robot --loglevel DEBUG:INFO --outputdir " + m_robot_outputdir + " " + p_test_main_entry
+
+    # 资源标签的属性和回归测试的选项变成环境变量
+    for m_robot_environ_key, m_robot_environ_value in p_context.label_environs:
+        p_context.log('label ENV [' + m_robot_environ_key + ']=[' + m_robot_environ_value + ']')
+    for m_robot_environ_key, m_robot_environ_value in p_context.option_environs:
+        p_context.log('Options ENV [' + m_robot_environ_key + ']=[' + m_robot_environ_value + ']')
+
+    # 启动RF程序
+    p_context.log("Will run robot command [" + Commands + "]")
+    if p_in_process:
+        # Robot Framework已经加载好了，不需要再启动一个新的解释器
+        # Robot Framework从os.environ中读取环境变量，这个进程只运行这一个作业，可以直接替换
+        os.environ.clear()
+        os.environ.update(p_context.env)
+        os.chdir(m_robot_outputdir)
+        run_cli(['--loglevel', 'DEBUG:INFO', '--outputdir', m_robot_outputdir] + shlex.split(p_test_main_entry),
+                exit=False)
+    elif 'win32' in str(sys.platform).lower():
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags = subprocess.CREATE_NEW_CONSOLE | subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        p = subprocess.Popen(Commands,
+                             startupinfo=startupinfo,
+                             env=p_context.env,
+                             cwd=m_robot_outputdir)
+        p_context.process = p
+        p.communicate()
+    else:
+        # robot在自己的进程组中运行，超时的时候可以结束它启动的所有进程
+        # 用exec让robot直接替换shell成为进程组的组长，收到SIGTERM时robot可以先写完输出文件再退出
+        p = subprocess.Popen("exec " + Commands,
+                             shell=True,
+                             stdout=p_context.stdout,
+                             stderr=p_context.stderr,
+                             env=p_context.env,
+                             cwd=m_robot_outputdir,
+                             start_new_session=True)
+        p_context.process = p
+        p.wait()
+        # 测试留在后台的进程也一起结束
+        cleanup_process_group(p.pid)
+    p_context.log("Finished command [" + Commands + "]")
+
+    # 处理一下报告日志，记录运行时间，测试结果的统计写到SUMMARY_FILE中，每个测试的结果写到TEST_RESULTS_FILE中
+    # Worker报告作业完成时带给服务端
+    m_TestResults = []
+    m_Summary = summarize_output(p_context.path("output.xml"), p_context.path("output.csv"), "suite-test-keyword",
+                                 lambda p_name, p_status, p_elapsed, p_message: m_TestResults.append(
+                                     (p_name, p_status, p_elapsed, p_message[0:MAX_MESSAGE_LENGTH])))
+    with open(p_context.path(SUMMARY_FILE), 'w') as f:
+        json.dump(m_Summary, f)
+    with open(p_context.path(TEST_RESULTS_FILE), 'w') as f:
+        json.dump(m_TestResults, f)
+
+
+# 作业对应的测试程序目录
+def get_test_path(p_job):
+    return os.path.join(os.environ['T_SRCHOME'], str(p_job['REGRESS_NAME']))
+
+
+# 预先加载运行测试需要的模块，之后从forkserver中fork出来的子进程不再需要加载
+def preload_robot():
+    for m_Module in PRELOAD_MODULES:
+        importlib.import_module(m_Module)
+
+
+# 运行测试的线程，异常信息写到作业自己的错误日志中
+def run_job_thread(p_context, p_test_main_entry, p_in_process):
+    try:
+        run_robot_framework_test(p_context, p_test_main_entry, p_in_process)
+    except Exception:
+        traceback.print_exc(file=p_context.stderr)
+        p_context.stderr.flush()
+
+
+# 运行一个作业，完成后把需要备份的内容移到暂存目录中，返回暂存目录
+#   调用者报告作业完成以后再用BackupStore备份暂存目录，工作目录可以马上给下一个作业使用
+#   超过作业的LIMIT_TIME时结束robot的整个进程组，p_context.timed_out为True，调用者报告为TIMEOUT
+#     在当前进程中运行的Robot Framework无法结束，由调用者结束整个作业进程（参见WorkerDaemon）
+#   超时以后运行测试的线程还没有结束时（在当前进程中运行的Robot Framework，或者robot结束以后KILL_GRACE秒内没有结束），
+#     它还在写输出文件和日志，不能暂存，在工作目录中留下INCOMPLETE_FILE，返回None，
+#     调用者在作业进程退出以后再暂存（参见WorkerDaemon.reap）
+#   不修改当前进程的工作目录、环境变量和标准输出，同一个进程中可以同时运行多个作业
+#   p_in_process为True时在当前进程中运行Robot Framework，只能用在为这个作业单独创建的进程中
+#   p_workspace_mode为准备工作目录的方式，参见Workspace
+def run_job(p_context, p_in_process=False, p_workspace_mode='copy'):
+    m_job = p_context.job
+    m_work_directory = p_context.work_directory
+    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Work directory ：' + m_work_directory)
+
+    # 把工作目录同步成测试目录的内容，只复制有变化的文件，删除上一个作业留下的文件
+    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Syncing test ')
+    m_Stats = Workspace(m_work_directory, p_workspace_mode).sync(get_test_path(m_job))
+    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+          'Copied %d files (%d bytes), %d unchanged, %d removed.' %
+          (m_Stats['Copied'], m_Stats['Bytes'], m_Stats['Unchanged'], m_Stats['Removed']))
+
+    # 程序输出、错误定向到新的目录
+    m_module_name = p_context.module_name
+    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Will write output log to ：' + m_module_name + '.tlg')
+    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Will write error log to ：' + m_module_name + '.err')
+    p_context.open_logs()
+    if p_in_process:
+        # Robot Framework的控制台输出直接写到sys.__stdout__，需要重定向文件描述符
+        m_saved_fds = (os.dup(1), os.dup(2))
+        os.dup2(p_context.stdout.fileno(), 1)
+        os.dup2(p_context.stderr.fileno(), 2)
+
+    # 运行Case
+    worker_thread = None
+    if m_job['REGRESS_TYPE'].upper() == 'RF':
+        p_context.log(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Started RF test ' + m_module_name)
+        worker_thread = threading.Thread(
+            target=run_job_thread,
+            args=(
+                p_context,
+                str(m_job['MAIN_ENTRY']),
+                p_in_process))
+        worker_thread.daemon = True
+        worker_thread.start()
+        worker_thread.join(int(m_job['LIMIT_TIME']))
+        if worker_thread.is_alive():
+            p_context.timed_out = True
+            p_context.log(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                          'Error:  MAX LIMIT TIME EXCEED: ' + str(m_job['LIMIT_TIME']))
+            if not p_in_process:
+                # robot进程结束以后，运行测试的线程马上就会结束
+                p_context.kill()
+                worker_thread.join(KILL_GRACE)
+            else:
+                # 运行测试的线程无法结束，不再等待，只结束测试启动的进程，作业进程退出以后由调用者暂存
+                terminate_processes(None, descendant_pids(os.getpid()))
+    else:
+        p_context.log(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                      "Error:: UNKNOWN REGRESS_TYPE [" + m_job['REGRESS_TYPE'] + "]")
+
+    # 还原程序输出、错误输出的位置
+    if p_in_process:
+        sys.__stdout__.flush()
+        sys.__stderr__.flush()
+        os.dup2(m_saved_fds[0], 1)
+        os.dup2(m_saved_fds[1], 2)
+        os.close(m_saved_fds[0])
+        os.close(m_saved_fds[1])
+    if worker_thread is not None and worker_thread.is_alive():
+        # 运行测试的线程还在写output.xml和日志，这时暂存会把写了一半的文件放到备份中，也不能汇总测试结果
+        p_context.log(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                      'Error:  test still running after kill, logs are incomplete.')
+        with open(p_context.path(INCOMPLETE_FILE), 'w') as f:
+            f.write('Test still running after MAX LIMIT TIME EXCEED: ' + str(m_job['LIMIT_TIME']) + '\n')
+        return None
+    p_context.close_logs()
+
+    # 暂存工作日志
+    return Workspace(m_work_directory, p_workspace_mode).stage(m_job['ID'])
+
+
+# 常驻Worker中运行一个作业的进程
+#   作业进程是自己的进程组的组长，Worker结束这个进程组时，作业启动的所有进程都会被结束
+#   作业超时的时候退出码为EXIT_TIMEOUT
+def run_job_process(p_context, p_in_process, p_workspace_mode):
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    run_job(p_context, p_in_process, p_workspace_mode)
+    if p_context.timed_out:
+        sys.exit(EXIT_TIMEOUT)
+
+
+# 读取暂存目录中测试结果的统计，没有的时候（例如测试没有正常结束）返回None
+def read_summary(p_staging):
+    if p_staging is None:
+        return None
+    try:
+        with open(os.path.join(p_staging, SUMMARY_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# 读取暂存目录中每个测试的结果，没有的时候返回None
+def read_test_results(p_staging):
+    if p_staging is None:
+        return None
+    try:
+        with open(os.path.join(p_staging, TEST_RESULTS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# 一次性的Worker在运行作业期间，在后台线程中定时发送心跳，服务端据此知道作业仍然在运行
+#   p_log_path不为None时同时报告作业的日志，和常驻Worker一样，作业正在被查看时才带上新增加的行
+#   作业运行期间主线程不使用这个连接，停止心跳以后主线程才能再使用
+class Heartbeat(object):
+    def __init__(self, p_proxy, p_job_id, p_interval=HEARTBEAT_INTERVAL, p_log_path=None):
+        self.proxy = p_proxy
+        self.job_id = p_job_id
+        self.interval = p_interval
+        self.tail = None if p_log_path is None else LogTail(p_log_path)
+        self.watched = False
+        self.heartbeats = True
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def report_interval(self):
+        if self.tail is None:
+            return self.interval
+        return WATCHED_OUTPUT_INTERVAL if self.watched else OUTPUT_INTERVAL
+
+    # 需要报告给服务端的日志，正在被查看时读取新增加的行
+    def collect_outputs(self):
+        return {self.job_id: self.tail.read() if self.watched else []}
+
+    def run(self):
+        m_HeartbeatTime = time.monotonic()
+        while not self.stopped.wait(self.report_interval()):
+            m_Output = None
+            m_Heartbeat = None
+            with self.proxy.batch() as m_Batch:
+                if self.tail is not None:
+                    m_Output = m_Batch.report_job_output(p_outputs=self.collect_outputs())
+                if self.heartbeats and time.monotonic() - m_HeartbeatTime >= self.interval:
+                    m_HeartbeatTime = time.monotonic()
+                    m_Heartbeat = m_Batch.heartbeat_jobs(p_machine_name=socket.gethostname(),
+                                                         p_os_pid=str(os.getpid()), p_job_ids=[self.job_id])
+            if m_Output is not None:
+                try:
+                    m_Result = m_Output.result()
+                    if m_Result['Result']:
+                        self.watched = self.job_id in m_Result['Watched']
+                except KeyError:
+                    # 旧版本的服务端不支持查看作业的输出
+                    self.tail = None
+            if m_Heartbeat is not None:
+                try:
+                    m_Result = m_Heartbeat.result()
+                except KeyError:
+                    # 旧版本的服务端不支持心跳
+                    self.heartbeats = False
+                    m_Result = {'Result': False}
+                if m_Result['Result'] and m_Result['Lost']:
+                    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                          'Warning:: JOB ' + str(self.job_id) + ' has been reclaimed by server.')
+                    return
+            if self.tail is None and not self.heartbeats:
+                return
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+# 输出一个作业的备份结果
+def print_backup_result(p_job_id, p_stats, p_error=None):
+    if p_error is not None:
+        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+              'Error:: backup log ' + str(p_job_id) + ' failed. ' + str(p_error))
+        return
+    print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'backup log ' + str(p_job_id) +
+          ': %d files, %d bytes compressed, %d shared test files' %
+          (p_stats['Files'], p_stats['Bytes'], p_stats['Shared']) +
+          (', %d changed since the job ran and not kept' % p_stats['Lost'] if p_stats['Lost'] else ''))
+
+
+# 常驻的Worker，同时运行最多p_slots个作业
+#   每个作业在自己的进程中运行，使用T_WORK下自己的slot_N目录
+#   和服务端之间只有一个连接：
+#     有空闲的位置时发出一个等待作业的请求（长轮询），不等待应答
+#     作业完成以后马上在同一个连接上发出批量请求，报告完成并为空闲的位置取新的作业
+#     服务端收到新的请求时会结束正在等待的请求，所以不需要第二个连接
+#   p_zygote为True时，启动时预先加载Robot Framework，每个作业从Worker进程fork出来，
+#   在子进程中直接运行Robot Framework，不再启动新的解释器。子进程的环境变量和Worker启动时一样，
+#   不受其他作业的影响
+#   作业进程结束以后马上报告给服务端，工作日志在后台线程中备份
+#   作业进程超过LIMIT_TIME以后还没有结束的，强制结束整个作业进程组，作业报告为TIMEOUT
+#   定时向服务端报告正在运行的作业，有人查看（farm --tail_job）的作业同时报告日志中新增加的行
+class WorkerDaemon(object):
+    def __init__(self, p_proxy, p_connection, p_slots, p_work_directory, p_backup_directory,
+                 p_labels=None, p_wait_timeout=60, p_zygote=False, p_workspace_mode='copy'):
+        self.proxy = p_proxy
+        self.connection = p_connection
+        self.work_directory = p_work_directory
+        self.backup_directory = p_backup_directory
+        self.backup = BackupWriter(BackupStore(p_backup_directory))
+        self.labels = p_labels
+        # 常驻的Worker总是等待作业
+        self.wait_timeout = p_wait_timeout if p_wait_timeout > 0 else 60
+        # 每个位置上是(作业信息, 进程)，空闲的位置是None
+        self.slots = [None] * p_slots
+        # 每个位置上次运行的回归测试，同样的回归测试尽量放到同一个位置上，工作目录只需要很少的同步
+        self.slot_regress = [None] * p_slots
+        # 每个位置上的作业必须结束的时间，超过以后强制结束作业进程
+        self.slot_deadline = [None] * p_slots
+        # 超时被强制结束的作业
+        self.killed = set()
+        # 已经发送了SIGTERM的进程[(进程组, 子孙进程, 发送SIGKILL的时间)]，到时间还没有结束的再发送SIGKILL
+        self.kills = []
+        # 租约到期、已经被服务端回收的作业，结束以后不再报告
+        self.lost = set()
+        self.workspace_mode = p_workspace_mode
+        # 已经结束、还没有报告给服务端的作业(ID, 状态, 备注, 测试结果的统计, 每个测试的结果)
+        self.finished = []
+        # 正在运行和还没有报告完成的作业的日志，作业编号 -> LogTail
+        self.tails = {}
+        # 服务端返回的正在被查看的作业
+        self.watched = set()
+        self.output_time = time.monotonic()
+        # 还没有收到应答的长轮询
+        self.poll = None
+        # 服务端支持claim_jobs时一次调用取满所有空闲的位置，旧版本的服务端逐个调用get_todo_job
+        self.claim_jobs = True
+        self.stopping = False
+        self.zygote = p_zygote
+        # Worker进程中有备份线程，直接从Worker进程fork时，子进程可能继承其他线程持有的锁（例如标准输出、备份队列的锁）
+        #   作业进程由forkserver fork出来：forkserver是一个新启动的、只有一个线程的进程，
+        #   预先加载好模块以后不再启动任何线程，只有这样fork才是安全的
+        #   --zygote时forkserver同时预先加载Robot Framework运行测试用到的模块，作业进程直接运行测试
+        #   不支持forkserver的系统上每个作业进程是一个新的解释器（spawn）
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.mp_context = multiprocessing.get_context('forkserver')
+            self.mp_context.set_forkserver_preload(['__main__', __name__] + (list(PRELOAD_MODULES) if p_zygote else []))
+        else:
+            self.mp_context = multiprocessing.get_context('spawn')
+        self.worker_info = {
+            'p_worker_user_name': getpass.getuser(),
+            'p_os_pid': str(os.getpid()),
+            'p_machine_name': socket.gethostname(),
+            'p_work_directory': p_work_directory,
+            'p_backup_directory': p_backup_directory,
+            'p_labels': p_labels
+        }
+
+    def slot_directory(self, p_slot):
+        return os.path.join(self.work_directory, 'slot_' + str(p_slot))
+
+    # 空闲的位置数量，已经发出的长轮询预留了一个位置
+    def free_slots(self):
+        return self.slots.count(None) - (1 if self.poll is not None else 0)
+
+    def running_slots(self):
+        return len(self.slots) - self.slots.count(None)
+
+    # 在一个空闲的位置上启动作业
+    def start_job(self, p_job):
+        m_TestPath = get_test_path(p_job)
+        if not os.path.exists(m_TestPath):
+            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Aborted JOB ' + str(p_job['ID']))
+            self.finished.append((p_job['ID'], 'ERROR', 'TestPath not exist. [' + str(m_TestPath) + "]", None, None))
+            return
+        m_FreeSlots = [i for i, m_Running in enumerate(self.slots) if m_Running is None]
+        m_Slot = next((i for i in m_FreeSlots if self.slot_regress[i] == p_job['REGRESS_NAME']), m_FreeSlots[0])
+        self.slot_regress[m_Slot] = p_job['REGRESS_NAME']
+        # 运行环境在Worker进程中准备好，资源标签属性的解析结果可以被后面的作业重用
+        m_Context = JobContext(p_job, self.slot_directory(m_Slot))
+        m_Process = self.mp_context.Process(target=run_job_process,
+                                         args=(m_Context, self.zygote, self.workspace_mode))
+        m_Process.start()
+        self.slots[m_Slot] = (p_job, m_Process)
+        # 作业进程自己在LIMIT_TIME时结束robot，这里多留出结束进程、等待运行测试的线程和暂存日志的时间
+        self.slot_deadline[m_Slot] = time.monotonic() + int(p_job['LIMIT_TIME']) + KILL_GRACE * 3
+        self.tails[p_job['ID']] = LogTail(m_Context.path(m_Context.module_name + '.tlg'))
+        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+              'Will do JOB [' + str(p_job['ID']) + '] in slot ' + str(m_Slot) + ' ....')
+
+    # 处理get_todo_job的结果
+    def accept(self, p_result):
+        if p_result['Result']:
+            self.start_job(p_result)
+        elif p_result['Message'] != 'No TASK TO DO ....':
+            # 服务端出错时等一下再试，避免不停地发出请求
+            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Error:: " + str(p_result['Message']))
+            time.sleep(1)
+
+    # 处理claim_jobs的结果，每一行是按照Columns排列的一个作业
+    def accept_claimed(self, p_result):
+        if not p_result['Result']:
+            self.accept(p_result)
+            return
+        for row in p_result['Rows']:
+            m_Job = dict(zip(p_result['Columns'], row))
+            m_Job['Result'] = True
+            self.start_job(m_Job)
+
+    # 回收已经结束的作业进程
+    def reap(self):
+        for m_Slot, m_Running in enumerate(self.slots):
+            if m_Running is None or m_Running[1].is_alive():
+                continue
+            m_Job, m_Process = m_Running
+            m_Process.join()
+            # 作业留在后台的进程也一起结束
+            cleanup_process_group(m_Process.pid)
+            # 作业进程已经把日志移到了暂存目录
+            m_Workspace = Workspace(self.slot_directory(m_Slot), self.workspace_mode)
+            m_Staging = m_Workspace.staging_directory(m_Job['ID'])
+            m_Incomplete = not os.path.exists(m_Staging) and \
+                os.path.exists(os.path.join(self.slot_directory(m_Slot), INCOMPLETE_FILE))
+            if m_Incomplete:
+                # 超时以后运行测试的线程没有结束，作业进程没有暂存日志，进程退出以后不会再有写入，这时再暂存
+                # 输出文件不完整，不汇总测试结果
+                m_Workspace.stage(m_Job['ID'])
+                m_Summary = None
+                m_TestResults = None
+            else:
+                m_Summary = read_summary(m_Staging)
+                m_TestResults = read_test_results(m_Staging)
+            if m_Job['ID'] in self.lost:
+                # 服务端已经把作业交给了别的Worker
+                self.lost.discard(m_Job['ID'])
+                self.killed.discard(m_Job['ID'])
+                self.tails.pop(m_Job['ID'], None)
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Lost JOB ' + str(m_Job['ID']))
+            elif m_Process.exitcode == 0:
+                self.finished.append((m_Job['ID'], 'COMPLETED', '', m_Summary, m_TestResults))
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Completed JOB ' + str(m_Job['ID']))
+            elif m_Process.exitcode == EXIT_TIMEOUT or m_Job['ID'] in self.killed:
+                self.killed.discard(m_Job['ID'])
+                self.finished.append((m_Job['ID'], 'TIMEOUT', 'MAX LIMIT TIME EXCEED: ' + str(m_Job['LIMIT_TIME']) +
+                                      (', logs incomplete.' if m_Incomplete else ''), m_Summary, m_TestResults))
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Timeout JOB ' + str(m_Job['ID']))
+            else:
+                self.finished.append((m_Job['ID'], 'ERROR', 'Worker process exit code [' +
+                                      str(m_Process.exitcode) + ']', m_Summary, m_TestResults))
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Failed JOB ' + str(m_Job['ID']))
+            self.slots[m_Slot] = None
+            if os.path.exists(m_Staging):
+                self.backup.submit(m_Job['ID'], m_Staging)
+
+    # 结束作业进程所在的进程组和它的所有子孙进程，先发送SIGTERM，KILL_GRACE秒以后还没有结束的在enforce_limits中发送SIGKILL
+    #   作业进程中的robot在自己的会话中运行，不在作业进程的进程组里，需要按照父子关系找到
+    #   不在这里等待，主循环可以继续处理其他位置上的作业
+    def kill_job(self, p_process):
+        if not hasattr(os, 'killpg'):
+            p_process.kill()
+            return
+        # 先找到子孙进程，作业进程结束以后它的子进程就不再能够通过父进程号找到
+        m_Pids = descendant_pids(p_process.pid)
+        if signal_processes(p_process.pid, m_Pids, signal.SIGTERM):
+            self.kills.append((p_process.pid, m_Pids, time.monotonic() + KILL_GRACE))
+
+    # 超过时间限制还没有结束的作业进程（例如在作业进程中运行的Robot Framework没有响应），结束它和它启动的所有进程
+    #   之前发送了SIGTERM、KILL_GRACE秒以后还没有结束的进程发送SIGKILL
+    def enforce_limits(self):
+        m_Now = time.monotonic()
+        m_Kills, self.kills = self.kills, []
+        for m_PGid, m_Pids, m_KillTime in m_Kills:
+            if not signal_processes(m_PGid, m_Pids, 0):
+                continue
+            if m_Now < m_KillTime:
+                self.kills.append((m_PGid, m_Pids, m_KillTime))
+                continue
+            signal_processes(m_PGid, m_Pids, signal.SIGKILL)
+        for m_Slot, m_Running in enumerate(self.slots):
+            if m_Running is None or m_Running[0]['ID'] in self.killed or m_Now < self.slot_deadline[m_Slot]:
+                continue
+            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                  'Kill JOB ' + str(m_Running[0]['ID']) + ', MAX LIMIT TIME EXCEED: ' + str(m_Running[0]['LIMIT_TIME']))
+            self.killed.add(m_Running[0]['ID'])
+            self.kill_job(m_Running[1])
+
+    # 提交上次Worker退出时还没有完成的备份
+    def recover_backups(self):
+        for m_Slot in range(len(self.slots)):
+            m_StagingRoot = os.path.join(self.slot_directory(m_Slot), Workspace.STAGING)
+            if not os.path.isdir(m_StagingRoot):
+                continue
+            for m_Name in sorted(os.listdir(m_StagingRoot)):
+                if os.path.isdir(os.path.join(m_StagingRoot, m_Name)):
+                    self.backup.submit(m_Name, os.path.join(m_StagingRoot, m_Name))
+
+    # 输出已经完成的备份
+    def report_backups(self):
+        while self.backup.done:
+            print_backup_result(*self.backup.done.popleft())
+
+    # 长轮询收到了应答
+    def collect_poll(self):
+        if self.poll is not None and self.poll.done():
+            m_Result = self.poll.result()
+            self.poll = None
+            self.accept(m_Result)
+            return m_Result['Result']
+        return False
+
+    # 发送心跳，延长正在运行的作业的租约
+    def send_heartbeat(self, p_batch):
+        m_JobIDs = [m_Running[0]['ID'] for m_Running in self.slots if m_Running is not None]
+        if not m_JobIDs:
+            return None
+        return p_batch.heartbeat_jobs(p_machine_name=self.worker_info['p_machine_name'],
+                                      p_os_pid=self.worker_info['p_os_pid'], p_job_ids=m_JobIDs)
+
+    # 服务端已经回收的作业，马上结束
+    def accept_heartbeat(self, p_future):
+        if p_future is None:
+            return
+        try:
+            m_Result = p_future.result()
+        except KeyError:
+            # 旧版本的服务端不支持心跳
+            return
+        if not m_Result['Result']:
+            return
+        for m_Running in self.slots:
+            if m_Running is None or int(m_Running[0]['ID']) not in m_Result['Lost'] or \
+                    m_Running[0]['ID'] in self.lost:
+                continue
+            print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+                  'Kill JOB ' + str(m_Running[0]['ID']) + ', reclaimed by server.')
+            self.lost.add(m_Running[0]['ID'])
+            self.kill_job(m_Running[1])
+
+    # 需要报告给服务端的作业输出，正在被查看的作业读取日志中新增加的行
+    def collect_outputs(self):
+        self.output_time = time.monotonic()
+        return {m_JobID: m_Tail.read() if m_JobID in self.watched else []
+                for m_JobID, m_Tail in self.tails.items()}
+
+    def accept_outputs(self, p_future):
+        try:
+            m_Result = p_future.result()
+        except KeyError:
+            # 旧版本的服务端不支持查看作业的输出
+            return
+        if m_Result['Result']:
+            self.watched = set(m_Result['Watched'])
+
+    # 定时报告正在运行的作业，同时发送心跳
+    def report_outputs(self):
+        with self.proxy.batch() as m_Batch:
+            m_Future = m_Batch.report_job_output(p_outputs=self.collect_outputs())
+            m_Heartbeat = self.send_heartbeat(m_Batch)
+        self.collect_poll()
+        self.accept_outputs(m_Future)
+        self.accept_heartbeat(m_Heartbeat)
+
+    def output_due(self):
+        m_Interval = WATCHED_OUTPUT_INTERVAL if self.watched else OUTPUT_INTERVAL
+        return len(self.tails) > 0 and time.monotonic() - self.output_time >= m_Interval
+
+    # 一次往返完成：报告已经结束的作业最后的输出和所有已经结束的作业，用一个claim_jobs取满空闲的位置
+    #   每个测试的结果在同一个批量调用中先于finish_job上传
+    def sync(self):
+        m_Finished, self.finished = self.finished, []
+        m_Free = 0 if self.stopping else self.free_slots()
+        m_Outputs = self.collect_outputs()
+        for m_JobID, m_Status, m_Notes, m_Summary, m_TestResults in m_Finished:
+            self.tails.pop(m_JobID, None)
+        m_UploadResults = []
+        m_FinishResults = []
+        with self.proxy.batch() as m_Batch:
+            m_OutputResult = m_Batch.report_job_output(p_outputs=m_Outputs)
+            m_Heartbeat = self.send_heartbeat(m_Batch)
+            for m_JobID, m_Status, m_Notes, m_Summary, m_TestResults in m_Finished:
+                if m_TestResults:
+                    m_UploadResults.append(m_Batch.upload_test_results(p_job_id=m_JobID,
+                                                                       p_test_results=m_TestResults))
+                m_Finish = {'p_job_id': m_JobID, 'p_job_status': m_Status, 'p_notes': m_Notes,
+                            'p_summary': m_Summary, 'p_machine_name': self.worker_info['p_machine_name'],
+                            'p_os_pid': self.worker_info['p_os_pid']}
+                m_FinishResults.append((m_Finish, m_Batch.finish_job(**m_Finish)))
+            m_Claim = None
+            m_TodoResults = []
+            if m_Free > 0 and self.claim_jobs:
+                m_Claim = m_Batch.claim_jobs(p_max_jobs=m_Free, **self.worker_info)
+            else:
+                m_TodoResults = [m_Batch.get_todo_job(**self.worker_info) for i in range(m_Free)]
+        # 发出批量请求时正在等待的长轮询会先返回
+        self.collect_poll()
+        self.accept_outputs(m_OutputResult)
+        self.accept_heartbeat(m_Heartbeat)
+        for m_Future in m_UploadResults:
+            try:
+                m_Result = m_Future.result()
+            except KeyError:
+                # 旧版本的服务端不支持上传测试结果
+                continue
+            if not m_Result['Result']:
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Error:: " + str(m_Result['Message']))
+        for m_Finish, m_Future in m_FinishResults:
+            try:
+                m_Result = m_Future.result()
+            except KeyError as ex:
+                # 批量调用没有被执行（例如旧版本的服务端不支持批量调用），不能丢掉作业的完成状态，单独再报告一次
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Error:: finish JOB " +
+                      str(m_Finish['p_job_id']) + ' in batch failed. ' + repr(ex) + ', retry.')
+                m_Result = self.finish_directly(m_Finish)
+            if not m_Result['Result']:
+                print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + "Error:: " + str(m_Result['Message']))
+        if m_Claim is not None:
+            try:
+                self.accept_claimed(m_Claim.result())
+            except KeyError:
+                # 旧版本的服务端不支持claim_jobs，空闲的位置由下一次请求来取
+                self.claim_jobs = False
+        for m_Future in m_TodoResults:
+            self.accept(m_Future.result())
+
+    # 不使用批量调用报告一个作业完成
+    #   旧版本的服务端不认识测试结果统计和Worker的参数时，只报告作业的状态
+    def finish_directly(self, p_finish):
+        try:
+            return self.proxy.finish_job(**p_finish)
+        except TypeError:
+            return self.proxy.finish_job(p_job_id=p_finish['p_job_id'], p_job_status=p_finish['p_job_status'],
+                                         p_notes=p_finish['p_notes'])
+
+    # 停止接受新的作业，等正在运行的作业结束以后退出
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        for m_Slot in range(len(self.slots)):
+            if not os.path.exists(self.slot_directory(m_Slot)):
+                os.makedirs(self.slot_directory(m_Slot))
+        if self.mp_context.get_start_method() == 'forkserver':
+            # 先启动forkserver，预先加载模块的时间不算在第一个作业中
+            m_Process = self.mp_context.Process(target=preload_robot)
+            m_Process.start()
+            m_Process.join()
+        self.backup.start()
+        self.recover_backups()
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) +
+              'Worker started with ' + str(len(self.slots)) + ' slots.')
+
+        while True:
+            self.enforce_limits()
+            self.reap()
+            self.report_backups()
+            if self.finished:
+                self.sync()
+            elif self.output_due():
+                self.report_outputs()
+            elif self.collect_poll() and self.free_slots() > 0:
+                # 刚刚取到一个作业，可能还有更多的作业在等待，直接取满空闲的位置
+                self.sync()
+
+            if self.stopping:
+                if self.poll is not None:
+                    # 任何新的请求都会结束服务端的等待
+                    self.proxy.pipeline().show_stats()
+                    self.poll.result()
+                    self.collect_poll()
+                    continue
+                if self.running_slots() == 0 and not self.finished and not self.kills:
+                    break
+            elif self.free_slots() > 0 and self.poll is None:
+                m_Info = dict(self.worker_info, p_wait_timeout=self.wait_timeout)
+                self.poll = self.proxy.pipeline().get_todo_job(**m_Info)
+                continue
+
+            m_Handles = [m_Running[1].sentinel for m_Running in self.slots if m_Running is not None]
+            if self.poll is not None and not self.poll.done():
+                m_Handles.append(self.connection)
+            # 定时醒来检查是否收到了停止的信号
+            m_Ready = wait(m_Handles, timeout=1)
+            if self.connection in m_Ready:
+                self.proxy.receive()
+
+        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Waiting for backups ....')
+        self.backup.close()
+        self.report_backups()
+        print(strftime("%Y-%m-%d %H:%M:%S:  ", localtime()) + 'Worker stopped.')
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+
+# Linux上创建reflink（写时复制的文件副本）的ioctl
+FICLONE = 0x40049409
+
+# 每次读写的大小
+CHUNK_SIZE = 1024 * 1024
+
+
+# 递归列出一个目录下的所有文件和子目录
+#   返回({相对路径: os.stat_result}, [子目录的相对路径])，p_skip中的名字只在顶层目录中忽略
+def scan_tree(p_root, p_skip=()):
+    m_Files = {}
+    m_Dirs = []
+    m_Stack = ['']
+    while m_Stack:
+        m_RelDir = m_Stack.pop()
+        with os.scandir(os.path.join(p_root, m_RelDir)) as it:
+            for m_Entry in it:
+                if m_RelDir == '' and m_Entry.name in p_skip:
+                    continue
+                m_RelPath = os.path.join(m_RelDir, m_Entry.name)
+                if m_Entry.is_dir():
+                    m_Dirs.append(m_RelPath)
+                    m_Stack.append(m_RelPath)
+                else:
+                    m_Files[m_RelPath] = m_Entry.stat()
+    return m_Files, m_Dirs
+
+
+# 计算文件内容的摘要
+def file_digest(p_path):
+    m_Hash = hashlib.blake2b(digest_size=16)
+    with open(p_path, 'rb') as f:
+        while True:
+            m_Buf = f.read(CHUNK_SIZE)
+            if not m_Buf:
+                break
+            m_Hash.update(m_Buf)
+    return m_Hash.hexdigest()
+
+
+# 创建一个reflink，文件系统不支持时返回False
+def reflink_file(p_src, p_dst):
+    import fcntl
+    with open(p_src, 'rb') as fsrc, open(p_dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                return False
+            raise
+    shutil.copystat(p_src, p_dst)
+    return True
+
+
+# 作业的工作目录
+#   每次运行作业前，用sync把工作目录同步成测试程序目录的内容，而不是清空以后重新复制
+#   工作目录下的清单文件记录了上次同步时每个文件的状态：
+#     [源文件大小, 源文件修改时间, 源文件摘要, 工作目录中文件大小, 工作目录中文件修改时间]
+#   源文件和工作目录中的文件都没有变化的，不需要再复制
+#   源文件只是修改时间变了，内容的摘要没有变化的，也不需要再复制
+#     摘要只在这个时候才计算，上次同步的内容用工作目录中没有变化的文件来计算，复制文件时不需要计算摘要
+#   工作目录中不在清单里的文件（例如上一个作业的输出）会被删除
+#   作业结束以后用stage把需要备份的内容移到暂存目录中，工作目录马上就可以给下一个作业使用
+#   p_mode
+#     copy      复制文件
+#     hardlink  建立硬链接，速度最快，但是测试程序修改这些文件时会同时修改测试程序目录中的文件
+#     reflink   建立写时复制的副本（btrfs、xfs等），文件系统不支持时自动改为复制
+class Workspace(object):
+    MANIFEST = '.farm_workspace'
+    MODES = ('copy', 'hardlink', 'reflink')
+    # 备份前的暂存目录，同步时不会删除
+    STAGING = '.farm_backup'
+    SKIP = (MANIFEST, MANIFEST + '.tmp', STAGING)
+
+    def __init__(self, p_work_directory, p_mode='copy'):
+        if p_mode not in self.MODES:
+            raise ValueError('Unknown workspace mode [' + str(p_mode) + ']')
+        self.work_directory = p_work_directory
+        self.mode = p_mode
+        self.manifest_file = os.path.join(p_work_directory, self.MANIFEST)
+        # 文件系统不支持reflink时，后面的文件直接复制
+        self._reflink = p_mode == 'reflink'
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # 读取上次同步时的清单，源目录或者同步方式变了，以前的记录就不能再用了
+    def load_manifest(self, p_source_directory):
+        m_Manifest = self.read_manifest()
+        if m_Manifest.get('Source') != os.path.abspath(p_source_directory) or m_Manifest.get('Mode') != self.mode:
+            return {}
+        return m_Manifest.get('Files', {})
+
+    def save_manifest(self, p_source_directory, p_files):
+        m_TempFile = self.manifest_file + '.tmp'
+        with open(m_TempFile, 'w') as f:
+            json.dump({'Source': os.path.abspath(p_source_directory), 'Mode': self.mode, 'Files': p_files}, f)
+        os.replace(m_TempFile, self.manifest_file)
+
+    # 删除工作目录中的一个文件或者目录
+    @staticmethod
+    def _remove(p_path):
+        if os.path.isdir(p_path) and not os.path.islink(p_path):
+            shutil.rmtree(p_path)
+        else:
+            os.remove(p_path)
+
+    # 把一个源文件放到工作目录中
+    def _place(self, p_src, p_dst):
+        if os.path.lexists(p_dst):
+            self._remove(p_dst)
+        if self.mode == 'hardlink':
+            try:
+                os.link(p_src, p_dst)
+                return
+            except OSError:
+                # 不在同一个文件系统上
+                pass
+        elif self._reflink:
+            if reflink_file(p_src, p_dst):
+                return
+            self._reflink = False
+        shutil.copy2(p_src, p_dst)
+
+    # 把工作目录同步为p_source_directory的内容，返回这次同步的统计信息
+    def sync(self, p_source_directory):
+        m_Stats = {'Copied': 0, 'Unchanged': 0, 'Removed': 0, 'Bytes': 0}
+        if not os.path.exists(self.work_directory):
+            os.makedirs(self.work_directory)
+        m_Records = self.load_manifest(p_source_directory)
+        m_SourceFiles, m_SourceDirs = scan_tree(p_source_directory)
+        m_WorkFiles, m_WorkDirs = scan_tree(self.work_directory, self.SKIP)
+
+        # 删除不在清单中的文件和目录，类型不一致的也删除
+        m_SourceDirSet = set(m_SourceDirs)
+        for m_RelPath in sorted(m_WorkDirs):
+            if m_RelPath not in m_SourceDirSet and os.path.isdir(os.path.join(self.work_directory, m_RelPath)):
+                shutil.rmtree(os.path.join(self.work_directory, m_RelPath))
+                m_Stats['Removed'] = m_Stats['Removed'] + 1
+        for m_RelPath in m_WorkFiles:
+            if m_RelPath not in m_SourceFiles and os.path.lexists(os.path.join(self.work_directory, m_RelPath)):
+                os.remove(os.path.join(self.work_directory, m_RelPath))
+                m_Stats['Removed'] = m_Stats['Removed'] + 1
+        for m_RelPath in sorted(m_SourceDirs):
+            m_Path = os.path.join(self.work_directory, m_RelPath)
+            if os.path.lexists(m_Path) and not os.path.isdir(m_Path):
+                os.remove(m_Path)
+            if not os.path.exists(m_Path):
+                os.mkdir(m_Path)
+
+        # 只复制发生了变化的文件
+        m_NewRecords = {}
+        for m_RelPath, m_SourceStat in m_SourceFiles.items():
+            m_Src = os.path.join(p_source_directory, m_RelPath)
+            m_Dst = os.path.join(self.work_directory, m_RelPath)
+            m_Record = m_Records.get(m_RelPath)
+            m_WorkStat = m_WorkFiles.get(m_RelPath)
+            m_Digest = None
+            if m_Record is not None and m_WorkStat is not None and stat.S_ISREG(m_WorkStat.st_mode) and \
+                    [m_WorkStat.st_size, m_WorkStat.st_mtime_ns] == m_Record[3:5]:
+                # 工作目录中的文件还是上次同步时的样子
+                if [m_SourceStat.st_size, m_SourceStat.st_mtime_ns] == m_Record[0:2]:
+                    m_NewRecords[m_RelPath] = m_Record
+                    m_Stats['Unchanged'] = m_Stats['Unchanged'] + 1
+                    continue
+                if m_SourceStat.st_size == m_Record[0]:
+                    # 源文件只是修改时间变了，比较一下内容
+                    m_OldDigest = m_Record[2] or file_digest(m_Dst)
+                    m_Digest = file_digest(m_Src)
+                    if m_Digest == m_OldDigest:
+                        m_NewRecords[m_RelPath] = [m_SourceStat.st_size, m_SourceStat.st_mtime_ns, m_Digest] + \
+                                                  m_Record[3:5]
+                        m_Stats['Unchanged'] = m_Stats['Unchanged'] + 1
+                        continue
+
+            self._place(m_Src, m_Dst)
+            m_WorkStat = os.stat(m_Dst)
+            m_NewRecords[m_RelPath] = [m_SourceStat.st_size, m_SourceStat.st_mtime_ns, m_Digest,
+                                       m_WorkStat.st_size, m_WorkStat.st_mtime_ns]
+            m_Stats['Copied'] = m_Stats['Copied'] + 1
+            m_Stats['Bytes'] = m_Stats['Bytes'] + m_SourceStat.st_size
+
+        self.save_manifest(p_source_directory, m_NewRecords)
+        return m_Stats
+
+    def staging_directory(self, p_name):
+        return os.path.join(self.work_directory, self.STAGING, str(p_name))
+
+    # 把作业留下的内容移到暂存目录p_name中，返回暂存目录
+    #   作业新产生的或者修改过的文件移到暂存目录中，下次同步时会重新复制
+    #   和源文件一样的文件留在工作目录中，只在索引文件（暂存目录.json）中记录源文件的状态：
+    #     {相对路径: [源文件, 源文件大小, 源文件修改时间, 源文件摘要]}
+    #   备份时按照内容保存一份，多个作业之间共用
+    def stage(self, p_name):
+        m_Manifest = self.read_manifest()
+        m_Records = m_Manifest.get('Files', {})
+        m_Staging = self.staging_directory(p_name)
+        if os.path.exists(m_Staging):
+            shutil.rmtree(m_Staging)
+        os.makedirs(m_Staging)
+        m_WorkFiles, m_WorkDirs = scan_tree(self.work_directory, self.SKIP)
+        for m_RelPath in m_WorkDirs:
+            os.makedirs(os.path.join(m_Staging, m_RelPath), exist_ok=True)
+        m_Shared = {}
+        for m_RelPath, m_WorkStat in m_WorkFiles.items():
+            m_Record = m_Records.get(m_RelPath)
+            if m_Record is not None and stat.S_ISREG(m_WorkStat.st_mode) and \
+                    [m_WorkStat.st_size, m_WorkStat.st_mtime_ns] == m_Record[3:5]:
+                m_Shared[m_RelPath] = [os.path.join(m_Manifest['Source'], m_RelPath)] + m_Record[0:3]
+            else:
+                os.rename(os.path.join(self.work_directory, m_RelPath), os.path.join(m_Staging, m_RelPath))
+        # 索引文件最后写入，有索引文件的暂存目录才是完整的
+        with open(m_Staging + '.tmp', 'w') as f:
+            json.dump(m_Shared, f)
+        os.replace(m_Staging + '.tmp', m_Staging + '.json')
+        return m_Staging
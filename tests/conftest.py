@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# 测试用到的公共夹具
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from farm.main import FarmHandler  # noqa: E402
+
+
+# 在临时目录下初始化FARM的配置数据库，返回连接好的FarmHandler
+@pytest.fixture
+def handler(tmp_path):
+    m_handler = FarmHandler()
+    m_handler.set_home(str(tmp_path))
+    m_handler.init_config_db()
+    m_handler.connect_config_db()
+    yield m_handler
+    m_handler.disconnect_config_db()
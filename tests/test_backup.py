@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# 作业日志的备份：压缩保存作业的输出，测试程序文件按照内容只保存一份
+import os
+
+from farm.backup import BackupStore, BackupWriter
+from farm.workspace import Workspace, scan_tree
+
+
+def write(p_path, p_text):
+    os.makedirs(os.path.dirname(str(p_path)), exist_ok=True)
+    with open(str(p_path), 'w') as f:
+        f.write(p_text)
+
+
+def read_tree(p_root):
+    m_Files, m_Dirs = scan_tree(str(p_root))
+    m_Contents = {}
+    for m_RelPath in m_Files:
+        with open(os.path.join(str(p_root), m_RelPath)) as f:
+            m_Contents[m_RelPath] = f.read()
+    return m_Contents
+
+
+def objects(p_backup):
+    return sorted(scan_tree(os.path.join(str(p_backup), 'objects'))[0])
+
+
+# 同步测试程序、写入作业的输出以后暂存，返回暂存目录
+def run_fake_job(p_tmp_path, p_job_id, p_output):
+    m_Workspace = Workspace(str(p_tmp_path / 'work'))
+    m_Workspace.sync(str(p_tmp_path / 'src'))
+    write(p_tmp_path / 'work' / 'output.xml', p_output)
+    write(p_tmp_path / 'work' / 'logs' / 'debug.log', 'debug ' + p_output)
+    return m_Workspace.stage(p_job_id)
+
+
+def make_source(p_tmp_path):
+    write(p_tmp_path / 'src' / 'main.robot', 'main')
+    write(p_tmp_path / 'src' / 'lib' / 'keywords.robot', 'keywords')
+
+
+# 恢复出来的内容和作业结束时的工作目录一样，暂存目录在备份以后删除
+def test_write_restore_round_trip(tmp_path):
+    make_source(tmp_path)
+    m_Staging = run_fake_job(tmp_path, 1, '<robot/>')
+    m_Store = BackupStore(str(tmp_path / 'backup'))
+    m_Stats = m_Store.write(1, m_Staging)
+    assert (m_Stats['Files'], m_Stats['Shared'], m_Stats['Lost']) == (2, 2, 0)
+    assert m_Stats['Bytes'] == os.path.getsize(m_Store.archive_path(1))
+    assert not os.path.exists(m_Staging) and not os.path.exists(m_Staging + '.json')
+    m_Store.restore(1, str(tmp_path / 'restored'))
+    assert read_tree(tmp_path / 'restored') == {
+        'main.robot': 'main',
+        os.path.join('lib', 'keywords.robot'): 'keywords',
+        'output.xml': '<robot/>',
+        os.path.join('logs', 'debug.log'): 'debug <robot/>'}
+
+
+# 多个作业使用的同样的测试程序文件只保存一份
+def test_shared_files_deduplicated(tmp_path):
+    make_source(tmp_path)
+    m_Store = BackupStore(str(tmp_path / 'backup'))
+    m_Store.write(1, run_fake_job(tmp_path, 1, 'first'))
+    m_Objects = objects(tmp_path / 'backup')
+    assert len(m_Objects) == 2
+    # 另外一个进程中的BackupStore也使用已经保存的文件
+    BackupStore(str(tmp_path / 'backup')).write(2, run_fake_job(tmp_path, 2, 'second'))
+    assert objects(tmp_path / 'backup') == m_Objects
+    m_Store.restore(2, str(tmp_path / 'restored'))
+    assert read_tree(tmp_path / 'restored')['main.robot'] == 'main'
+    assert read_tree(tmp_path / 'restored')['output.xml'] == 'second'
+    # 内容变了的测试程序文件另外保存
+    write(tmp_path / 'src' / 'main.robot', 'main v2')
+    m_Store.write(3, run_fake_job(tmp_path, 3, 'third'))
+    assert len(objects(tmp_path / 'backup')) == 3
+
+
+# 作业结束以后源文件被修改过的，不能再按照内容保存，记录为丢失
+def test_source_changed_after_job(tmp_path):
+    make_source(tmp_path)
+    m_Staging = run_fake_job(tmp_path, 1, '<robot/>')
+    write(tmp_path / 'src' / 'main.robot', 'main v2')
+    m_Store = BackupStore(str(tmp_path / 'backup'))
+    m_Stats = m_Store.write(1, m_Staging)
+    assert (m_Stats['Shared'], m_Stats['Lost']) == (1, 1)
+    m_Store.restore(1, str(tmp_path / 'restored'))
+    assert 'main.robot' not in read_tree(tmp_path / 'restored')
+
+
+# 后台线程按照提交的顺序备份，结果放在done中
+def test_backup_writer(tmp_path):
+    make_source(tmp_path)
+    m_Writer = BackupWriter(BackupStore(str(tmp_path / 'backup')))
+    m_Writer.start()
+    m_Writer.submit(1, run_fake_job(tmp_path, 1, 'first'))
+    m_Writer.submit(2, str(tmp_path / 'missing'))
+    m_Writer.close()
+    assert [m_Done[0] for m_Done in m_Writer.done] == [1, 2]
+    assert m_Writer.done[0][1]['Files'] == 2 and m_Writer.done[0][2] is None
+    assert m_Writer.done[1][1] is None and 'FileNotFoundError' in m_Writer.done[1][2]
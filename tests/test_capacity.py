@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# 资源标签的容量按照计数信号量管理，运行中的作业不会超过容量
+import pytest
+
+from farm.main import FarmHandler
+
+WORKER = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='host',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def claim_ids(p_handler, p_max_jobs=10):
+    m_Result = p_handler.claim_jobs(p_max_jobs=p_max_jobs, **WORKER)
+    assert m_Result['Result'], m_Result
+    return [dict(zip(m_Result['Columns'], m_Row))['ID'] for m_Row in m_Result['Rows']]
+
+
+def submit(p_handler, p_capacity, p_count):
+    assert p_handler.create_label('L1', 'A=1', p_capacity)['Result']
+    for i in range(p_count):
+        assert p_handler.add_regress('r%d' % i, 'main.robot', 3600, 'RF')['Result']
+        assert p_handler.submit_job('L1', 'r%d' % i, 'alice', '')['Result']
+
+
+def label_used(p_handler):
+    m_State = p_handler.scheduler.labels['L1']
+    return m_State.used, m_State.capacity
+
+
+# 容量用满以后不再派发，作业完成释放容量以后继续派发
+def test_capacity_limits_dispatch(handler):
+    submit(handler, 2, 3)
+    m_JobIDs = claim_ids(handler)
+    assert len(m_JobIDs) == 2
+    assert claim_ids(handler) == []
+    assert label_used(handler) == (2, 2)
+    assert handler.finish_job(m_JobIDs[0], 'COMPLETED', '')['Result']
+    assert len(claim_ids(handler)) == 1
+    assert label_used(handler) == (2, 2)
+
+
+# 内存中的占用情况在检查点写回FARM_LABEL，服务端重启以后从运行中的作业重建
+def test_checkpoint_labels(handler):
+    submit(handler, 2, 3)
+    claim_ids(handler)
+    handler.checkpoint_labels()
+    m_Row = handler.db.reader().query_one("SELECT CURRENT_USED FROM FARM_LABEL WHERE NAME = 'L1'")
+    assert m_Row[0] == 2
+    # 服务端重启
+    m_handler = FarmHandler()
+    m_handler.set_home(handler.HomeDirectory)
+    m_handler.connect_config_db()
+    try:
+        assert label_used(m_handler) == (2, 2)
+        assert claim_ids(m_handler) == []
+    finally:
+        m_handler.disconnect_config_db()
+
+
+# 批量调用回滚时，finish_job还没有释放的容量不会被其他请求占用，也不会重复占用
+def test_rollback_finish_keeps_capacity(handler):
+    submit(handler, 1, 2)
+    m_JobID, = claim_ids(handler)
+    with pytest.raises(RuntimeError):
+        with handler.batch_transaction():
+            assert handler.finish_job(m_JobID, 'COMPLETED', '')['Result']
+            # 事务提交之前容量还被完成的作业占用
+            assert not handler.get_todo_job(**WORKER)['Result']
+            assert handler.scheduler.claim() is None
+            raise RuntimeError('rollback')
+    assert label_used(handler) == (1, 1)
+    m_Status = handler.db.reader().query_one("SELECT STATUS FROM FARM_JOBS WHERE ID = ?", (m_JobID, ))
+    assert m_Status[0] == 'WORKING'
+    with handler.batch_transaction():
+        assert handler.finish_job(m_JobID, 'COMPLETED', '')['Result']
+    assert label_used(handler) == (0, 1)
+    assert len(claim_ids(handler)) == 1
+    assert label_used(handler) == (1, 1)
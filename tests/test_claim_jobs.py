@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# 一次调用派发最多N个作业，不超过资源标签的容量
+import pytest
+
+WORKER = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='host',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def claim(p_handler, p_max_jobs, p_labels=None):
+    m_Result = p_handler.claim_jobs(p_labels=p_labels, p_max_jobs=p_max_jobs, **WORKER)
+    assert m_Result['Result'], m_Result
+    return [dict(zip(m_Result['Columns'], m_Row)) for m_Row in m_Result['Rows']]
+
+
+def submit(p_handler, p_label_name, p_capacity, p_count):
+    assert p_handler.create_label(p_label_name, 'NAME=' + p_label_name, p_capacity)['Result']
+    assert p_handler.add_regress('r_' + p_label_name, 'main.robot', 3600, 'RF')['Result']
+    for i in range(p_count):
+        assert p_handler.submit_job(p_label_name, 'r_' + p_label_name, 'alice', '')['Result']
+
+
+# 最多派发N个作业，不够N个时有多少派发多少
+def test_claim_up_to_n(handler):
+    submit(handler, 'L1', 10, 5)
+    m_Jobs = claim(handler, 3)
+    assert len(m_Jobs) == 3
+    assert [m_Job['LABEL_NAME'] for m_Job in m_Jobs] == ['L1'] * 3
+    assert m_Jobs[0]['PROPERTIES'] == 'NAME=L1' and int(m_Jobs[0]['LIMIT_TIME']) == 3600
+    assert len(claim(handler, 10)) == 2
+    assert claim(handler, 10) == []
+    assert handler.db.reader().query_one("SELECT COUNT(*) FROM FARM_JOBS WHERE STATUS = 'WORKING'") == (5, )
+
+
+# 每个资源标签派发的作业不超过它的容量，p_labels限制派发的资源标签
+def test_claim_respects_capacity(handler):
+    submit(handler, 'L1', 2, 3)
+    submit(handler, 'L2', 1, 3)
+    assert [m_Job['LABEL_NAME'] for m_Job in claim(handler, 10, ['L2'])] == ['L2']
+    assert sorted(m_Job['LABEL_NAME'] for m_Job in claim(handler, 10)) == ['L1', 'L1']
+    assert claim(handler, 10) == []
+    assert handler.scheduler.labels['L1'].used == 2 and handler.scheduler.labels['L2'].used == 1
+
+
+# 作业数超过一次查询的IN列表长度时分批读取
+def test_claim_many_jobs(handler):
+    m_Count = handler.CLAIM_QUERY_SIZES[-2] + 6
+    submit(handler, 'L1', m_Count, m_Count)
+    m_Jobs = claim(handler, m_Count + 1)
+    assert len(m_Jobs) == m_Count
+    assert len(set(m_Job['ID'] for m_Job in m_Jobs)) == m_Count
+
+
+# 批量调用回滚时派发的作业全部放回队列，释放占用的容量
+def test_claim_rollback(handler):
+    submit(handler, 'L1', 2, 3)
+    with pytest.raises(RuntimeError):
+        with handler.batch_transaction():
+            assert len(claim(handler, 10)) == 2
+            raise RuntimeError('rollback')
+    assert handler.scheduler.labels['L1'].used == 0
+    assert handler.db.reader().query_one("SELECT COUNT(*) FROM FARM_JOBS WHERE STATUS = 'NEW'") == (3, )
+    assert len(claim(handler, 10)) == 2
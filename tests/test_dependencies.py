@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# 套件中有依赖关系的作业在前置作业完成以后才派发
+WORKER = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='host',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def claim_names(p_handler):
+    m_Result = p_handler.claim_jobs(p_max_jobs=10, **WORKER)
+    assert m_Result['Result'], m_Result
+    return dict((m_Job['REGRESS_NAME'], m_Job['ID'])
+                for m_Job in (dict(zip(m_Result['Columns'], m_Row)) for m_Row in m_Result['Rows']))
+
+
+def create_suite(p_handler, p_suite_name, p_regress_names):
+    for m_Name in p_regress_names:
+        assert p_handler.add_regress(m_Name, 'main.robot', 3600, 'RF')['Result']
+    with p_handler.db.transaction() as m_conn:
+        m_conn.executemany("INSERT INTO FARM_SUITE_REGRESS(SUITE_NAME, REGRESS_NAME) VALUES(?, ?)",
+                           [(p_suite_name, m_Name) for m_Name in p_regress_names])
+
+
+# setup -> (a, b) -> cleanup：每个作业在它的前置作业全部完成时才能派发，前置作业失败也算完成
+def test_release_after_prerequisites(handler):
+    assert handler.create_label('L1', 'A=1', 10)['Result']
+    create_suite(handler, 's', ['setup', 'a', 'b', 'cleanup'])
+    for m_Name, m_DependsOn in (('a', 'setup'), ('b', 'setup'), ('cleanup', 'a'), ('cleanup', 'b')):
+        assert handler.add_suite_dependency('s', m_Name, m_DependsOn)['Result']
+    assert not handler.add_suite_dependency('s', 'setup', 'cleanup')['Result']
+    assert handler.submit_job('L1', 's', 'alice', '')['Result']
+
+    m_Jobs = claim_names(handler)
+    assert list(m_Jobs) == ['setup']
+    assert handler.finish_job(m_Jobs['setup'], 'COMPLETED', '')['Result']
+    m_Jobs = claim_names(handler)
+    assert sorted(m_Jobs) == ['a', 'b']
+    assert handler.finish_job(m_Jobs['a'], 'COMPLETED', '')['Result']
+    assert claim_names(handler) == {}
+    assert handler.finish_job(m_Jobs['b'], 'ERROR', '')['Result']
+    assert list(claim_names(handler)) == ['cleanup']
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# 从内存中的等待队列派发作业
+WORKER = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='host',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def claim_names(p_handler, p_max_jobs=10):
+    m_Result = p_handler.claim_jobs(p_max_jobs=p_max_jobs, **WORKER)
+    assert m_Result['Result'], m_Result
+    return [dict(zip(m_Result['Columns'], m_Row))['REGRESS_NAME'] for m_Row in m_Result['Rows']]
+
+
+# 作业按照提交的顺序派发，派发以后标记为WORKING
+def test_dispatch_in_order(handler):
+    assert handler.create_label('L1', 'A=1', 10)['Result']
+    for m_Name in ('r1', 'r2'):
+        assert handler.add_regress(m_Name, 'main.robot', 3600, 'RF')['Result']
+        assert handler.submit_job('L1', m_Name, 'alice', '')['Result']
+    m_Job = handler.get_todo_job(**WORKER)
+    assert m_Job['Result'] and m_Job['REGRESS_NAME'] == 'r1' and m_Job['PROPERTIES'] == 'A=1'
+    assert claim_names(handler) == ['r2']
+    assert not handler.get_todo_job(**WORKER)['Result']
+    m_Rows = handler.db.reader().query_all("SELECT STATUS, WORKER_MACHINE_NAME FROM FARM_JOBS ORDER BY ID")
+    assert m_Rows == [('WORKING', 'host'), ('WORKING', 'host')]
+
+
+# 回归测试已经不存在的作业标记为ERROR并计入任务，不占用资源容量
+def test_missing_regress_fails_job(handler):
+    assert handler.create_label('L1', 'A=1', 1)['Result']
+    for m_Name in ('r1', 'r2'):
+        assert handler.add_regress(m_Name, 'main.robot', 3600, 'RF')['Result']
+        assert handler.submit_job('L1', m_Name, 'alice', '')['Result']
+    with handler.db.transaction() as m_conn:
+        m_conn.execute("DELETE FROM FARM_REGRESS WHERE NAME = 'r1'")
+    assert claim_names(handler) == []
+    assert handler.scheduler.labels['L1'].used == 0
+    assert claim_names(handler) == ['r2']
+    m_conn = handler.db.reader()
+    assert m_conn.query_all("SELECT REGRESS_NAME, STATUS, NOTES FROM FARM_JOBS WHERE STATUS = 'ERROR'") == \
+        [('r1', 'ERROR', 'Regress or label not exist.')]
+    assert m_conn.query_one("SELECT SUM(COMPLETED_JOBS), SUM(FAILED_JOBS) FROM FARM_TASKS") == (1, 1)
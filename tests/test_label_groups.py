@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# 提交到资源标签组的作业在派发时绑定到组中空闲容量最多的资源标签
+from farm.scheduler import Scheduler
+
+WORKER = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='host',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def claim_labels(p_handler, p_max_jobs=10):
+    m_Result = p_handler.claim_jobs(p_max_jobs=p_max_jobs, **WORKER)
+    assert m_Result['Result'], m_Result
+    m_Jobs = [dict(zip(m_Result['Columns'], m_Row)) for m_Row in m_Result['Rows']]
+    return [(m_Job['ID'], m_Job['LABEL_NAME']) for m_Job in m_Jobs]
+
+
+def setup_group(p_handler, p_capacities):
+    assert p_handler.create_label_group('G')['Result']
+    assert p_handler.add_regress('r1', 'main.robot', 3600, 'RF')['Result']
+    for m_LabelName, m_Capacity in sorted(p_capacities.items()):
+        assert p_handler.create_label(m_LabelName, 'NAME=' + m_LabelName, m_Capacity)['Result']
+        assert p_handler.update_label_group('G', m_LabelName)['Result']
+
+
+def used(p_handler, p_label_name):
+    return p_handler.scheduler.labels[p_label_name].used
+
+
+# 每个作业绑定到当时空闲容量最多的资源标签，绑定的资源标签记录在作业中
+def test_group_binds_least_loaded(handler):
+    setup_group(handler, {'L1': 2, 'L2': 4})
+    for i in range(5):
+        assert handler.submit_job('G', 'r1', 'alice', '')['Result']
+    m_Claimed = claim_labels(handler)
+    # 空闲容量相同时按照资源标签的名字
+    assert [m_LabelName for m_JobID, m_LabelName in m_Claimed] == ['L2', 'L2', 'L1', 'L2', 'L1']
+    assert (used(handler, 'L1'), used(handler, 'L2')) == (2, 3)
+    m_Rows = handler.db.reader().query_all("SELECT ID, LABEL_NAME FROM FARM_JOBS ORDER BY ID")
+    assert sorted(m_Rows) == sorted((int(m_JobID), m_LabelName) for m_JobID, m_LabelName in m_Claimed)
+
+
+# 资源标签被直接提交的作业占满时，组中的作业绑定到其他资源标签；完成时释放绑定的资源标签的容量
+def test_group_skips_busy_label(handler):
+    setup_group(handler, {'L1': 2, 'L2': 1})
+    assert handler.submit_job('L1', 'r1', 'bob', '')['Result']
+    assert handler.submit_job('L1', 'r1', 'bob', '')['Result']
+    assert [m_LabelName for m_JobID, m_LabelName in claim_labels(handler)] == ['L1', 'L1']
+    assert handler.submit_job('G', 'r1', 'alice', '')['Result']
+    assert handler.submit_job('G', 'r1', 'alice', '')['Result']
+    m_Claimed = claim_labels(handler)
+    assert [m_LabelName for m_JobID, m_LabelName in m_Claimed] == ['L2']
+    assert handler.finish_job(m_Claimed[0][0], 'COMPLETED', '')['Result']
+    assert used(handler, 'L2') == 0
+    assert [m_LabelName for m_JobID, m_LabelName in claim_labels(handler)] == ['L2']
+
+
+# 空闲容量相同时绑定到最近运行时间之比最小（最快）的资源标签
+def test_group_prefers_faster_label():
+    m_Scheduler = Scheduler()
+    m_Scheduler.define_label_group('G')
+    for m_LabelName in ('L1', 'L2'):
+        m_Scheduler.define_label(m_LabelName, 1)
+        m_Scheduler.add_group_label('G', m_LabelName)
+    m_Scheduler.record_latency('L1', 20.0, 10.0)
+    m_Scheduler.record_latency('L2', 5.0, 10.0)
+    m_Scheduler.push('G', [1, 2], 0, 'alice', 1)
+    assert m_Scheduler.claim_many(None, 2) == [('G', 'L2', 1), ('G', 'L1', 2)]
+
+
+# 从组中去掉的资源标签不再绑定组中的作业
+def test_group_removed_label(handler):
+    setup_group(handler, {'L1': 4, 'L2': 1})
+    assert handler.update_label_group('G', 'L1', False)['Result']
+    for i in range(2):
+        assert handler.submit_job('G', 'r1', 'alice', '')['Result']
+    assert [m_LabelName for m_JobID, m_LabelName in claim_labels(handler)] == ['L2']
+    assert used(handler, 'L1') == 0
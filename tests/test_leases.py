@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# 租约到期的作业被回收，重新派发以后原来的Worker不能再结束它
+WORKER_A = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='hostA',
+                p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+WORKER_B = dict(WORKER_A, p_os_pid='2', p_machine_name='hostB')
+
+
+def claim_one(p_handler, p_worker):
+    m_Result = p_handler.claim_jobs(**p_worker)
+    assert m_Result['Result'], m_Result
+    return [dict(zip(m_Result['Columns'], m_Row))['ID'] for m_Row in m_Result['Rows']]
+
+
+def submit_one(p_handler):
+    assert p_handler.create_label('L1', 'A=1', 1)['Result']
+    assert p_handler.add_regress('r1', 'main.robot', 3600, 'RF')['Result']
+    assert p_handler.submit_job('L1', 'r1', 'alice', '')['Result']
+
+
+# 回收的作业回到队列中，另一个Worker可以取到它
+def test_reclaim_requeues(handler):
+    submit_one(handler)
+    m_JobID, = claim_one(handler, WORKER_A)
+    assert claim_one(handler, WORKER_B) == []
+    assert handler.reclaim_job(m_JobID) == {'Result': True, 'Status': 'NEW'}
+    assert claim_one(handler, WORKER_B) == [m_JobID]
+
+
+# 超过MAX_RECLAIMS次或者到达最终期限的作业标记为ERROR
+def test_reclaim_deadline_passed(handler):
+    submit_one(handler)
+    m_JobID, = claim_one(handler, WORKER_A)
+    assert handler.reclaim_job(m_JobID, True) == {'Result': True, 'Status': 'ERROR'}
+    m_Status = handler.db.reader().query_one("SELECT STATUS FROM FARM_JOBS WHERE ID = ?", (m_JobID, ))
+    assert m_Status[0] == 'ERROR'
+    assert handler.leases.count() == 0
+
+
+# 作业被回收、派发给hostB以后，hostA迟到的finish_job被拒绝，不影响hostB的租约
+def test_stale_finish_rejected(handler):
+    submit_one(handler)
+    m_JobID, = claim_one(handler, WORKER_A)
+    assert handler.reclaim_job(m_JobID)['Result']
+    assert claim_one(handler, WORKER_B) == [m_JobID]
+    m_Result = handler.finish_job(m_JobID, 'COMPLETED', '', p_machine_name='hostA', p_os_pid='1')
+    assert not m_Result['Result']
+    assert 'is not running on worker [hostA:1]' in m_Result['Message']
+    assert handler.heartbeat_jobs('hostB', '2', [m_JobID]) == {'Result': True, 'Lost': []}
+    assert handler.heartbeat_jobs('hostA', '1', [m_JobID]) == {'Result': True, 'Lost': [int(m_JobID)]}
+    assert handler.finish_job(m_JobID, 'COMPLETED', '', p_machine_name='hostB', p_os_pid='2')['Result']
+    assert handler.leases.count() == 0
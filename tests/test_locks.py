@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# 读写锁：共享锁可以重入，等待中的排它锁优先于新的共享锁
+import threading
+import time
+
+import pytest
+
+from farm.locks import ReadWriteLock
+
+
+def start(p_target):
+    m_Thread = threading.Thread(target=p_target, daemon=True)
+    m_Thread.start()
+    return m_Thread
+
+
+def wait_writers(p_lock, p_count=1):
+    m_Deadline = time.monotonic() + 5
+    while p_lock._writers_waiting < p_count and time.monotonic() < m_Deadline:
+        time.sleep(0.01)
+    assert p_lock._writers_waiting == p_count
+
+
+# 已经持有共享锁的线程可以再获得共享锁，即使有线程在等待排它锁（批量调用中的每个调用）
+def test_shared_reentrant_with_waiting_writer():
+    m_Lock = ReadWriteLock()
+    m_Order = []
+    m_Lock.acquire_shared()
+    m_Writer = start(lambda: (m_Lock.acquire_exclusive(), m_Order.append('writer'), m_Lock.release_exclusive()))
+    wait_writers(m_Lock)
+    with m_Lock.shared():
+        assert m_Lock.held_shared()
+        m_Order.append('nested')
+    assert m_Lock.held_shared()
+    m_Lock.release_shared()
+    assert not m_Lock.held_shared()
+    m_Writer.join(5)
+    assert m_Order == ['nested', 'writer']
+
+
+# 有线程在等待排它锁时，新的共享锁请求排在它后面，修改配置的请求不会被源源不断的只读请求饿死
+def test_waiting_writer_blocks_new_readers():
+    m_Lock = ReadWriteLock()
+    m_Order = []
+
+    def write():
+        with m_Lock.exclusive():
+            m_Order.append('writer')
+
+    def read():
+        with m_Lock.shared():
+            m_Order.append('reader')
+    m_Lock.acquire_shared()
+    m_Writer = start(write)
+    wait_writers(m_Lock)
+    m_Reader = start(read)
+    time.sleep(0.1)
+    assert m_Order == []
+    m_Lock.release_shared()
+    m_Writer.join(5)
+    m_Reader.join(5)
+    assert m_Order == ['writer', 'reader']
+
+
+# 持有排它锁的线程可以获得共享锁，持有共享锁的线程不能升级为排它锁
+def test_exclusive_then_shared_no_upgrade():
+    m_Lock = ReadWriteLock()
+    with m_Lock.exclusive():
+        with m_Lock.shared():
+            assert m_Lock.held_shared()
+    with m_Lock.shared():
+        with pytest.raises(RuntimeError):
+            m_Lock.acquire_exclusive()
+    # 锁已经全部释放，其他线程可以获得排它锁
+    m_Writer = start(lambda: m_Lock.acquire_exclusive())
+    m_Writer.join(5)
+    assert not m_Writer.is_alive()
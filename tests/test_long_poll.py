@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# 长轮询：没有可以执行的作业时get_todo_job等待，作业可以执行时马上被唤醒
+import asyncio
+import threading
+import time
+from multiprocessing.connection import Client
+
+from farm.main import RPCHandler, RPCProxy
+from farm.rpcserver import AsyncRPCServer
+
+WORKER = dict(p_worker_user_name='test', p_os_pid='1', p_machine_name='host',
+              p_work_directory='/tmp/work', p_backup_directory='/tmp/backup')
+
+
+def setup_label(p_handler, p_capacity):
+    assert p_handler.create_label('L1', 'A=1', p_capacity)['Result']
+    assert p_handler.add_regress('r1', 'main.robot', 3600, 'RF')['Result']
+
+
+# 在后台线程中等待作业，返回(线程, 结果)
+def wait_job(p_handler, p_wait_timeout=10):
+    m_Result = {}
+
+    def run():
+        m_Result.update(p_handler.get_todo_job(p_labels=['L1'], p_wait_timeout=p_wait_timeout, **WORKER))
+        m_Result['Elapsed'] = time.monotonic() - m_Start
+    m_Start = time.monotonic()
+    m_Thread = threading.Thread(target=run, daemon=True)
+    m_Thread.start()
+    m_Deadline = time.monotonic() + 5
+    while p_handler.scheduler.waiting_count() == 0 and time.monotonic() < m_Deadline:
+        time.sleep(0.01)
+    assert p_handler.scheduler.waiting_count() == 1
+    return m_Thread, m_Result
+
+
+# 等待中提交的作业马上派发给等待的请求
+def test_wait_wakes_on_submit(handler):
+    setup_label(handler, 1)
+    m_Thread, m_Result = wait_job(handler)
+    assert handler.submit_job('L1', 'r1', 'alice', '')['Result']
+    m_Thread.join(5)
+    assert m_Result['Result'] and m_Result['Elapsed'] < 5
+    assert handler.scheduler.waiting_count() == 0
+
+
+# 作业完成释放容量以后，等待的请求马上取到排在后面的作业
+def test_wait_wakes_on_finish(handler):
+    setup_label(handler, 1)
+    assert handler.submit_job('L1', 'r1', 'alice', '')['Result']
+    assert handler.submit_job('L1', 'r1', 'alice', '')['Result']
+    m_First = handler.get_todo_job(**WORKER)
+    assert m_First['Result']
+    m_Thread, m_Result = wait_job(handler)
+    assert handler.finish_job(m_First['ID'], 'COMPLETED', '')['Result']
+    m_Thread.join(5)
+    assert m_Result['Result'] and m_Result['ID'] != m_First['ID']
+
+
+# 一直没有作业时等到超时，不再登记为等待的请求
+def test_wait_timeout(handler):
+    setup_label(handler, 1)
+    m_Thread, m_Result = wait_job(handler, 0.2)
+    m_Thread.join(5)
+    assert not m_Result['Result'] and m_Result['Elapsed'] >= 0.2
+    assert handler.scheduler.waiting_count() == 0
+
+
+# 同一个连接上发来的下一个请求取消正在等待的调用，两个应答按照请求的顺序返回
+def test_next_request_cancels_wait(handler):
+    setup_label(handler, 1)
+    m_RPCHandler = RPCHandler()
+    m_RPCHandler.register_function(handler.show_jobs)
+    m_RPCHandler.register_function(handler.get_todo_job, waiting=True)
+    m_Server = AsyncRPCServer(m_RPCHandler, ('localhost', 0), b'welcome')
+    m_Loop = asyncio.new_event_loop()
+    m_Started = threading.Event()
+    m_Tasks = []
+
+    async def serve():
+        m_Tasks.append(asyncio.ensure_future(m_Server.serve_forever()))
+        while m_Server._server is None:
+            await asyncio.sleep(0.01)
+        m_Started.set()
+        try:
+            await m_Tasks[0]
+        except asyncio.CancelledError:
+            pass
+    m_Thread = threading.Thread(target=lambda: m_Loop.run_until_complete(serve()), daemon=True)
+    m_Thread.start()
+    assert m_Started.wait(5)
+    m_Port = m_Server._server.sockets[0].getsockname()[1]
+    c = Client(('localhost', m_Port), authkey=b'welcome')
+    try:
+        proxy = RPCProxy(c)
+        # 第一个调用协商报文格式
+        assert proxy.show_jobs('alice')['Result']
+        m_Start = time.monotonic()
+        m_Wait = proxy.pipeline().get_todo_job(p_labels=['L1'], p_wait_timeout=30, **WORKER)
+        m_Deadline = time.monotonic() + 5
+        while handler.scheduler.waiting_count() == 0 and time.monotonic() < m_Deadline:
+            time.sleep(0.01)
+        m_Next = proxy.pipeline().show_jobs('alice')
+        assert not m_Wait.result()['Result']
+        assert m_Next.result()['Result']
+        assert time.monotonic() - m_Start < 5
+        assert handler.scheduler.waiting_count() == 0
+    finally:
+        c.close()
+        m_Loop.call_soon_threadsafe(m_Tasks[0].cancel)
+        m_Thread.join(5)
+        m_Loop.close()
+        m_Server.executor.shutdown()
+        m_Server.wait_executor.shutdown()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# 流式汇总output.xml的结果和原来用robot.result读出来的一致，Robot Framework 7.0以前和以后的格式都支持
+import io
+
+import pytest
+
+from farm.outputxml import summarize_output
+
+robot = pytest.importorskip('robot')
+from robot.api import ExecutionResult, ResultVisitor  # noqa: E402
+
+CASES = '''*** Test Cases ***
+Passing
+    Log    hello
+    FOR    ${i}    IN RANGE    2
+        IF    ${i} == 1    Log    one
+    END
+
+Failing
+    Should Be Equal    1    2    values differ
+
+Skipped
+    Skip    not today
+'''
+
+
+# 运行一个有两个子套件的测试，参数为True时用--legacyoutput生成7.0以前格式的output.xml
+@pytest.fixture(params=[False, True], ids=['rf7', 'legacy'])
+def output_xml(request, tmp_path):
+    m_Suite = tmp_path / 'Suite'
+    m_Suite.mkdir()
+    for m_Name in ('first', 'second'):
+        (m_Suite / (m_Name + '.robot')).write_text(CASES)
+    m_Output = str(tmp_path / 'output.xml')
+    robot.run(str(m_Suite), output=m_Output, log='NONE', report='NONE', legacyoutput=request.param,
+              stdout=io.StringIO(), stderr=io.StringIO())
+    with open(m_Output, encoding='utf-8') as f:
+        assert ('starttime=' in f.read()) == request.param
+    return m_Output
+
+
+# 原来的方式：用robot.result读出每个测试的长名字、状态和信息
+class ResultCollector(ResultVisitor):
+    def __init__(self):
+        self.tests = []
+
+    def visit_test(self, test):
+        self.tests.append((test.longname, test.status, test.message))
+
+
+# 测试结果的统计、总用时和每个测试的结果都和robot.result一致
+def test_summary_matches_execution_result(tmp_path, output_xml):
+    m_Tests = []
+    m_Summary = summarize_output(output_xml, str(tmp_path / 'output.csv'), 'suite-test-keyword',
+                                 lambda p_name, p_status, p_elapsed, p_message:
+                                 m_Tests.append((p_name, p_status, p_message)))
+    m_Result = ExecutionResult(output_xml)
+    m_Total = m_Result.statistics.total
+    assert (m_Summary['Tests'], m_Summary['Passed'], m_Summary['Failed'], m_Summary['Skipped']) == \
+        (m_Total.total, m_Total.passed, m_Total.failed, m_Total.skipped) == (6, 2, 2, 2)
+    assert abs(m_Summary['Elapsed'] - m_Result.suite.elapsedtime / 1000.0) < 0.002
+    m_Collector = ResultCollector()
+    m_Result.suite.visit(m_Collector)
+    assert m_Tests == m_Collector.tests
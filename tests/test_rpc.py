@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# RPCProxy和RPCHandler之间的协议协商、批量和流水线调用
+import threading
+from multiprocessing import Pipe
+
+import pytest
+
+from farm.main import RPCHandler, RPCProxy
+
+
+def add(x, y):
+    return x + y
+
+
+# 旧版本的服务端：不认识rpc_negotiate，总是使用旧的报文格式
+class OldRPCHandler(RPCHandler):
+    @staticmethod
+    def negotiate(func_name, args, kwargs):
+        return 1, (func_name, args, kwargs)
+
+
+# 在后台线程中用p_handler处理一个连接，返回客户端的连接
+def serve(p_handler):
+    m_Client, m_Server = Pipe()
+    p_handler.register_function(add)
+    t = threading.Thread(target=p_handler.handle_connection, args=(m_Server, ))
+    t.daemon = True
+    t.start()
+    return m_Client
+
+
+# 第一次调用时协商到新的报文格式，协商请求中的调用正常返回结果
+def test_negotiate_protocol_2():
+    m_Proxy = RPCProxy(serve(RPCHandler()))
+    assert m_Proxy.add(1, 2) == 3
+    assert m_Proxy._protocol == 2
+    assert m_Proxy.add('a', 'b') == 'ab'
+    with pytest.raises(KeyError):
+        m_Proxy.missing()
+
+
+# 旧版本的服务端返回KeyError('rpc_negotiate')，客户端改用旧的格式重新发送
+def test_negotiate_old_server():
+    m_Proxy = RPCProxy(serve(OldRPCHandler()))
+    assert m_Proxy.add(1, 2) == 3
+    assert m_Proxy._protocol == 1
+    assert m_Proxy.add(3, 4) == 7
+
+
+# 指定旧的格式时不协商，新版本的服务端同样可以处理
+def test_old_client():
+    m_Proxy = RPCProxy(serve(RPCHandler()), protocol=1)
+    assert m_Proxy.add(1, 2) == 3
+    assert m_Proxy._protocol == 1
+
+
+# 批量调用中每个调用的结果分别返回，出错的调用在它自己的RPCFuture中抛出异常
+def test_batch_errors_per_call():
+    m_Proxy = RPCProxy(serve(RPCHandler()))
+    m_Batch = m_Proxy.batch()
+    m_Sum = m_Batch.add(1, 2)
+    m_Missing = m_Batch.missing()
+    m_BadArgs = m_Batch.add(1, z=2)
+    m_Last = m_Batch.add(3, 4)
+    m_Batch.send().result()
+    assert m_Sum.result() == 3
+    with pytest.raises(KeyError):
+        m_Missing.result()
+    with pytest.raises(TypeError):
+        m_BadArgs.result()
+    assert m_Last.result() == 7
+
+
+# 整个批量调用失败时（例如服务端不支持rpc_batch），每一个调用都抛出这个异常
+def test_batch_failure_propagates():
+    m_Handler = RPCHandler()
+    del m_Handler._functions['rpc_batch']
+    m_Proxy = RPCProxy(serve(m_Handler))
+    m_Batch = m_Proxy.batch()
+    m_Futures = [m_Batch.add(1, 2), m_Batch.add(3, 4)]
+    with pytest.raises(KeyError):
+        m_Batch.execute()
+    for m_Future in m_Futures:
+        with pytest.raises(KeyError):
+            m_Future.result()
+    assert m_Proxy.add(5, 6) == 11
+
+
+# 流水线调用的应答按照发送的顺序交给对应的RPCFuture
+def test_pipeline_order():
+    m_Proxy = RPCProxy(serve(RPCHandler()), max_pending=2)
+    m_Pipeline = m_Proxy.pipeline()
+    m_Futures = [m_Pipeline.add(i, i) for i in range(10)]
+    assert [m_Future.result() for m_Future in reversed(m_Futures)] == [i * 2 for i in reversed(range(10))]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# 调度器的内存状态：作业队列、资源标签和资源标签组
+from farm.scheduler import DependencyGraph, FairQueue, LeaseTable, Scheduler, critical_path
+
+
+def drain(p_queue):
+    return [p_queue.popleft()[0] for _ in range(len(p_queue))]
+
+
+# 高优先级的作业先派发，即使它最后放入
+def test_fair_queue_priority_first():
+    m_Queue = FairQueue()
+    for m_JobID in range(4):
+        m_Queue.append(m_JobID, (0, 'alice', 1, None, None))
+    m_Queue.append(9, (10, 'carol', 3, None, None))
+    assert drain(m_Queue)[0] == 9
+
+
+# 同一个优先级中用户之间轮流派发，先提交大量作业的用户不会让后来的用户一直等待
+def test_fair_queue_users_interleave():
+    m_Queue = FairQueue()
+    for m_JobID in range(4):
+        m_Queue.append(m_JobID, (0, 'alice', 1, None, None))
+    for m_JobID in (4, 5):
+        m_Queue.append(m_JobID, (0, 'bob', 2, None, None))
+    assert drain(m_Queue) == [0, 4, 1, 5, 2, 3]
+
+
+# 份额按照预计运行时间计算：一个10秒的作业和十个1秒的作业占用相同的份额
+def test_fair_queue_share_by_cost():
+    m_Queue = FairQueue()
+    for m_JobID in range(3):
+        m_Queue.append(m_JobID, (0, 'alice', 1, 10.0, None))
+    for m_JobID in range(10, 30):
+        m_Queue.append(m_JobID, (0, 'bob', 2, 1.0, None))
+    m_Order = drain(m_Queue)
+    assert m_Order[:12] == [0] + list(range(10, 20)) + [1]
+
+
+# 同一个用户的任务之间轮流派发，任务中关键路径长的作业先派发
+def test_fair_queue_tasks_and_ranks():
+    m_Queue = FairQueue()
+    m_Queue.append(1, (0, 'alice', 1, None, 5.0))
+    m_Queue.append(2, (0, 'alice', 1, None, 50.0))
+    m_Queue.append(3, (0, 'alice', 2, None, None))
+    m_Queue.append(4, (0, 'alice', 1, None, 5.0))
+    assert drain(m_Queue) == [2, 3, 1, 4]
+
+
+# 派发失败的作业放回队列的最前面
+def test_fair_queue_appendleft():
+    m_Queue = FairQueue()
+    m_Queue.append(1, (0, 'alice', 1, None, None))
+    m_Queue.append(2, (0, 'alice', 1, None, None))
+    m_JobID, m_Info = m_Queue.popleft()
+    m_Queue.appendleft(m_JobID, m_Info)
+    assert drain(m_Queue) == [1, 2]
+
+
+def group_scheduler(p_capacity):
+    m_Scheduler = Scheduler()
+    m_Scheduler.define_label('L1', p_capacity)
+    m_Scheduler.define_label_group('G')
+    m_Scheduler.add_group_label('G', 'L1')
+    return m_Scheduler
+
+
+# 资源标签组中的高优先级作业优先于资源标签自己队列中的低优先级作业
+def test_claim_many_priority_across_queues():
+    m_Scheduler = group_scheduler(1)
+    m_Scheduler.push('L1', [1], 0, 'alice', 1)
+    m_Scheduler.push('G', [2], 10, 'bob', 2)
+    assert m_Scheduler.claim_many(['L1'], 2) == [('G', 'L1', 2)]
+    assert m_Scheduler.claimed[2][:3] == (10, 'bob', 2)
+    m_Scheduler.release(2)
+    assert m_Scheduler.claim() == ('L1', 'L1', 1)
+
+
+# 优先级相同时资源标签的队列和资源标签组的队列轮流派发
+def test_claim_many_same_priority_alternates():
+    m_Scheduler = group_scheduler(4)
+    m_Scheduler.push('L1', [1, 2, 3], 0, 'alice', 1)
+    m_Scheduler.push('G', [4, 5, 6], 0, 'bob', 2)
+    assert m_Scheduler.claim_many(None, 4) == [('L1', 'L1', 1), ('G', 'L1', 4), ('L1', 'L1', 2), ('G', 'L1', 5)]
+
+
+# 重建的正在运行的作业占用容量，被放回队列时回到原来的优先级
+def test_load_jobs_keeps_running_info():
+    m_Scheduler = group_scheduler(1)
+    m_Scheduler.load_jobs([('L1', 2, 0, 'bob', 2, None, None)], [('L1', 1, 10, 'alice', 1, None, None)])
+    assert m_Scheduler.claim() is None
+    m_Scheduler.unclaim('L1', 1)
+    assert m_Scheduler.claim() == ('L1', 'L1', 1)
+
+
+# 没有心跳的租约在心跳期限到期，到达最终期限的租约标记出来
+def test_lease_table_expiry():
+    m_Leases = LeaseTable(0.05)
+    m_Leases.grant(1, ('hostA', '1'), 10, 0.05)
+    m_Leases.grant(2, ('hostA', '1'), 0.05)
+    assert sorted(m_Leases.wait_expired(5)) == [(1, False), (2, True)]
+    assert m_Leases.count() == 0
+
+
+# 心跳延长租约，其他Worker的心跳和取消不影响租约
+def test_lease_table_renew_and_owner():
+    m_Leases = LeaseTable(0.3)
+    m_Leases.grant(1, ('hostA', '1'), 10, 0.1)
+    assert m_Leases.renew([1], ('hostA', '1')) == []
+    assert m_Leases.renew([1], ('hostB', '2')) == [1]
+    assert m_Leases.wait_expired(0.15) == []
+    m_Leases.drop(1, ('hostB', '2'))
+    assert m_Leases.count() == 1
+    m_Leases.drop(1, ('hostA', '1'))
+    assert m_Leases.count() == 0
+    assert m_Leases.wait_expired(0.4) == []
+    m_Leases.close()
+    assert m_Leases.wait_expired() is None
+
+
+# 关键路径长度是作业自己的运行时间加上依赖它的作业中最长的关键路径
+def test_critical_path():
+    m_Estimates = {'setup': 10.0, 'a': 5.0, 'b': 20.0, 'cleanup': 1.0, 'other': 3.0}
+    m_Edges = [('a', 'setup'), ('b', 'setup'), ('cleanup', 'a'), ('cleanup', 'b'), ('a', 'missing')]
+    assert critical_path(m_Estimates, m_Edges) == {'setup': 31.0, 'a': 6.0, 'b': 21.0, 'cleanup': 1.0, 'other': 3.0}
+    assert critical_path(m_Estimates, []) == m_Estimates
+    assert critical_path({'a': 1.0, 'b': 1.0}, [('a', 'b'), ('b', 'a')]) is None
+
+
+# 前置作业全部完成时释放作业，回滚时恢复
+def test_dependency_graph_release_and_undo():
+    m_Graph = DependencyGraph()
+    m_Graph.add([(3, 1), (3, 2), (4, 1)], {3: 7.0, 4: 2.0})
+    assert m_Graph.blocked_count() == 2
+    m_Dependents, m_Released = m_Graph.finish(1)
+    assert m_Dependents == [3, 4] and m_Released == {4: 2.0}
+    m_Graph.undo(1, m_Dependents, m_Released)
+    assert m_Graph.blocked_count() == 2
+    assert m_Graph.finish(1)[1] == {4: 2.0}
+    assert m_Graph.finish(2) == ([3], {3: 7.0})
+    assert m_Graph.finish(5) == ([], {})
+    assert m_Graph.blocked_count() == 0
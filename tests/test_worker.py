@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Worker结束超时的作业
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from farm import worker
+from farm.worker import EXIT_TIMEOUT, INCOMPLETE_FILE, JobContext, WorkerDaemon, descendant_pids, run_job
+from farm.workspace import Workspace
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'killpg') or not os.path.isdir('/proc'),
+                                reason='needs process groups and /proc')
+
+
+def alive(p_pid):
+    try:
+        with open('/proc/' + str(p_pid) + '/stat', 'rb') as f:
+            return f.read().rsplit(b')', 1)[1].split()[0] != b'Z'
+    except OSError:
+        return False
+
+
+# 忽略SIGTERM的作业进程，它启动的进程在自己的会话中运行
+def stubborn_job():
+    m_Process = subprocess.Popen([sys.executable, '-c',
+                                  'import signal, subprocess, sys, time\n'
+                                  'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+                                  'subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"], '
+                                  'start_new_session=True)\n'
+                                  'time.sleep(60)\n'], start_new_session=True)
+    m_Deadline = time.monotonic() + 10
+    while not descendant_pids(m_Process.pid) and time.monotonic() < m_Deadline:
+        time.sleep(0.05)
+    return m_Process
+
+
+# 常驻Worker先发送SIGTERM，不等待；KILL_GRACE秒以后还没有结束的进程在enforce_limits中发送SIGKILL
+def test_daemon_kill_escalates(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, 'KILL_GRACE', 0.5)
+    m_Daemon = WorkerDaemon(None, None, 1, str(tmp_path / 'work'), str(tmp_path / 'backup'))
+    m_Process = stubborn_job()
+    m_Pids = descendant_pids(m_Process.pid)
+    assert m_Pids
+    m_Start = time.monotonic()
+    m_Daemon.kill_job(m_Process)
+    assert time.monotonic() - m_Start < 0.5
+    # 子进程收到SIGTERM已经结束，作业进程忽略了SIGTERM
+    m_Daemon.enforce_limits()
+    assert alive(m_Process.pid) and len(m_Daemon.kills) == 1
+    m_Deadline = time.monotonic() + 10
+    while m_Daemon.kills and time.monotonic() < m_Deadline:
+        time.sleep(0.1)
+        m_Daemon.enforce_limits()
+    m_Process.wait(5)
+    assert m_Daemon.kills == []
+    assert not any(alive(m_Pid) for m_Pid in m_Pids)
+
+
+# 在T_SRCHOME下准备一个回归测试，PATH上的robot启动一个在自己的会话中运行的进程，然后一直等待
+def timeout_job(p_tmp_path, p_monkeypatch):
+    os.makedirs(str(p_tmp_path / 'src' / 'r1'))
+    (p_tmp_path / 'src' / 'r1' / 'main.robot').write_text('*** Test Cases ***\n')
+    m_Bin = p_tmp_path / 'bin'
+    m_Bin.mkdir()
+    m_Robot = m_Bin / 'robot'
+    m_Robot.write_text('#!' + sys.executable + '\n'
+                       'import subprocess, sys, time\n'
+                       'm_Child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"], '
+                       'start_new_session=True)\n'
+                       'open("child.pid", "w").write(str(m_Child.pid))\n'
+                       'time.sleep(60)\n')
+    m_Robot.chmod(m_Robot.stat().st_mode | stat.S_IEXEC)
+    p_monkeypatch.setenv('PATH', str(m_Bin) + os.pathsep + os.environ['PATH'])
+    p_monkeypatch.setenv('T_SRCHOME', str(p_tmp_path / 'src'))
+    m_Job = {'ID': 1, 'REGRESS_NAME': 'r1', 'PROPERTIES': '', 'REGRESS_OPTIONS': '',
+             'MAIN_ENTRY': 'main.robot', 'REGRESS_TYPE': 'RF', 'LIMIT_TIME': 1}
+    return JobContext(m_Job, str(p_tmp_path / 'work'))
+
+
+# 超过LIMIT_TIME时结束robot和它启动的进程，作业标记为超时，日志照常暂存
+def test_run_job_timeout_kills_process_group(tmp_path, monkeypatch):
+    m_Context = timeout_job(tmp_path, monkeypatch)
+    m_Staging = run_job(m_Context)
+    assert m_Context.timed_out
+    assert os.path.exists(m_Staging + '.json')
+    with open(os.path.join(m_Staging, 'child.pid')) as f:
+        assert not alive(int(f.read()))
+    with open(os.path.join(m_Staging, 'r1.tlg')) as f:
+        assert 'MAX LIMIT TIME EXCEED: 1' in f.read()
+
+
+# 结束进程以后运行测试的线程还没有结束时不暂存，留下INCOMPLETE_FILE，常驻Worker在作业进程退出以后暂存并报告日志不完整
+def test_timeout_logs_incomplete(tmp_path, monkeypatch):
+    m_Context = timeout_job(tmp_path, monkeypatch)
+    m_Running = threading.Event()
+    m_Release = threading.Event()
+
+    def hung_job_thread(p_context, p_test_main_entry, p_in_process):
+        m_Running.set()
+        m_Release.wait(10)
+        p_context.log('written after the kill')
+    monkeypatch.setattr(worker, 'run_job_thread', hung_job_thread)
+    monkeypatch.setattr(worker, 'KILL_GRACE', 0.2)
+    try:
+        assert run_job(m_Context) is None
+    finally:
+        m_Release.set()
+    assert m_Running.is_set() and m_Context.timed_out
+    assert os.path.exists(m_Context.path(INCOMPLETE_FILE))
+
+    # 超时退出的作业进程，它的进程组已经不存在
+    m_Exited = subprocess.Popen([sys.executable, '-c', ''], start_new_session=True)
+    m_Exited.wait()
+
+    class ExitedProcess(object):
+        pid = m_Exited.pid
+        exitcode = EXIT_TIMEOUT
+
+        def is_alive(self):
+            return False
+
+        def join(self):
+            pass
+    m_Daemon = WorkerDaemon(None, None, 1, str(tmp_path / 'work'), str(tmp_path / 'backup'))
+    monkeypatch.setattr(m_Daemon, 'slot_directory', lambda p_slot: m_Context.work_directory)
+    m_Daemon.slots[0] = (m_Context.job, ExitedProcess())
+    m_Daemon.reap()
+    assert m_Daemon.finished == [(1, 'TIMEOUT', 'MAX LIMIT TIME EXCEED: 1, logs incomplete.', None, None)]
+    m_Staging = Workspace(m_Context.work_directory).staging_directory(1)
+    assert os.path.exists(os.path.join(m_Staging, INCOMPLETE_FILE))
+    assert m_Daemon.backup.queue.get_nowait() == (1, m_Staging)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# 工作目录按照清单增量同步，作业结束以后暂存需要备份的内容
+import json
+import os
+
+import pytest
+
+from farm.workspace import Workspace
+
+
+def write(p_path, p_text, p_mtime_ns=None):
+    os.makedirs(os.path.dirname(str(p_path)), exist_ok=True)
+    with open(str(p_path), 'w') as f:
+        f.write(p_text)
+    if p_mtime_ns is not None:
+        os.utime(str(p_path), ns=(p_mtime_ns, p_mtime_ns))
+
+
+def read(p_path):
+    with open(str(p_path)) as f:
+        return f.read()
+
+
+@pytest.fixture
+def source(tmp_path):
+    m_Source = tmp_path / 'src'
+    write(m_Source / 'main.robot', 'main')
+    write(m_Source / 'lib' / 'keywords.robot', 'keywords')
+    write(m_Source / 'lib' / 'old.robot', 'old')
+    return m_Source
+
+
+# 第一次同步复制所有文件，源文件没有变化时不再复制
+def test_sync_unchanged(tmp_path, source):
+    m_Workspace = Workspace(str(tmp_path / 'work'))
+    assert m_Workspace.sync(str(source))['Copied'] == 3
+    m_Stats = m_Workspace.sync(str(source))
+    assert (m_Stats['Copied'], m_Stats['Unchanged'], m_Stats['Removed']) == (0, 3, 0)
+
+
+# 修改过的源文件重新复制，只是修改时间变了的不复制，源目录中删除的文件和作业的输出都被删除
+def test_sync_changed_and_removed(tmp_path, source):
+    m_Work = tmp_path / 'work'
+    m_Workspace = Workspace(str(m_Work))
+    m_Workspace.sync(str(source))
+    write(source / 'main.robot', 'main v2')
+    write(source / 'lib' / 'keywords.robot', 'keywords', 10 ** 18)
+    os.remove(str(source / 'lib' / 'old.robot'))
+    write(m_Work / 'output.xml', '<robot/>')
+    m_Stats = m_Workspace.sync(str(source))
+    assert (m_Stats['Copied'], m_Stats['Unchanged'], m_Stats['Removed']) == (1, 1, 2)
+    assert read(m_Work / 'main.robot') == 'main v2'
+    assert sorted(os.listdir(str(m_Work / 'lib'))) == ['keywords.robot']
+    assert not os.path.exists(str(m_Work / 'output.xml'))
+    # 修改时间的变化已经记录下来，下次不需要再比较内容
+    assert m_Workspace.sync(str(source))['Unchanged'] == 2
+
+
+# 作业修改了工作目录中的文件，下次同步时重新复制
+def test_sync_restores_modified_work_file(tmp_path, source):
+    m_Work = tmp_path / 'work'
+    m_Workspace = Workspace(str(m_Work))
+    m_Workspace.sync(str(source))
+    write(m_Work / 'main.robot', 'changed by the job')
+    assert m_Workspace.sync(str(source))['Copied'] == 1
+    assert read(m_Work / 'main.robot') == 'main'
+
+
+# 暂存时作业新产生的和修改过的文件移到暂存目录，没有变化的测试文件只记录在索引文件中
+def test_stage(tmp_path, source):
+    m_Work = tmp_path / 'work'
+    m_Workspace = Workspace(str(m_Work))
+    m_Workspace.sync(str(source))
+    write(m_Work / 'output.xml', '<robot/>')
+    write(m_Work / 'lib' / 'keywords.robot', 'changed by the job')
+    m_Staging = m_Workspace.stage(7)
+    assert m_Staging == m_Workspace.staging_directory(7)
+    assert read(os.path.join(m_Staging, 'output.xml')) == '<robot/>'
+    assert read(os.path.join(m_Staging, 'lib', 'keywords.robot')) == 'changed by the job'
+    assert not os.path.exists(str(m_Work / 'output.xml'))
+    with open(m_Staging + '.json') as f:
+        m_Shared = json.load(f)
+    assert sorted(m_Shared) == [os.path.join('lib', 'old.robot'), 'main.robot']
+    assert m_Shared['main.robot'][0] == os.path.join(str(source), 'main.robot')
+    assert os.path.exists(str(m_Work / 'main.robot'))
+    # 暂存目录不受同步的影响，移走的文件下次同步时重新复制
+    m_Stats = m_Workspace.sync(str(source))
+    assert (m_Stats['Copied'], m_Stats['Removed']) == (1, 0)
+    assert os.path.exists(m_Staging + '.json')
+
+
+# 源目录变了以后清单不能再用，所有文件重新复制
+def test_sync_other_source(tmp_path, source):
+    m_Other = tmp_path / 'other'
+    write(m_Other / 'main.robot', 'main')
+    m_Workspace = Workspace(str(tmp_path / 'work'))
+    m_Workspace.sync(str(source))
+    m_Stats = m_Workspace.sync(str(m_Other))
+    # 整个目录删除时只算一次
+    assert (m_Stats['Copied'], m_Stats['Removed']) == (1, 1)
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Workspace(str(tmp_path / 'work'), 'symlink')